@@ -0,0 +1,130 @@
+"""
+Estadísticas pre-agregadas para /api/stats.
+
+interaction_logger llama a `actualizar_rollups` dentro de la misma transacción
+en la que inserta cada lote, así que las tablas daily_call_stats y
+question_stats siempre cuadran con las filas crudas. `/api/stats` solo lee
+esas tablas (una fila por día y un top-N indexado), sin recorrer calls ni
+interactions.
+"""
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import select
+from sqlalchemy.dialects import postgresql, sqlite
+
+import models
+from text_normalization import normalizar_texto
+
+# Evento (interaction_logger.log_event) -> columna de daily_call_stats
+EVENTOS = {
+    "tts_play": "tts_play",
+    "tts_say": "tts_say",
+    "asr_retry": "asr_retries",
+    "asr_failure": "asr_failures",
+}
+COLUMNAS_DIA = ("calls", "turns") + tuple(EVENTOS.values())
+
+# Las preguntas más largas se agrupan por su inicio
+MAX_QUESTION_KEY = 200
+
+
+def _dia(ts: float) -> date:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).date()
+
+
+def insert_dialecto(db, tabla):
+    """INSERT con ON CONFLICT del dialecto en uso (Postgres o SQLite)"""
+    dialecto = postgresql if db.bind.dialect.name == "postgresql" else sqlite
+    return dialecto.insert(tabla)
+
+
+async def actualizar_rollups(db, registros: list[dict]):
+    """Suma un lote de registros del logger a las tablas de estadísticas"""
+    por_dia: dict[date, Counter] = defaultdict(Counter)
+    preguntas: dict[str, dict] = {}
+
+    for r in registros:
+        contadores = por_dia[_dia(r["ts"])]
+        if r["tipo"] == "call":
+            contadores["calls"] += 1
+        elif r["tipo"] == "interaction":
+            contadores["turns"] += 1
+            clave = normalizar_texto(r["user_text"] or "")[:MAX_QUESTION_KEY]
+            if clave:
+                pregunta = preguntas.setdefault(clave, {"count": 0, "ts": 0.0})
+                pregunta["count"] += 1
+                if r["ts"] >= pregunta["ts"]:
+                    pregunta["ts"] = r["ts"]
+                    pregunta["example"] = r["user_text"]
+        elif r["tipo"] == "event" and r["nombre"] in EVENTOS:
+            contadores[EVENTOS[r["nombre"]]] += 1
+
+    tabla = models.DailyCallStats.__table__
+    for dia, contadores in por_dia.items():
+        valores = {col: contadores.get(col, 0) for col in COLUMNAS_DIA}
+        stmt = insert_dialecto(db, tabla).values(day=dia, **valores)
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["day"],
+            set_={col: tabla.c[col] + stmt.excluded[col] for col in valores},
+        ))
+
+    tabla = models.QuestionStats.__table__
+    for clave, pregunta in preguntas.items():
+        stmt = insert_dialecto(db, tabla).values(
+            question_key=clave,
+            example=pregunta["example"],
+            count=pregunta["count"],
+            last_asked=datetime.fromtimestamp(pregunta["ts"], tz=timezone.utc),
+        )
+        await db.execute(stmt.on_conflict_do_update(
+            index_elements=["question_key"],
+            set_={
+                "count": tabla.c.count + stmt.excluded.count,
+                "example": stmt.excluded.example,
+                "last_asked": stmt.excluded.last_asked,
+            },
+        ))
+
+
+def _tasa(parte: int, total: int) -> float:
+    return round(parte / total, 4) if total else 0.0
+
+
+async def resumen_estadisticas(db, days: int = 30, top: int = 10) -> dict:
+    """KPIs de los últimos `days` días a partir de las tablas de rollup"""
+    desde = datetime.now(timezone.utc).date() - timedelta(days=days - 1)
+    result = await db.execute(
+        select(models.DailyCallStats)
+        .where(models.DailyCallStats.day >= desde)
+        .order_by(models.DailyCallStats.day)
+    )
+    dias = result.scalars().all()
+
+    totales = Counter()
+    for dia in dias:
+        for col in COLUMNAS_DIA:
+            totales[col] += getattr(dia, col)
+
+    result = await db.execute(
+        select(models.QuestionStats.example, models.QuestionStats.count, models.QuestionStats.last_asked)
+        .order_by(models.QuestionStats.count.desc())
+        .limit(top)
+    )
+
+    return {
+        "since": desde.isoformat(),
+        "calls": totales["calls"],
+        "turns": totales["turns"],
+        "avg_turns_per_call": round(totales["turns"] / totales["calls"], 2) if totales["calls"] else 0.0,
+        # Audios servidos con <Say> de Twilio porque ElevenLabs no respondió
+        "tts_fallback_rate": _tasa(totales["tts_say"], totales["tts_play"] + totales["tts_say"]),
+        # Reintentos de reconocimiento por cada intento de turno
+        "asr_retry_rate": _tasa(totales["asr_retries"], totales["turns"] + totales["asr_retries"]),
+        "asr_failures": totales["asr_failures"],
+        "calls_per_day": [{"day": dia.day.isoformat(), "calls": dia.calls, "turns": dia.turns} for dia in dias],
+        "top_questions": [
+            {"question": example, "count": count, "last_asked": last_asked}
+            for example, count, last_asked in result.all()
+        ],
+    }
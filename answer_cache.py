@@ -0,0 +1,131 @@
+"""
+Cache semántico de respuestas delante de Gemini.
+
+La clave es el embedding de la consulta que ya se calcula para el RAG: si una
+pregunta nueva queda a menos de `max_distance` (distancia coseno) de una ya
+respondida, se devuelve la respuesta guardada sin pasar por la recuperación
+ni Gemini. El audio no se guarda aquí: se pide a audio_cache por el texto,
+que sabe si el MP3 sigue en disco.
+"""
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    embedding: np.ndarray
+    created_at: float
+    hits: int = 0
+
+
+class SemanticAnswerCache:
+    """Cache LRU con TTL indexado por similitud coseno de embeddings"""
+
+    def __init__(self, max_entries: int = 500, ttl: float = 21600, max_distance: float = 0.08):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._matrix: Optional[np.ndarray] = None
+        self._matrix_ids: list[int] = []
+        self._kb_version: Optional[str] = None
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalizar(embedding) -> np.ndarray:
+        vec = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vec)
+        return vec / norm if norm else vec
+
+    def _indice(self) -> np.ndarray:
+        """Matriz (n, dim) de embeddings normalizados; se reconstruye solo tras cambios"""
+        if self._matrix is None:
+            self._matrix_ids = list(self._entries.keys())
+            self._matrix = np.stack([self._entries[i].embedding for i in self._matrix_ids])
+        return self._matrix
+
+    def _descartar(self, entry_id: int):
+        self._entries.pop(entry_id, None)
+        self._matrix = None
+
+    def sync_version(self, kb_version: str):
+        """Vacía el cache si la base de conocimiento se re-vectorizó"""
+        if self._kb_version is not None and kb_version != self._kb_version:
+            self.invalidate()
+        self._kb_version = kb_version
+
+    def invalidate(self):
+        self._entries.clear()
+        self._matrix = None
+        self.invalidations += 1
+        print("🧹 Cache de respuestas invalidado")
+
+    def lookup(self, embedding) -> Optional[CachedAnswer]:
+        """Devuelve la respuesta más cercana si está dentro de la distancia configurada"""
+        # Descartar las expiradas antes de buscar: una vencida no debe tapar
+        # a otra vigente que también esté dentro de la distancia
+        limite = time.time() - self.ttl
+        for entry_id in [i for i, e in self._entries.items() if e.created_at < limite]:
+            self._descartar(entry_id)
+
+        if not self._entries:
+            self.misses += 1
+            return None
+
+        query = self._normalizar(embedding)
+        similitudes = self._indice() @ query
+        mejor = int(np.argmax(similitudes))
+        entry_id = self._matrix_ids[mejor]
+        entry = self._entries[entry_id]
+
+        if 1.0 - float(similitudes[mejor]) > self.max_distance:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(entry_id)
+        entry.hits += 1
+        self.hits += 1
+        return entry
+
+    def store(self, embedding, question: str, answer: str):
+        entry = CachedAnswer(
+            question=question,
+            answer=answer,
+            embedding=self._normalizar(embedding),
+            created_at=time.time(),
+        )
+        self._entries[self._next_id] = entry
+        self._next_id += 1
+        self._matrix = None
+
+        # Evicción LRU
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "invalidations": self.invalidations,
+            "max_distance": self.max_distance,
+        }
+
+
+answer_cache = SemanticAnswerCache(
+    max_entries=int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500")),
+    ttl=float(os.getenv("ANSWER_CACHE_TTL", "21600")),
+    max_distance=float(os.getenv("ANSWER_CACHE_MAX_DISTANCE", "0.08")),
+)
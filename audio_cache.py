@@ -0,0 +1,226 @@
+"""
+Cache de audios TTS en dos niveles.
+
+- Memoria: hash del texto -> URL pública, acotado por número de entradas con
+  desalojo LRU. Solo guarda URLs (el audio está en disco), así que el
+  presupuesto en bytes se aplica al nivel de disco.
+- Disco: archivos {hash}.mp3 en AUDIO_DIR con un índice en memoria de tamaño
+  y último acceso. El directorio se escanea una sola vez al arrancar; a partir
+  de ahí el presupuesto de bytes y la expiración se aplican sobre el índice.
+
+Los mensajes fijados (COMMON_MESSAGES) nunca se desalojan. La limpieza
+periódica corre en una tarea de fondo (`janitor`), fuera del camino de la llamada.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+AUDIO_DIR = os.getenv("AUDIO_DIR", "audio_files")
+
+
+def hash_texto(texto: str) -> str:
+    """Clave del cache: md5 del texto (también es el nombre del archivo)"""
+    return hashlib.md5(texto.encode()).hexdigest()
+
+
+@dataclass
+class DiskEntry:
+    size: int
+    last_access: float
+
+
+class AudioCache:
+    def __init__(
+        self,
+        directory: str,
+        max_memory_entries: int = 1000,
+        max_disk_bytes: int = 500_000_000,
+        max_age: float = 86400,
+    ):
+        self.directory = directory
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.max_age = max_age
+
+        self._memory: "OrderedDict[str, str]" = OrderedDict()
+        self._disk: "OrderedDict[str, DiskEntry]" = OrderedDict()
+        self._disk_bytes = 0
+        self._pinned: set[str] = set()
+        self._lock = threading.Lock()
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def filepath(self, texto_hash: str) -> str:
+        return os.path.join(self.directory, f"{texto_hash}.mp3")
+
+    # --- Memoria -----------------------------------------------------------
+
+    def get_url(self, texto_hash: str) -> Optional[str]:
+        with self._lock:
+            url = self._memory.get(texto_hash)
+            if url is None:
+                return None
+            self._memory.move_to_end(texto_hash)
+            self.memory_hits += 1
+            self._touch(texto_hash)
+            return url
+
+    def put_url(self, texto_hash: str, url: str):
+        with self._lock:
+            self._memory.pop(texto_hash, None)
+            self._memory[texto_hash] = url
+
+            while len(self._memory) > self.max_memory_entries:
+                victima = next((h for h in self._memory if h not in self._pinned), None)
+                if victima is None:
+                    break
+                del self._memory[victima]
+
+    # --- Disco -------------------------------------------------------------
+
+    def _touch(self, texto_hash: str):
+        entry = self._disk.get(texto_hash)
+        if entry is not None:
+            entry.last_access = time.time()
+            self._disk.move_to_end(texto_hash)
+
+    def on_disk(self, texto_hash: str) -> bool:
+        """Consulta el índice (sin tocar el sistema de archivos)"""
+        with self._lock:
+            if texto_hash in self._disk:
+                self._touch(texto_hash)
+                self.disk_hits += 1
+                return True
+            self.misses += 1
+            return False
+
+    def refrescar(self, texto_hash: str) -> bool:
+        """Como on_disk, pero sin contar acierto/fallo (pre-warming).
+
+        Renueva el último acceso para que la limpieza por edad no borre un
+        audio que el pre-warming eligió conservar.
+        """
+        with self._lock:
+            if texto_hash not in self._disk:
+                return False
+            self._touch(texto_hash)
+            return True
+
+    def register_file(self, texto_hash: str, size: int):
+        """Registra un archivo recién escrito y aplica el presupuesto de disco"""
+        with self._lock:
+            anterior = self._disk.pop(texto_hash, None)
+            if anterior is not None:
+                self._disk_bytes -= anterior.size
+            self._disk[texto_hash] = DiskEntry(size=size, last_access=time.time())
+            self._disk_bytes += size
+            victimas = self._victimas_por_presupuesto()
+        self._borrar(victimas)
+
+    def _victimas_por_presupuesto(self) -> list[str]:
+        """Elige (y saca del índice) archivos LRU hasta quedar bajo el presupuesto"""
+        victimas = []
+        for texto_hash in list(self._disk.keys()):
+            if self._disk_bytes <= self.max_disk_bytes:
+                break
+            if texto_hash in self._pinned:
+                continue
+            victimas.append(texto_hash)
+            self._sacar(texto_hash)
+        return victimas
+
+    def _sacar(self, texto_hash: str):
+        entry = self._disk.pop(texto_hash)
+        self._disk_bytes -= entry.size
+        self._memory.pop(texto_hash, None)
+        self.evictions += 1
+
+    def _borrar(self, hashes: list[str]):
+        for texto_hash in hashes:
+            try:
+                os.unlink(self.filepath(texto_hash))
+            except FileNotFoundError:
+                pass
+            except Exception as e:
+                print(f"⚠️ Error borrando audio {texto_hash}: {e}")
+
+    def pin(self, texto_hash: str):
+        with self._lock:
+            self._pinned.add(texto_hash)
+
+    def scan(self):
+        """Construye el índice de disco (única lectura completa del directorio)"""
+        os.makedirs(self.directory, exist_ok=True)
+        ahora = time.time()
+        encontrados = []
+        with os.scandir(self.directory) as it:
+            for item in it:
+                if not item.is_file():
+                    continue
+                stat = item.stat()
+                if item.name.endswith(".mp3"):
+                    encontrados.append((item.name[:-4], stat.st_size, stat.st_mtime))
+                elif ahora - stat.st_mtime > 3600:
+                    # Temporales de escrituras interrumpidas
+                    os.unlink(item.path)
+
+        with self._lock:
+            self._disk.clear()
+            self._disk_bytes = 0
+            for texto_hash, size, mtime in sorted(encontrados, key=lambda e: e[2]):
+                self._disk[texto_hash] = DiskEntry(size=size, last_access=mtime)
+                self._disk_bytes += size
+            victimas = self._victimas_por_presupuesto()
+        self._borrar(victimas)
+        print(f"✅ Cache de audio: {len(self._disk)} archivos, {self._disk_bytes / 1e6:.1f} MB")
+
+    def cleanup(self):
+        """Elimina audios no fijados sin acceso en `max_age` segundos"""
+        limite = time.time() - self.max_age
+        with self._lock:
+            expirados = [
+                h for h, entry in self._disk.items()
+                if entry.last_access < limite and h not in self._pinned
+            ]
+            for texto_hash in expirados:
+                self._sacar(texto_hash)
+        self._borrar(expirados)
+        if expirados:
+            print(f"🧹 Cache de audio: {len(expirados)} archivos expirados eliminados")
+
+    async def janitor(self, interval: float):
+        """Tarea de fondo: limpieza periódica fuera del camino de las llamadas"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await asyncio.to_thread(self.cleanup)
+            except Exception as e:
+                print(f"⚠️ Error limpiando archivos: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "memory_entries": len(self._memory),
+            "disk_files": len(self._disk),
+            "disk_bytes": self._disk_bytes,
+            "pinned": len(self._pinned),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+audio_cache = AudioCache(
+    AUDIO_DIR,
+    max_memory_entries=int(os.getenv("AUDIO_CACHE_MAX_ENTRIES", "1000")),
+    max_disk_bytes=int(os.getenv("AUDIO_CACHE_MAX_DISK_BYTES", "500000000")),
+    max_age=float(os.getenv("AUDIO_CACHE_MAX_AGE", "86400")),
+)
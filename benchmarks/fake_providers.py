@@ -0,0 +1,214 @@
+"""
+Servidor local que imita las APIs de Gemini (generativelanguage) y ElevenLabs.
+
+Responde con los mismos formatos JSON/bytes que las APIs reales, así que el
+código de producción (SDK google-generativeai con transporte REST y SDK de
+ElevenLabs) corre sin cambios: pool de conexiones, streaming de audio y
+manejo de errores incluidos. Solo hay que apuntar los clientes aquí:
+
+    python -m benchmarks.fake_providers --port 8100 --quota-rate 0.02
+    GEMINI_BASE_URL=http://127.0.0.1:8100 ELEVENLABS_BASE_URL=http://127.0.0.1:8100 \\
+        uvicorn main:app --port 8001
+
+Endpoints:
+    POST /v1beta/models/{model}:generateContent
+    POST /v1beta/models/{model}:streamGenerateContent   (?alt=sse)
+    POST /v1beta/models/{model}:embedContent
+    POST /v1beta/models/{model}:batchEmbedContents
+    POST /v1/text-to-speech/{voice_id}                  (audio/mpeg en chunks)
+    POST /v1/text-to-speech/{voice_id}/stream
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+from dataclasses import dataclass, field
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from benchmarks.stubs import LATENCIAS_POR_DEFECTO, Latencia, embedding_falso
+
+RESPUESTA = "ORISOD Enzyme es un antioxidante natural a base de extractos de romero y olivo."
+
+
+@dataclass
+class Config:
+    gemini: Latencia = field(default_factory=lambda: Latencia.parse(LATENCIAS_POR_DEFECTO["gemini"]))
+    embed: Latencia = field(default_factory=lambda: Latencia.parse(LATENCIAS_POR_DEFECTO["embed"]))
+    # Tiempo al primer byte de audio y pausa entre chunks
+    tts: Latencia = field(default_factory=lambda: Latencia.parse(LATENCIAS_POR_DEFECTO["tts"]))
+    tts_chunk_interval: Latencia = field(default_factory=lambda: Latencia.parse("normal:15:5"))
+    tts_chunk_size: int = 4096
+    # Bytes de MP3 por carácter de texto (~128 kbps a ~15 caracteres por segundo)
+    tts_bytes_per_char: int = 1000
+    # Fracción de peticiones que fallan por cuota (429 en Gemini, 401 quota_exceeded en ElevenLabs)
+    quota_rate: float = 0.0
+    # Peticiones TTS simultáneas permitidas por la "cuenta" antes de responder 429
+    tts_max_concurrency: int = 0
+    seed: int = 0
+
+
+def _tokens(texto: str) -> int:
+    return max(1, len(texto) // 4)
+
+
+def _texto_de_contents(body: dict) -> str:
+    return " ".join(
+        part.get("text", "")
+        for content in body.get("contents", [])
+        for part in content.get("parts", [])
+    )
+
+
+def crear_app(config: Config) -> FastAPI:
+    app = FastAPI(title="Proveedores falsos (Gemini + ElevenLabs)")
+    rng = random.Random(config.seed)
+    tts_en_curso = 0
+
+    def _cuota_agotada() -> bool:
+        return config.quota_rate > 0 and rng.random() < config.quota_rate
+
+    def _error_gemini_429() -> JSONResponse:
+        return JSONResponse(status_code=429, content={"error": {
+            "code": 429,
+            "message": "Resource has been exhausted (e.g. check quota).",
+            "status": "RESOURCE_EXHAUSTED",
+        }})
+
+    def _respuesta_generate(prompt: str, texto: str, model: str, final: bool = True) -> dict:
+        candidato = {"content": {"parts": [{"text": texto}], "role": "model"}, "index": 0}
+        if final:
+            candidato["finishReason"] = "STOP"
+        return {
+            "candidates": [candidato],
+            "usageMetadata": {
+                "promptTokenCount": _tokens(prompt),
+                "candidatesTokenCount": _tokens(texto),
+                "totalTokenCount": _tokens(prompt) + _tokens(texto),
+            },
+            "modelVersion": model,
+        }
+
+    # --- Gemini --------------------------------------------------------------
+
+    @app.post("/v1beta/models/{model}:generateContent")
+    async def generate_content(model: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(config.gemini.muestra(rng))
+        if _cuota_agotada():
+            return _error_gemini_429()
+        return _respuesta_generate(_texto_de_contents(body), RESPUESTA, model)
+
+    @app.post("/v1beta/models/{model}:streamGenerateContent")
+    async def stream_generate_content(model: str, request: Request):
+        body = await request.json()
+        if _cuota_agotada():
+            return _error_gemini_429()
+        prompt = _texto_de_contents(body)
+        palabras = RESPUESTA.split(" ")
+        total = config.gemini.muestra(rng)
+
+        async def _eventos():
+            # Primer token tras ~1/3 de la latencia, el resto repartido
+            await asyncio.sleep(total / 3)
+            for i in range(0, len(palabras), 4):
+                final = i + 4 >= len(palabras)
+                texto = " ".join(palabras[i:i + 4]) + ("" if final else " ")
+                yield f"data: {json.dumps(_respuesta_generate(prompt, texto, model, final))}\r\n\r\n"
+                await asyncio.sleep(total * 2 / 3 / max(1, len(palabras) // 4))
+
+        return StreamingResponse(_eventos(), media_type="text/event-stream")
+
+    @app.post("/v1beta/models/{model}:embedContent")
+    async def embed_content(model: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(config.embed.muestra(rng))
+        if _cuota_agotada():
+            return _error_gemini_429()
+        return {"embedding": {"values": embedding_falso(_texto_de_contents({"contents": [body["content"]]}))}}
+
+    @app.post("/v1beta/models/{model}:batchEmbedContents")
+    async def batch_embed_contents(model: str, request: Request):
+        body = await request.json()
+        await asyncio.sleep(config.embed.muestra(rng))
+        if _cuota_agotada():
+            return _error_gemini_429()
+        return {"embeddings": [
+            {"values": embedding_falso(_texto_de_contents({"contents": [req["content"]]}))}
+            for req in body.get("requests", [])
+        ]}
+
+    # --- ElevenLabs ----------------------------------------------------------
+
+    async def _text_to_speech(voice_id: str, request: Request):
+        nonlocal tts_en_curso
+        body = await request.json()
+        if _cuota_agotada():
+            return JSONResponse(status_code=401, content={"detail": {
+                "status": "quota_exceeded",
+                "message": "This request exceeds your quota. You have 0 credits remaining.",
+            }})
+        if config.tts_max_concurrency and tts_en_curso >= config.tts_max_concurrency:
+            return JSONResponse(status_code=429, content={"detail": {
+                "status": "too_many_concurrent_requests",
+                "message": "Too many concurrent requests for your subscription.",
+            }})
+
+        total = max(config.tts_chunk_size, len(body.get("text", "")) * config.tts_bytes_per_char)
+        tts_en_curso += 1
+
+        async def _audio():
+            nonlocal tts_en_curso
+            try:
+                await asyncio.sleep(config.tts.muestra(rng))
+                enviados = 0
+                while enviados < total:
+                    n = min(config.tts_chunk_size, total - enviados)
+                    yield (b"ID3" + os.urandom(n - 3)) if enviados == 0 else os.urandom(n)
+                    enviados += n
+                    await asyncio.sleep(config.tts_chunk_interval.muestra(rng))
+            finally:
+                tts_en_curso -= 1
+
+        return StreamingResponse(_audio(), media_type="audio/mpeg")
+
+    app.post("/v1/text-to-speech/{voice_id}")(_text_to_speech)
+    app.post("/v1/text-to-speech/{voice_id}/stream")(_text_to_speech)
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gemini y ElevenLabs falsos para pruebas de rendimiento")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    for nombre in ("gemini", "embed", "tts"):
+        parser.add_argument(f"--{nombre}", default=LATENCIAS_POR_DEFECTO[nombre],
+                            help=f"Latencia de {nombre} (ver benchmarks/stubs.py)")
+    parser.add_argument("--tts-chunk-interval", default="normal:15:5", help="Pausa entre chunks de audio")
+    parser.add_argument("--tts-chunk-size", type=int, default=4096)
+    parser.add_argument("--tts-max-concurrency", type=int, default=0, help="0 = sin límite")
+    parser.add_argument("--quota-rate", type=float, default=0.0, help="Fracción de errores de cuota")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    config = Config(
+        gemini=Latencia.parse(args.gemini),
+        embed=Latencia.parse(args.embed),
+        tts=Latencia.parse(args.tts),
+        tts_chunk_interval=Latencia.parse(args.tts_chunk_interval),
+        tts_chunk_size=args.tts_chunk_size,
+        quota_rate=args.quota_rate,
+        tts_max_concurrency=args.tts_max_concurrency,
+        seed=args.seed,
+    )
+
+    import uvicorn
+    print(f"⚡ Proveedores falsos en http://{args.host}:{args.port}")
+    uvicorn.run(crear_app(config), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,260 @@
+"""
+Generador de carga sintética de Twilio y reporte de latencias.
+
+Cada llamada simulada hace /inicio, varios turnos /voice con payloads como los
+de Twilio (CallSid, SpeechResult, Confidence, ...) y termina con una
+despedida que cuelga. Las llamadas llegan como proceso de Poisson a la tasa
+indicada (carga abierta: no se espera a que terminen las anteriores).
+
+En proceso (por defecto) importa main con los proveedores sustituidos por
+stubs (benchmarks/stubs.py). Contra un servidor local:
+
+    python -m benchmarks.serve --port 8001
+    python -m benchmarks.load_test --url http://127.0.0.1:8001 --rate 20
+
+Ejemplo en proceso:
+
+    python -m benchmarks.load_test --rate 10 --duration 30 --gemini lognormal:900:0.4
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+import httpx
+import numpy as np
+
+from benchmarks.stubs import LATENCIAS_POR_DEFECTO, Latencia, aplicar_stubs, preparar_entorno
+
+PREGUNTAS = [
+    "¿Qué es ORISOD Enzyme?",
+    "¿Qué beneficios tiene?",
+    "¿Cuánto cuesta?",
+    "¿Cuáles son los ingredientes?",
+    "¿Cómo se toma?",
+    "¿Tiene efectos secundarios?",
+    "¿Dónde lo puedo comprar?",
+    "¿Qué ofreces?",
+    "¿Sirve como antioxidante?",
+    "¿Lo puede tomar un niño?",
+    "¿Cuánto tarda en hacer efecto?",
+    "¿Tiene romero y olivo?",
+]
+DESPEDIDA = "gracias adiós"
+
+
+class Metricas:
+    """Latencias por endpoint y lag del event loop"""
+
+    def __init__(self):
+        self.latencias: dict[str, list[float]] = defaultdict(list)
+        self.errores: dict[str, int] = defaultdict(int)
+        self.lag: list[float] = []
+        self.llamadas_completas = 0
+        # Registros que el servidor debió guardar (calls por /inicio, interactions por turno con voz)
+        self.enviados: dict[str, int] = defaultdict(int)
+
+    def registrar(self, endpoint: str, segundos: float, ok: bool):
+        self.latencias[endpoint].append(segundos)
+        if not ok:
+            self.errores[endpoint] += 1
+
+    async def medir_lag(self, intervalo: float = 0.01):
+        """Retraso con el que despierta un sleep: mide cuánto se bloquea el loop"""
+        while True:
+            inicio = time.perf_counter()
+            await asyncio.sleep(intervalo)
+            self.lag.append(time.perf_counter() - inicio - intervalo)
+
+    def reporte(self, duracion: float) -> dict:
+        endpoints = {}
+        for endpoint, valores in sorted(self.latencias.items()):
+            ms = np.array(valores) * 1000
+            endpoints[endpoint] = {
+                "requests": len(valores),
+                "errors": self.errores[endpoint],
+                "rps": round(len(valores) / duracion, 2),
+                "p50_ms": round(float(np.percentile(ms, 50)), 1),
+                "p95_ms": round(float(np.percentile(ms, 95)), 1),
+                "p99_ms": round(float(np.percentile(ms, 99)), 1),
+                "max_ms": round(float(ms.max()), 1),
+            }
+        lag = np.array(self.lag or [0.0]) * 1000
+        return {
+            "duration_s": round(duracion, 2),
+            "calls_completed": self.llamadas_completas,
+            "calls_per_s": round(self.llamadas_completas / duracion, 2),
+            "endpoints": endpoints,
+            "event_loop_lag_ms": {
+                "p50": round(float(np.percentile(lag, 50)), 2),
+                "p99": round(float(np.percentile(lag, 99)), 2),
+                "max": round(float(lag.max()), 2),
+            },
+        }
+
+
+def imprimir_reporte(reporte: dict):
+    print(f"\n📊 {reporte['calls_completed']} llamadas en {reporte['duration_s']}s "
+          f"({reporte['calls_per_s']} llamadas/s)")
+    print(f"{'endpoint':<10}{'reqs':>7}{'err':>6}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for endpoint, r in reporte["endpoints"].items():
+        print(f"{endpoint:<10}{r['requests']:>7}{r['errors']:>6}{r['rps']:>8}"
+              f"{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}{r['max_ms']:>9}")
+    lag = reporte["event_loop_lag_ms"]
+    print(f"⏱️ Lag del event loop: p50={lag['p50']}ms p99={lag['p99']}ms max={lag['max']}ms")
+    if "db_rows" in reporte:
+        print(f"💾 Guardados: {reporte['db_rows']['calls']} llamadas, {reporte['db_rows']['interactions']} interacciones")
+
+
+def _form_twilio(call_sid: str, telefono: str, **extra) -> dict:
+    return {
+        "CallSid": call_sid,
+        "AccountSid": "AC" + "0" * 32,
+        "From": telefono,
+        "To": "+525500000000",
+        "CallStatus": "in-progress",
+        "Direction": "inbound",
+        "ApiVersion": "2010-04-01",
+        **extra,
+    }
+
+
+async def _post(client: httpx.AsyncClient, metricas: Metricas, endpoint: str, url: str, data: dict) -> bool:
+    inicio = time.perf_counter()
+    try:
+        r = await client.post(url, data=data)
+        ok = r.status_code == 200
+    except httpx.HTTPError:
+        ok = False
+    metricas.registrar(endpoint, time.perf_counter() - inicio, ok)
+    return ok
+
+
+async def simular_llamada(client: httpx.AsyncClient, metricas: Metricas, rng: random.Random, args):
+    call_sid = "CA" + uuid.uuid4().hex
+    telefono = f"+52{rng.randint(2000000000, 9999999999)}"
+    if await _post(client, metricas, "inicio", "/inicio", _form_twilio(call_sid, telefono)):
+        metricas.enviados["calls"] += 1
+
+    for _ in range(rng.randint(args.min_turns, args.max_turns)):
+        await asyncio.sleep(args.think)
+        if rng.random() < args.silence_rate:
+            # Twilio sin SpeechResult: el servidor pide repetir
+            await _post(client, metricas, "voice", "/voice?attempt=1",
+                        _form_twilio(call_sid, telefono, SpeechResult="", Confidence="0.0"))
+            continue
+        form = _form_twilio(call_sid, telefono, SpeechResult=rng.choice(PREGUNTAS),
+                            Confidence=f"{rng.uniform(0.55, 0.97):.2f}")
+        if await _post(client, metricas, "voice", "/voice?attempt=1", form):
+            metricas.enviados["interactions"] += 1
+
+    await asyncio.sleep(args.think)
+    if await _post(client, metricas, "voice", "/voice?attempt=1",
+                   _form_twilio(call_sid, telefono, SpeechResult=DESPEDIDA, Confidence="0.93")):
+        metricas.enviados["interactions"] += 1
+    metricas.llamadas_completas += 1
+
+
+async def generar_carga(client: httpx.AsyncClient, metricas: Metricas, args) -> float:
+    """Llegadas de Poisson durante `duration` segundos; espera a que terminen todas"""
+    rng = random.Random(args.seed)
+    llamadas = []
+    inicio = time.perf_counter()
+    while time.perf_counter() - inicio < args.duration:
+        llamadas.append(asyncio.create_task(simular_llamada(client, metricas, rng, args)))
+        await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*llamadas)
+    return time.perf_counter() - inicio
+
+
+async def ejecutar(args) -> dict:
+    metricas = Metricas()
+    monitor = asyncio.create_task(metricas.medir_lag())
+    limites = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+
+    guardados = None
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url, limits=limites, timeout=30) as client:
+            duracion = await generar_carga(client, metricas, args)
+    else:
+        directorio = preparar_entorno()
+        import main as servidor
+        aplicar_stubs(servidor, _latencias(args), directorio, seed=args.seed)
+        # El lifespan arranca el logger, los caches y las tareas de fondo como en producción
+        async with servidor.lifespan(servidor.app):
+            transport = httpx.ASGITransport(app=servidor.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=30) as client:
+                duracion = await generar_carga(client, metricas, args)
+            _verificar_worker(servidor.interaction_logger)
+        # Al salir del lifespan el logger ya drenó la cola
+        guardados = await _contar_guardados(servidor)
+        _verificar_guardados(metricas.enviados, guardados)
+
+    monitor.cancel()
+    reporte = metricas.reporte(duracion)
+    if guardados is not None:
+        reporte["db_rows"] = guardados
+    return reporte
+
+
+def _verificar_worker(logger):
+    """Si el worker write-behind murió, las latencias de DB del reporte no valen"""
+    worker = logger._worker
+    if worker is None or worker.done():
+        error = worker.exception() if worker is not None and not worker.cancelled() else None
+        raise RuntimeError(f"El worker del interaction_logger no está corriendo: {error!r}")
+
+
+async def _contar_guardados(servidor) -> dict[str, int]:
+    from sqlalchemy import func, select
+
+    async with servidor.AsyncSessionLocal() as db:
+        return {
+            "calls": await db.scalar(select(func.count()).select_from(servidor.models.CallLog)),
+            "interactions": await db.scalar(select(func.count()).select_from(servidor.models.Interaction)),
+        }
+
+
+def _verificar_guardados(enviados: dict[str, int], guardados: dict[str, int]):
+    faltantes = {t: (enviados[t], guardados[t]) for t in ("calls", "interactions") if enviados[t] != guardados[t]}
+    if faltantes:
+        detalle = ", ".join(f"{t}: {e} enviados / {g} en DB" for t, (e, g) in faltantes.items())
+        raise RuntimeError(f"Registros perdidos por el logger ({detalle})")
+
+
+def _latencias(args) -> dict[str, Latencia]:
+    return {nombre: Latencia.parse(getattr(args, nombre)) for nombre in LATENCIAS_POR_DEFECTO}
+
+
+def agregar_argumentos_latencia(parser: argparse.ArgumentParser):
+    for nombre, defecto in LATENCIAS_POR_DEFECTO.items():
+        parser.add_argument(f"--{nombre}", default=defecto, help=f"Latencia simulada de {nombre} (default {defecto})")
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Carga sintética de llamadas Twilio")
+    parser.add_argument("--url", help="Servidor a probar (por defecto: main en proceso con stubs)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Llamadas nuevas por segundo")
+    parser.add_argument("--duration", type=float, default=20.0, help="Segundos generando llamadas")
+    parser.add_argument("--min-turns", type=int, default=2)
+    parser.add_argument("--max-turns", type=int, default=5)
+    parser.add_argument("--think", type=float, default=0.0, help="Pausa entre turnos (s)")
+    parser.add_argument("--silence-rate", type=float, default=0.05, help="Fracción de turnos sin voz reconocida")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    agregar_argumentos_latencia(parser)
+    args = parser.parse_args(argv)
+
+    reporte = asyncio.run(ejecutar(args))
+    imprimir_reporte(reporte)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
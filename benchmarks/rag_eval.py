@@ -0,0 +1,213 @@
+"""
+Evaluación offline de la recuperación del RAG (calidad, latencia y tamaño del prompt).
+
+Cada pregunta de benchmarks/rag_eval_set.json lleva las secciones de
+contexto_orisod.txt que deberían recuperarse ("2.1", "3.5", ...). Un chunk
+es relevante si su título empieza con esa sección o con una subsección
+("3" cubre "3.1", "3.2", ...). Para cada estrategia de chunking, backend y
+top_k se reporta:
+
+    recall@k    fracción de las secciones esperadas que aparecen en el top k
+    hit@k       preguntas con al menos una sección esperada en el top k
+    MRR         1 / posición del primer chunk relevante
+    latencia    p50/p95 de retriever.search (sin el embedding de la consulta)
+    tokens      tamaño del contexto que se enviaría a Gemini (media y p95)
+
+Los embeddings se piden a Gemini (respeta GEMINI_BASE_URL) y se guardan en
+un .npz, así que las corridas siguientes no usan red. Con --fake-embeddings
+se usan vectores deterministas (útil solo para medir latencia):
+
+    python -m benchmarks.rag_eval --backends bm25,numpy,hybrid --top-k 1,2,3,5
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+import time
+from typing import Optional
+
+import numpy as np
+
+from chunking import ESTRATEGIAS, estimar_tokens
+from retrieval import BM25Retriever, HybridRetriever, NumpyRetriever, guardar_indice_numpy
+
+EVAL_SET_PATH = os.path.join(os.path.dirname(__file__), "rag_eval_set.json")
+EMBEDDINGS_PATH = os.path.join(os.path.dirname(__file__), "rag_eval_embeddings.npz")
+BACKENDS = ("bm25", "numpy", "hybrid")
+
+
+def seccion_de(titulo: str) -> str:
+    """Número de sección al inicio del título ("3.5 Metabolismo..." -> "3.5")"""
+    primero = titulo.split(maxsplit=1)[0] if titulo.strip() else ""
+    return primero.rstrip(".")
+
+
+def es_relevante(chunk: dict, secciones: list[str]) -> bool:
+    seccion = chunk.get("section") or seccion_de(chunk["title"])
+    return any(seccion == s or seccion.startswith(s + ".") for s in secciones)
+
+
+class Embeddings:
+    """Embeddings de Gemini con cache en disco por (task_type, texto)"""
+
+    def __init__(self, path: str = EMBEDDINGS_PATH, fake: bool = False):
+        self.path = path
+        self.fake = fake
+        self.vectores: dict[str, np.ndarray] = {}
+        self.nuevos = 0
+        if not fake and os.path.exists(path):
+            with np.load(path) as datos:
+                self.vectores = {clave: datos[clave] for clave in datos.files}
+
+    @staticmethod
+    def _clave(texto: str, task_type: str) -> str:
+        return hashlib.sha256(f"{task_type}\n{texto}".encode()).hexdigest()
+
+    def obtener(self, texto: str, task_type: str) -> list[float]:
+        if self.fake:
+            from benchmarks.stubs import embedding_falso
+            return embedding_falso(texto)
+        clave = self._clave(texto, task_type)
+        if clave not in self.vectores:
+            import google.generativeai as genai
+            from llm_client import EMBEDDING_MODEL, configurar_gemini
+
+            if not self.nuevos:
+                configurar_gemini()
+            result = genai.embed_content(model=EMBEDDING_MODEL, content=texto, task_type=task_type)
+            self.vectores[clave] = np.asarray(result["embedding"], dtype=np.float32)
+            self.nuevos += 1
+        return self.vectores[clave].tolist()
+
+    def guardar(self):
+        if self.fake or not self.nuevos:
+            return
+        tmp = self.path + ".tmp.npz"
+        np.savez(tmp, **self.vectores)
+        os.replace(tmp, self.path)
+        print(f"💾 {self.nuevos} embeddings nuevos guardados en {self.path}")
+
+
+def construir_retrievers(chunks: list[dict], backends: list[str], embeddings: Embeddings, directorio: str) -> dict:
+    retrievers = {}
+    lexical = BM25Retriever(chunks)
+    if "bm25" in backends:
+        retrievers["bm25"] = lexical
+    if "numpy" in backends or "hybrid" in backends:
+        guardar_indice_numpy(
+            chunks,
+            [embeddings.obtener(c["content"], "retrieval_document") for c in chunks],
+            directorio,
+        )
+        vector = NumpyRetriever(directorio)
+        if "numpy" in backends:
+            retrievers["numpy"] = vector
+        if "hybrid" in backends:
+            retrievers["hybrid"] = HybridRetriever(vector, lexical, alpha=float(os.getenv("HYBRID_ALPHA", "0.6")))
+    return retrievers
+
+
+def evaluar(retriever, preguntas: list[dict], consultas: list[Optional[list[float]]], top_k: int, repeticiones: int) -> dict:
+    recalls, hits, rr, tokens, latencias = [], [], [], [], []
+    for pregunta, embedding in zip(preguntas, consultas):
+        resultados = []
+        for _ in range(repeticiones):
+            inicio = time.perf_counter()
+            resultados = retriever.search(pregunta["question"], embedding, top_k=top_k)
+            latencias.append(time.perf_counter() - inicio)
+
+        esperadas = pregunta["sections"]
+        encontradas = {s for s in esperadas if any(es_relevante(r, [s]) for r in resultados)}
+        recalls.append(len(encontradas) / len(esperadas))
+        hits.append(1.0 if encontradas else 0.0)
+        rango = next((i for i, r in enumerate(resultados, 1) if es_relevante(r, esperadas)), None)
+        rr.append(1 / rango if rango else 0.0)
+        tokens.append(estimar_tokens("\n\n".join(r["content"] for r in resultados)))
+
+    ms = np.array(latencias) * 1000
+    return {
+        "recall": round(float(np.mean(recalls)), 3),
+        "hit": round(float(np.mean(hits)), 3),
+        "mrr": round(float(np.mean(rr)), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "tokens_mean": round(float(np.mean(tokens)), 1),
+        "tokens_p95": round(float(np.percentile(tokens, 95)), 1),
+    }
+
+
+def ejecutar(args) -> dict:
+    with open(args.eval_set, "r", encoding="utf-8") as f:
+        preguntas = json.load(f)
+    with open(args.context, "r", encoding="utf-8") as f:
+        contenido = f.read()
+
+    embeddings = Embeddings(args.embeddings, fake=args.fake_embeddings)
+    filas = []
+    try:
+        for estrategia in args.strategies:
+            chunks = ESTRATEGIAS[estrategia](contenido)
+            with tempfile.TemporaryDirectory(prefix="rag_eval_") as directorio:
+                retrievers = construir_retrievers(chunks, args.backends, embeddings, directorio)
+                for backend, retriever in retrievers.items():
+                    consultas = [
+                        embeddings.obtener(p["question"], "retrieval_query") if retriever.needs_embedding else None
+                        for p in preguntas
+                    ]
+                    for top_k in args.top_k:
+                        filas.append({
+                            "strategy": estrategia,
+                            "chunks": len(chunks),
+                            "backend": backend,
+                            "top_k": top_k,
+                            **evaluar(retriever, preguntas, consultas, top_k, args.repeat),
+                        })
+    finally:
+        embeddings.guardar()
+    return {"questions": len(preguntas), "results": filas}
+
+
+def imprimir_reporte(reporte: dict):
+    print(f"\n📊 Recuperación sobre {reporte['questions']} preguntas")
+    print(f"{'estrategia':<12}{'backend':<9}{'k':>3}{'recall':>8}{'hit':>7}{'mrr':>7}"
+          f"{'p50 ms':>9}{'p95 ms':>9}{'tokens':>8}{'tok p95':>9}")
+    for f in reporte["results"]:
+        print(f"{f['strategy']:<12}{f['backend']:<9}{f['top_k']:>3}{f['recall']:>8}{f['hit']:>7}{f['mrr']:>7}"
+              f"{f['p50_ms']:>9}{f['p95_ms']:>9}{f['tokens_mean']:>8}{f['tokens_p95']:>9}")
+
+
+def _lista(texto: str) -> list[str]:
+    return [v.strip() for v in texto.split(",") if v.strip()]
+
+
+def main(argv: Optional[list[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluación offline de la recuperación del RAG")
+    parser.add_argument("--eval-set", default=EVAL_SET_PATH)
+    parser.add_argument("--context", default="contexto_orisod.txt")
+    parser.add_argument("--backends", type=_lista, default=list(BACKENDS), help="bm25,numpy,hybrid")
+    parser.add_argument("--strategies", type=_lista, default=list(ESTRATEGIAS),
+                        help=f"Estrategias de chunking ({', '.join(ESTRATEGIAS)})")
+    parser.add_argument("--top-k", type=lambda t: [int(v) for v in _lista(t)], default=[1, 2, 3, 5])
+    parser.add_argument("--repeat", type=int, default=20, help="Búsquedas por pregunta para medir latencia")
+    parser.add_argument("--embeddings", default=EMBEDDINGS_PATH, help="Cache .npz de embeddings de Gemini")
+    parser.add_argument("--fake-embeddings", action="store_true", help="Vectores deterministas, sin Gemini")
+    parser.add_argument("--json", help="Guardar el reporte en este archivo")
+    args = parser.parse_args(argv)
+
+    for backend in args.backends:
+        if backend not in BACKENDS:
+            parser.error(f"Backend desconocido: {backend} (opciones: {', '.join(BACKENDS)})")
+    for estrategia in args.strategies:
+        if estrategia not in ESTRATEGIAS:
+            parser.error(f"Estrategia desconocida: {estrategia} (opciones: {', '.join(ESTRATEGIAS)})")
+
+    reporte = ejecutar(args)
+    imprimir_reporte(reporte)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(reporte, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
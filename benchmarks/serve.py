@@ -0,0 +1,31 @@
+"""
+Servidor uvicorn local con los proveedores sustituidos por stubs.
+
+    python -m benchmarks.serve --port 8001 --gemini fixed:500
+    python -m benchmarks.load_test --url http://127.0.0.1:8001
+"""
+import argparse
+
+import uvicorn
+
+from benchmarks.load_test import _latencias, agregar_argumentos_latencia
+from benchmarks.stubs import aplicar_stubs, preparar_entorno
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor con stubs para benchmarks")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--seed", type=int, default=0)
+    agregar_argumentos_latencia(parser)
+    args = parser.parse_args()
+
+    directorio = preparar_entorno()
+    import main as servidor
+    aplicar_stubs(servidor, _latencias(args), directorio, seed=args.seed)
+    print(f"⚡ Servidor de benchmark en http://{args.host}:{args.port} (datos en {directorio})")
+    uvicorn.run(servidor.app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
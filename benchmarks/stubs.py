@@ -0,0 +1,150 @@
+"""
+Dobles de Gemini, embeddings, ElevenLabs y la base de datos para los benchmarks.
+
+Los stubs se enganchan en el mismo punto en que el servidor llama a cada
+proveedor, así que el pool de threads de LLMClient, el single-flight del
+audio y el logger write-behind siguen funcionando igual que en producción;
+solo cambia el round-trip de red por una espera con la distribución elegida.
+
+Distribuciones (`--gemini`, `--embed`, `--tts`, `--db`), en milisegundos:
+    fixed:300            siempre 300 ms
+    uniform:100:400      uniforme entre 100 y 400 ms
+    normal:300:50        normal (media, desviación), truncada en 0
+    lognormal:300:0.5    lognormal con mediana 300 ms y sigma 0.5 (colas largas)
+"""
+import asyncio
+import hashlib
+import os
+import random
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+
+
+@dataclass
+class Latencia:
+    tipo: str
+    a: float
+    b: float = 0.0
+
+    @classmethod
+    def parse(cls, spec: str) -> "Latencia":
+        partes = spec.split(":")
+        tipo, valores = partes[0], [float(v) for v in partes[1:]]
+        if tipo not in ("fixed", "uniform", "normal", "lognormal") or not valores:
+            raise ValueError(f"Distribución inválida: {spec} (ej. fixed:300, lognormal:300:0.5)")
+        return cls(tipo, *valores)
+
+    def muestra(self, rng: random.Random) -> float:
+        """Una latencia en segundos"""
+        if self.tipo == "fixed":
+            ms = self.a
+        elif self.tipo == "uniform":
+            ms = rng.uniform(self.a, self.b)
+        elif self.tipo == "normal":
+            ms = max(0.0, rng.gauss(self.a, self.b))
+        else:
+            ms = self.a * rng.lognormvariate(0.0, self.b)
+        return ms / 1000
+
+
+# Perfil aproximado de producción (mediana de cada proveedor)
+LATENCIAS_POR_DEFECTO = {
+    "gemini": "lognormal:900:0.4",
+    "embed": "lognormal:150:0.3",
+    "tts": "lognormal:400:0.4",
+    "db": "lognormal:8:0.5",
+}
+
+
+def preparar_entorno(directorio: Optional[str] = None) -> str:
+    """Variables de entorno para importar main sin servicios externos.
+
+    Debe llamarse antes de `import main`. Devuelve el directorio temporal
+    donde quedan la base SQLite, los audios y el índice vectorial.
+    """
+    directorio = directorio or tempfile.mkdtemp(prefix="bench_")
+    os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(directorio, 'bench.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["AUDIO_DIR"] = os.path.join(directorio, "audio")
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(directorio, "embedding_cache.npz")
+    os.environ["LOG_SPILL_PATH"] = os.path.join(directorio, "spill.jsonl")
+    os.environ["RETRIEVER_BACKEND"] = "bm25"
+    os.environ["ENABLE_ELEVENLABS"] = "true"
+    os.environ.setdefault("AUDIO_STREAMING", "false")
+    os.environ.setdefault("GEMINI_API_KEY", "bench")
+    os.environ.setdefault("ELEVENLABS_API_KEY", "bench")
+    return directorio
+
+
+def embedding_falso(texto: str, dim: int = 768) -> list[float]:
+    """Vector determinista por texto (misma pregunta -> mismo embedding)"""
+    semilla = int.from_bytes(hashlib.sha256(texto.encode()).digest()[:8], "little")
+    vec = np.random.default_rng(semilla).standard_normal(dim).astype(np.float32)
+    return (vec / np.linalg.norm(vec)).tolist()
+
+
+class _RespuestaFalsa:
+    def __init__(self, texto: str):
+        self.text = texto
+        self.parts = [texto]
+        self.candidates = []
+
+
+class _ModeloFalso:
+    def __init__(self, latencia: Latencia, rng: random.Random):
+        self.latencia = latencia
+        self.rng = rng
+
+    def generate_content(self, prompt, **kwargs):
+        # Corre en el pool de threads de LLMClient, como la llamada REST real
+        time.sleep(self.latencia.muestra(self.rng))
+        return _RespuestaFalsa("ORISOD Enzyme es un antioxidante natural a base de romero y olivo.")
+
+
+def aplicar_stubs(main, latencias: dict[str, Latencia], directorio: str, seed: int = 0):
+    """Sustituye los proveedores externos del módulo `main` ya importado"""
+    import llm_client
+    from chunking import cargar_chunks
+    from retrieval import NumpyRetriever, guardar_indice_numpy
+
+    rng = random.Random(seed)
+
+    # Gemini: generación y embeddings dentro del mismo pool/semáforo de LLMClient
+    modelo = _ModeloFalso(latencias["gemini"], rng)
+    main.llm.get_model = lambda model_name: modelo
+
+    def _embed(model, content, task_type=None, request_options=None):
+        time.sleep(latencias["embed"].muestra(rng))
+        return {"embedding": embedding_falso(content)}
+
+    llm_client.genai.embed_content = _embed
+
+    # Índice vectorial numpy con embeddings falsos: ejercita el camino embedding -> RAG
+    chunks = cargar_chunks()
+    index_dir = os.path.join(directorio, "vector_index")
+    guardar_indice_numpy(chunks, [embedding_falso(c["content"]) for c in chunks], index_dir)
+    main.retriever = NumpyRetriever(index_dir)
+    main.RAG_ENABLED = True
+
+    # ElevenLabs: primer byte tras la latencia, luego el resto del MP3
+    def _convertir(texto: str):
+        time.sleep(latencias["tts"].muestra(rng))
+        yield b"ID3" + os.urandom(2048)
+        for _ in range(7):
+            yield os.urandom(4096)
+
+    main._convertir_audio = _convertir
+
+    # DB: latencia extra por lote antes del INSERT real en SQLite
+    logger = main.interaction_logger
+    flush_original = logger._flush
+
+    async def _flush(lote):
+        await asyncio.sleep(latencias["db"].muestra(rng))
+        await flush_original(lote)
+
+    logger._flush = _flush
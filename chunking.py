@@ -0,0 +1,209 @@
+"""
+División de contexto_orisod.txt en chunks.
+
+La usan vectorize_context.py (embeddings) y el índice BM25 de retrieval.py,
+así ambos trabajan sobre exactamente los mismos chunks e ids. Cada chunk lleva
+el hash de su título y contenido ("hash"): es la clave estable con la que
+vectorize_context.py reutiliza embeddings y con la que el retriever híbrido
+cruza los resultados de los dos índices.
+
+Estrategias (CHUNK_STRATEGY):
+- tokens (por defecto): respeta la jerarquía de secciones numeradas ("2.",
+  "2.1", ...). Cada sección hoja produce uno o más chunks de hasta
+  CHUNK_MAX_TOKENS, cortados en límites de línea con CHUNK_OVERLAP_TOKENS de
+  solapamiento; cada chunk empieza con la ruta de títulos ("2. Componentes >
+  2.1 Polifenoles del olivo") y lleva la sección padre en sus metadatos.
+- secciones: la división original, un chunk por cada línea que empieza con
+  dígito o '##' (fragmenta líneas como "24 flavonoides..." o "100% vegetal").
+"""
+import hashlib
+import math
+import os
+import re
+from typing import Optional
+
+CHUNK_STRATEGY = os.getenv("CHUNK_STRATEGY", "tokens")
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "200"))
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
+
+# "2. Título" o "2.1 Título" / "2.1. Título"; "24 flavonoides" o "100% vegetal" no son títulos
+TITULO_NUMERADO = re.compile(r"^(\d+\.|\d+(?:\.\d+)+\.?)\s+\S")
+TITULO_MARKDOWN = re.compile(r"^(#{1,6})\s+\S")
+
+
+def dividir_en_secciones(contenido: str) -> list[dict]:
+    """Divide por secciones: cada línea que empieza con dígito o '##' abre un chunk"""
+    chunks = []
+    current_chunk = ""
+    current_title = ""
+
+    for line in contenido.split('\n'):
+        # Detectar títulos principales (números al inicio)
+        if line.strip() and (line[0].isdigit() or line.startswith('##')):
+            if current_chunk:
+                chunks.append({
+                    "title": current_title,
+                    "content": current_chunk.strip()
+                })
+            current_title = line.strip()
+            current_chunk = line + "\n"
+        else:
+            current_chunk += line + "\n"
+
+    # Agregar el último chunk
+    if current_chunk:
+        chunks.append({
+            "title": current_title,
+            "content": current_chunk.strip()
+        })
+
+    return [{"id": f"chunk_{i}", **chunk} for i, chunk in enumerate(chunks)]
+
+
+def estimar_tokens(texto: str) -> int:
+    """Aproximación de tokens de Gemini (~4 caracteres por token en español)"""
+    return math.ceil(len(texto) / 4)
+
+
+def _nivel_titulo(linea: str) -> Optional[tuple[int, str]]:
+    """(nivel, número de sección) si la línea es un título, si no None"""
+    m = TITULO_NUMERADO.match(linea)
+    if m:
+        numero = m.group(1).rstrip(".")
+        return numero.count(".") + 1, numero
+    m = TITULO_MARKDOWN.match(linea)
+    if m:
+        return len(m.group(1)), ""
+    return None
+
+
+def _parsear_secciones(contenido: str) -> list[dict]:
+    """Secciones en orden con su ruta de títulos y sus líneas de cuerpo"""
+    secciones = []
+    ruta: list[tuple[int, str]] = []
+    actual = {"level": 0, "number": "", "path": [], "lines": []}
+    for linea in contenido.split("\n"):
+        linea = linea.rstrip()
+        titulo = _nivel_titulo(linea)
+        if titulo is None:
+            if linea.strip():
+                actual["lines"].append(linea)
+            continue
+        nivel, numero = titulo
+        secciones.append(actual)
+        ruta = [(n, t) for n, t in ruta if n < nivel] + [(nivel, linea.strip())]
+        actual = {"level": nivel, "number": numero, "path": [t for _, t in ruta], "lines": []}
+    secciones.append(actual)
+
+    # Una sección es hoja si la siguiente no es más profunda
+    for i, seccion in enumerate(secciones):
+        siguiente = secciones[i + 1] if i + 1 < len(secciones) else None
+        seccion["leaf"] = siguiente is None or siguiente["level"] <= seccion["level"]
+    return secciones
+
+
+def _partir_linea(linea: str, max_tokens: int) -> list[str]:
+    """Parte una línea demasiado larga por oraciones y, si hace falta, por palabras"""
+    if estimar_tokens(linea) <= max_tokens:
+        return [linea]
+    piezas, actual = [], ""
+    for unidad in re.split(r"(?<=[.;:])\s+", linea):
+        palabras = [unidad] if estimar_tokens(unidad) <= max_tokens else unidad.split()
+        for palabra in palabras:
+            candidato = f"{actual} {palabra}".strip()
+            if actual and estimar_tokens(candidato) > max_tokens:
+                piezas.append(actual)
+                candidato = palabra
+            actual = candidato
+    if actual:
+        piezas.append(actual)
+    return piezas
+
+
+def _empaquetar(lineas: list[str], max_tokens: int, overlap_tokens: int) -> list[list[str]]:
+    """Agrupa líneas en bloques de hasta max_tokens, repitiendo al inicio de cada
+    bloque las últimas líneas del anterior (hasta overlap_tokens)"""
+    unidades = [pieza for linea in lineas for pieza in _partir_linea(linea, max_tokens)]
+    bloques: list[list[str]] = []
+    actual: list[str] = []
+    tokens = 0
+    nuevas = 0  # líneas del bloque actual que no vienen del solapamiento
+    for unidad in unidades:
+        costo = estimar_tokens(unidad) + 1
+        if nuevas and tokens + costo > max_tokens:
+            bloques.append(actual)
+            solape: list[str] = []
+            for previa in reversed(actual):
+                if sum(estimar_tokens(l) + 1 for l in solape) + estimar_tokens(previa) + 1 > overlap_tokens:
+                    break
+                solape.insert(0, previa)
+            # El solapamiento nunca deja sin espacio a la línea nueva
+            while solape and sum(estimar_tokens(l) + 1 for l in solape) + costo > max_tokens:
+                solape.pop(0)
+            actual, tokens, nuevas = solape, sum(estimar_tokens(l) + 1 for l in solape), 0
+        actual.append(unidad)
+        tokens += costo
+        nuevas += 1
+    if nuevas:
+        bloques.append(actual)
+    return bloques
+
+
+def dividir_por_tokens(
+    contenido: str,
+    max_tokens: Optional[int] = None,
+    overlap_tokens: Optional[int] = None,
+) -> list[dict]:
+    """Chunks por sección hoja, acotados en tokens y con la ruta de títulos.
+
+    Las introducciones de secciones padre (texto antes de su primera
+    subsección) forman su propio chunk; los padres sin texto solo aportan su
+    título a la ruta de sus hijos.
+    """
+    max_tokens = max_tokens or CHUNK_MAX_TOKENS
+    overlap_tokens = CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+
+    chunks = []
+    for seccion in _parsear_secciones(contenido):
+        if not seccion["lines"] and not seccion["leaf"]:
+            continue
+        ruta = seccion["path"]
+        encabezado = " > ".join(ruta)
+        # El encabezado se repite en cada parte: se descuenta del presupuesto
+        presupuesto = max(max_tokens - estimar_tokens(encabezado) - 1, max_tokens // 2)
+        bloques = _empaquetar(seccion["lines"], presupuesto, overlap_tokens) or [[]]
+        for parte, bloque in enumerate(bloques):
+            texto = "\n".join([encabezado, *bloque]) if encabezado else "\n".join(bloque)
+            if not texto.strip():
+                continue
+            chunks.append({
+                "title": ruta[-1] if ruta else "",
+                "content": texto,
+                "section": seccion["number"],
+                "parent": ruta[-2] if len(ruta) > 1 else "",
+                "part": parte,
+            })
+
+    return [{"id": f"chunk_{i}", **chunk} for i, chunk in enumerate(chunks)]
+
+
+# Estrategias de división disponibles (nombre -> función contenido -> chunks)
+ESTRATEGIAS = {
+    "tokens": dividir_por_tokens,
+    "secciones": dividir_en_secciones,
+}
+
+
+def hash_chunk(chunk: dict) -> str:
+    return hashlib.sha256(f"{chunk['title']}\n{chunk['content']}".encode()).hexdigest()
+
+
+def cargar_chunks(path: str = "contexto_orisod.txt", estrategia: Optional[str] = None) -> list[dict]:
+    estrategia = estrategia or CHUNK_STRATEGY
+    if estrategia not in ESTRATEGIAS:
+        raise ValueError(f"Estrategia de chunking desconocida: {estrategia} (opciones: {', '.join(ESTRATEGIAS)})")
+    with open(path, "r", encoding="utf-8") as f:
+        chunks = ESTRATEGIAS[estrategia](f.read())
+    for chunk in chunks:
+        chunk["hash"] = hash_chunk(chunk)
+    return chunks
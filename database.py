@@ -1,6 +1,6 @@
 from sqlalchemy import create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
+from sqlalchemy.orm import sessionmaker, declarative_base
 import os
 from dotenv import load_dotenv
 
@@ -10,13 +10,50 @@ import json
 
 DATABASE_URL = os.getenv("DATABASE_URL")
 
+
+def _async_url(url: str) -> str:
+    """Traduce DATABASE_URL al driver asíncrono (asyncpg para Postgres, aiosqlite para SQLite)"""
+    for prefijo in ("postgresql+psycopg2://", "postgresql://", "postgres://"):
+        if url.startswith(prefijo):
+            return "postgresql+asyncpg://" + url[len(prefijo):]
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
 # Configurar serializador JSON para guardar acentos correctamente
+def _json_serializer(obj):
+    return json.dumps(obj, ensure_ascii=False)
+
+
+# Engine síncrono: scripts de mantenimiento (inspect_db.py, migraciones)
 engine = create_engine(
     DATABASE_URL,
-    json_serializer=lambda obj: json.dumps(obj, ensure_ascii=False)
+    json_serializer=_json_serializer
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine asíncrono: webhooks y dashboard, sin bloquear el event loop
+_pool_kwargs = {}
+if not ASYNC_DATABASE_URL.startswith("sqlite"):
+    _pool_kwargs = dict(
+        pool_size=int(os.getenv("DB_POOL_SIZE", "10")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+        pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "5")),
+        pool_recycle=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+        pool_pre_ping=True,
+    )
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    json_serializer=_json_serializer,
+    **_pool_kwargs
+)
+# expire_on_commit=False: los objetos siguen legibles tras el commit sin lazy-load
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, expire_on_commit=False)
+
 Base = declarative_base()
 
 def get_db():
@@ -25,3 +62,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,101 @@
+"""
+Cache LRU de embeddings de consulta (consulta normalizada -> embedding).
+
+Evita el round-trip a Gemini para preguntas repetidas. Se persiste en disco como .npz para sobrevivir reinicios.
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+import numpy as np
+
+from llm_client import EMBEDDING_MODEL
+from text_normalization import normalizar_texto as normalizar_consulta
+
+
+class EmbeddingCache:
+    """Cache LRU acotado por número de consultas"""
+
+    def __init__(self, path: str, max_entries: int = 2000, model: str = ""):
+        self.path = path
+        self.max_entries = max_entries
+        self.model = model
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._dirty = False
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, consulta: str) -> Optional[list[float]]:
+        key = normalizar_consulta(consulta)
+        with self._lock:
+            vec = self._entries.get(key)
+            if vec is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return vec.tolist()
+
+    def put(self, consulta: str, embedding: list[float]):
+        key = normalizar_consulta(consulta)
+        with self._lock:
+            self._entries[key] = np.asarray(embedding, dtype=np.float32)
+            self._entries.move_to_end(key)
+            self._dirty = True
+            self._evict()
+
+    def _evict(self):
+        """Desaloja las entradas menos usadas"""
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def load(self):
+        """Carga el cache desde disco (se ignora si es de otro modelo de embeddings)"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            data = np.load(self.path, allow_pickle=False)
+            if str(data["model"]) != self.model:
+                print(f"⚠️ Cache de embeddings de otro modelo ({data['model']}), se descarta")
+                return
+            with self._lock:
+                for key, vec in zip(data["keys"], data["vectors"]):
+                    self._entries[str(key)] = vec
+                self._evict()
+            print(f"✅ Cache de embeddings cargado: {len(self._entries)} consultas")
+        except Exception as e:
+            print(f"⚠️ Error cargando cache de embeddings: {e}")
+
+    def save(self):
+        """Escribe el cache a disco de forma atómica si hubo cambios"""
+        with self._lock:
+            if not self._dirty or not self._entries:
+                return
+            keys = np.array(list(self._entries.keys()))
+            vectors = np.stack(list(self._entries.values()))
+            self._dirty = False
+        tmp_path = f"{self.path}.tmp.npz"
+        try:
+            np.savez(tmp_path, keys=keys, vectors=vectors, model=np.array(self.model))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            self._dirty = True
+            print(f"⚠️ Error guardando cache de embeddings: {e}")
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+        }
+
+
+embedding_cache = EmbeddingCache(
+    path=os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.npz"),
+    max_entries=int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", "2000")),
+    model=EMBEDDING_MODEL,
+)
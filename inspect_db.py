@@ -9,21 +9,28 @@ models.Base.metadata.create_all(bind=engine)
 def ver_llamadas():
     db = SessionLocal()
     try:
-        calls = db.query(models.CallLog).order_by(models.CallLog.id.desc()).all()
+        # Solo las últimas 5; para volcar todo el historial usar /api/calls/export
+        total = db.query(models.CallLog).count()
+        calls = db.query(models.CallLog).order_by(models.CallLog.id.desc()).limit(5).all()
         
-        print(f"\n📊 Total de llamadas registradas: {len(calls)}")
+        print(f"\n📊 Total de llamadas registradas: {total}")
         
-        for call in calls[:5]:  # Mostrar las últimas 5
+        for call in calls:
             print(f"\n📞 ID: {call.id} | SID: {call.call_sid} | Fecha: {call.start_time}")
             print(f"📱 Usuario: {call.user_phone}")
             print("📝 Interacciones:")
             
-            if call.interaction_log:
-                for interaction in call.interaction_log:
+            interacciones = db.query(models.Interaction).filter(
+                models.Interaction.call_sid == call.call_sid
+            ).order_by(models.Interaction.turn_index).all()
+            # Llamadas sin migrar conservan el JSON antiguo
+            turnos = [(i.user_text, i.ai_text) for i in interacciones] or [
+                (i.get('user', ''), i.get('ai', '')) for i in (call.interaction_log or [])
+            ]
+
+            if turnos:
+                for user_text, ai_text in turnos:
                     # Asegurar que se muestren caracteres especiales correctamente
-                    user_text = interaction.get('user', '')
-                    ai_text = interaction.get('ai', '')
-                    
                     print(f"   👤 User: {user_text}")
                     print(f"   🤖 AI:   {ai_text}")
                     print("   ---")
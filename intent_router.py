@@ -0,0 +1,168 @@
+"""
+Router de intenciones: responde las preguntas frecuentes sin embedding, RAG ni Gemini.
+
+Las intenciones y sus frases viven en intents.json (INTENTS_PATH). Todas las
+frases se compilan en un autómata Aho-Corasick sobre palabras normalizadas
+(text_normalization), así que cada turno se clasifica con una sola pasada
+por la transcripción, sin importar cuántas frases haya. Modos por frase:
+
+    contains   la frase aparece en cualquier parte ("¿y qué ofreces?")
+    exact      la transcripción completa es la frase ("hola")
+    suffix     la transcripción termina con la frase ("gracias, adiós")
+
+Si coinciden varias intenciones con respuesta ("¿qué es y cómo se toma?") el
+turno sigue el camino normal con Gemini. Una intención sin respuesta (la
+despedida) solo evita a Gemini si la frase es la transcripción completa: en
+"¿cuánto cuesta?, adiós" se responde la pregunta y después se cuelga. Las respuestas fijas se pre-generan
+en audio al arrancar y quedan fijadas en el cache.
+"""
+import json
+import os
+import threading
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Optional
+
+from text_normalization import normalizar_texto
+
+INTENTS_PATH = os.getenv("INTENTS_PATH", "intents.json")
+MODOS = ("contains", "exact", "suffix")
+
+
+@dataclass
+class Intent:
+    name: str
+    answer: Optional[str] = None
+    # Cuelga la llamada después de la despedida
+    hangup: bool = False
+
+
+@dataclass
+class _Nodo:
+    hijos: dict[str, int] = field(default_factory=dict)
+    falla: int = 0
+    # (índice de intención, modo, largo en palabras) de las frases que terminan aquí
+    salidas: list[tuple[int, str, int]] = field(default_factory=list)
+
+
+class IntentRouter:
+    """Autómata Aho-Corasick por palabras con las frases de todas las intenciones"""
+
+    def __init__(self, intents: list[Intent], frases: list[tuple[int, str, str]]):
+        self.intents = intents
+        self._nodos = [_Nodo()]
+        for indice, modo, frase in frases:
+            if modo not in MODOS:
+                raise ValueError(f"Modo desconocido '{modo}' en la intención {intents[indice].name}")
+            palabras = normalizar_texto(frase).split()
+            if not palabras:
+                continue
+            actual = 0
+            for palabra in palabras:
+                siguiente = self._nodos[actual].hijos.get(palabra)
+                if siguiente is None:
+                    siguiente = len(self._nodos)
+                    self._nodos.append(_Nodo())
+                    self._nodos[actual].hijos[palabra] = siguiente
+                actual = siguiente
+            self._nodos[actual].salidas.append((indice, modo, len(palabras)))
+        self._enlazar_fallas()
+
+        self._lock = threading.Lock()
+        self.turnos = 0
+        self.por_intencion: Counter = Counter()
+
+    def _enlazar_fallas(self):
+        """BFS: cada nodo apunta al sufijo propio más largo que también está en el trie"""
+        cola = list(self._nodos[0].hijos.values())
+        while cola:
+            actual = cola.pop(0)
+            for palabra, hijo in self._nodos[actual].hijos.items():
+                falla = self._nodos[actual].falla
+                while falla and palabra not in self._nodos[falla].hijos:
+                    falla = self._nodos[falla].falla
+                destino = self._nodos[falla].hijos.get(palabra, 0)
+                self._nodos[hijo].falla = destino if destino != hijo else 0
+                self._nodos[hijo].salidas.extend(self._nodos[self._nodos[hijo].falla].salidas)
+                cola.append(hijo)
+
+    @classmethod
+    def desde_archivo(cls, path: str = INTENTS_PATH) -> "IntentRouter":
+        with open(path, "r", encoding="utf-8") as f:
+            config = json.load(f)
+        intents, frases = [], []
+        for i, item in enumerate(config["intents"]):
+            intents.append(Intent(item["name"], item.get("answer"), bool(item.get("hangup", False))))
+            for grupo in item["patterns"]:
+                frases.extend((i, grupo.get("match", "contains"), frase) for frase in grupo["phrases"])
+        return cls(intents, frases)
+
+    def _buscar(self, texto: str) -> dict[int, bool]:
+        """Índice de cada intención presente -> si alguna de sus frases es `texto` completo"""
+        palabras = normalizar_texto(texto).split()
+        total = len(palabras)
+        encontradas: dict[int, bool] = {}
+        estado = 0
+        for pos, palabra in enumerate(palabras):
+            while estado and palabra not in self._nodos[estado].hijos:
+                estado = self._nodos[estado].falla
+            estado = self._nodos[estado].hijos.get(palabra, 0)
+            for indice, modo, largo in self._nodos[estado].salidas:
+                final = pos == total - 1
+                if modo == "contains" or (modo == "suffix" and final) or (modo == "exact" and final and largo == total):
+                    encontradas[indice] = encontradas.get(indice, False) or largo == total
+        return encontradas
+
+    def clasificar(self, texto: str) -> list[Intent]:
+        """Intenciones presentes en `texto`, en el orden de intents.json"""
+        return [self.intents[i] for i in sorted(self._buscar(texto))]
+
+    def resolver(self, texto: str) -> tuple[Optional[Intent], bool]:
+        """(intención con respuesta directa o None, despedida) de un turno.
+
+        Cuenta el turno en las estadísticas: la respuesta directa solo se da
+        si exactamente una intención coincide, y si no tiene respuesta, solo
+        cuando su frase es todo el turno (lo demás puede ser una pregunta).
+        """
+        encontradas = self._buscar(texto)
+        intents = [self.intents[i] for i in sorted(encontradas)]
+        despedida = any(i.hangup for i in intents)
+        directa = None
+        if len(encontradas) == 1:
+            (indice, completa), = encontradas.items()
+            if self.intents[indice].answer or completa:
+                directa = self.intents[indice]
+        with self._lock:
+            self.turnos += 1
+            self.por_intencion[directa.name if directa else ("ambiguous" if len(intents) > 1 else "llm")] += 1
+        return directa, despedida
+
+    def respuestas(self) -> list[str]:
+        """Textos fijos a pre-generar en audio"""
+        return [i.answer for i in self.intents if i.answer]
+
+    def stats(self) -> dict:
+        with self._lock:
+            turnos = self.turnos
+            por_intencion = dict(self.por_intencion)
+        absorbidos = sum(n for nombre, n in por_intencion.items() if nombre not in ("llm", "ambiguous"))
+        return {
+            "intents": len(self.intents),
+            "turns": turnos,
+            "absorbed": absorbidos,
+            "absorbed_ratio": round(absorbidos / turnos, 4) if turnos else 0.0,
+            "by_intent": por_intencion,
+        }
+
+
+def cargar_router(path: str = INTENTS_PATH) -> IntentRouter:
+    try:
+        router = IntentRouter.desde_archivo(path)
+        print(f"✅ Router de intenciones cargado ({len(router.intents)} intenciones)")
+        return router
+    except Exception as e:
+        print(f"⚠️ Error cargando {path}, router de intenciones vacío: {e}")
+        return IntentRouter([], [])
+
+
+intent_router = cargar_router()
@@ -0,0 +1,501 @@
+"""
+Registro write-behind de llamadas e interacciones.
+
+Los webhooks solo encolan el registro (sin round-trip a la base de datos).
+Una tarea de fondo vacía la cola en lotes con INSERT multi-fila cuando se
+alcanza `batch_size` o pasa `flush_interval`. La cola está acotada: si se
+llena, o si Postgres no está disponible, los registros se escriben en un
+archivo de respaldo (JSONL) que se reintenta antes de cada vaciado (para que
+los turnos viejos no queden detrás de los nuevos) y al arrancar. El archivo se
+escribe y se lee en threads (nunca en el event loop del webhook) y se reinserta
+por lotes sin cargarlo completo en memoria. Al apagar (lifespan) se drena la cola.
+
+Como el respaldo puede llegar después que registros más nuevos, el orden de
+los turnos (turn_index) y el resumen de la llamada salen del `ts` de cada
+registro, no del orden en que se insertan.
+"""
+import asyncio
+import json
+import os
+import shutil
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import select, insert, update, func, case, or_
+from sqlalchemy.exc import IntegrityError
+
+import models
+from analytics import actualizar_rollups, insert_dialecto
+from database import AsyncSessionLocal
+from metrics import DB_FLUSH_SECONDS, LOG_RECORDS
+from phone_numbers import normalizar_telefono, invertir
+
+# Marca de fin para que el worker vacíe el lote en curso y termine
+_FIN = {"tipo": "fin"}
+
+
+class InteractionLogger:
+    def __init__(
+        self,
+        session_factory,
+        max_queue: int = 10000,
+        batch_size: int = 200,
+        flush_interval: float = 0.5,
+        spill_path: str = "interaction_spill.jsonl",
+    ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.spill_path = spill_path
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self._worker: Optional[asyncio.Task] = None
+        self._hay_respaldo = False
+        # Registros rechazados por la cola llena, a la espera de escribirse en el respaldo
+        self._desborde: list[dict] = []
+        self._volcado: Optional[asyncio.Task] = None
+        # Serializa escrituras y reintentos del archivo de respaldo
+        self._lock_respaldo = asyncio.Lock()
+
+        self.enqueued = 0
+        self.written = 0
+        self.spilled = 0
+        self.batches = 0
+
+    # --- API para los webhooks (no bloquea) ----------------------------------
+
+    def log_call(self, call_sid: str, user_phone: Optional[str]):
+        self._encolar({
+            "tipo": "call",
+            "ts": time.time(),
+            "call_sid": call_sid,
+            "user_phone": user_phone,
+        })
+
+    def log_interaction(self, call_sid: str, user_text: str, ai_text: str,
+                        confidence: Optional[float] = None, latencies: Optional[dict] = None):
+        self._encolar({
+            "tipo": "interaction",
+            "ts": time.time(),
+            "call_sid": call_sid,
+            "user_text": user_text,
+            "ai_text": ai_text,
+            "confidence": confidence,
+            "latencies": latencies,
+        })
+
+    def log_event(self, nombre: str, call_sid: Optional[str] = None):
+        """Evento contable para /api/stats (ver analytics.EVENTOS)"""
+        self._encolar({
+            "tipo": "event",
+            "ts": time.time(),
+            "call_sid": call_sid,
+            "nombre": nombre,
+        })
+
+    def _encolar(self, registro: dict):
+        try:
+            self._queue.put_nowait(registro)
+            self.enqueued += 1
+        except asyncio.QueueFull:
+            # Contrapresión: nunca bloquear la llamada; el registro va al respaldo
+            # desde una tarea aparte, sin escribir en disco dentro del webhook
+            self._desborde.append(registro)
+            if self._volcado is None or self._volcado.done():
+                self._volcado = asyncio.create_task(self._volcar_desborde())
+
+    # --- Respaldo local ------------------------------------------------------
+
+    async def _volcar_desborde(self):
+        while self._desborde:
+            registros, self._desborde = self._desborde, []
+            await self._respaldar(registros)
+
+    @staticmethod
+    def _linea(registro: dict) -> str:
+        return json.dumps(registro, ensure_ascii=False) + "\n"
+
+    def _escribir_respaldo(self, registros: list[dict]):
+        with open(self.spill_path, "a", encoding="utf-8") as f:
+            f.writelines(self._linea(r) for r in registros)
+
+    async def _respaldar(self, registros: list[dict]):
+        """Agrega registros al archivo de respaldo (en un thread, fuera del event loop)"""
+        async with self._lock_respaldo:
+            try:
+                await asyncio.to_thread(self._escribir_respaldo, registros)
+            except Exception as e:
+                print(f"❌ Error escribiendo respaldo de logs ({len(registros)} registros perdidos): {e}")
+                return
+            self._hay_respaldo = True
+        self.spilled += len(registros)
+        LOG_RECORDS.labels("spilled").inc(len(registros))
+
+    @staticmethod
+    def _leer_respaldo(f, limite: int) -> list[dict]:
+        """Siguientes `limite` registros del archivo abierto"""
+        registros = []
+        while len(registros) < limite:
+            linea = f.readline()
+            if not linea:
+                break
+            if not linea.strip():
+                continue
+            try:
+                registros.append(json.loads(linea))
+            except ValueError:
+                # Línea truncada por una escritura interrumpida
+                print(f"⚠️ Línea inválida en el respaldo de logs, se omite: {linea[:80]!r}")
+        return registros
+
+    def _recortar_respaldo(self, f, pendientes: list[dict]):
+        """Reemplaza el respaldo por lo que no se guardó más lo que falta leer de `f`"""
+        tmp_path = f"{self.spill_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as destino:
+            destino.writelines(self._linea(r) for r in pendientes)
+            shutil.copyfileobj(f, destino)
+        f.close()
+        os.replace(tmp_path, self.spill_path)
+
+    async def _reintentar_respaldo(self) -> bool:
+        """Vuelve a insertar el archivo de respaldo en orden, de a `batch_size` registros.
+
+        Si un lote falla, el archivo queda con lo que no se guardó de ese lote
+        y lo que faltaba leer, y se devuelve False.
+        """
+        async with self._lock_respaldo:
+            self._hay_respaldo = False
+            if not await asyncio.to_thread(os.path.exists, self.spill_path):
+                return True
+            print("⚡ Reintentando registros del respaldo de logs")
+            f = await asyncio.to_thread(open, self.spill_path, "r", encoding="utf-8")
+            guardados = 0
+            try:
+                while True:
+                    registros = await asyncio.to_thread(self._leer_respaldo, f, self.batch_size)
+                    if not registros:
+                        break
+                    pendientes = await self._guardar(registros)
+                    guardados += len(registros) - len(pendientes)
+                    if pendientes:
+                        await asyncio.to_thread(self._recortar_respaldo, f, pendientes)
+                        self._hay_respaldo = True
+                        return False
+            finally:
+                f.close()
+            await asyncio.to_thread(os.unlink, self.spill_path)
+        print(f"✅ Respaldo de logs reinsertado: {guardados} registros")
+        return True
+
+    # --- Vaciado por lotes ---------------------------------------------------
+
+    @staticmethod
+    def _fecha(ts: float) -> datetime:
+        return datetime.fromtimestamp(ts, tz=timezone.utc)
+
+    @staticmethod
+    def _marca(fecha: Optional[datetime]) -> float:
+        """Inverso de _fecha; SQLite devuelve fechas sin zona (guardadas en UTC)"""
+        if fecha is None:
+            return 0.0
+        if fecha.tzinfo is None:
+            fecha = fecha.replace(tzinfo=timezone.utc)
+        return fecha.timestamp()
+
+    async def _flush(self, lote: list[dict]):
+        # El respaldo va primero: sus registros son anteriores a los del lote
+        if self._hay_respaldo:
+            try:
+                al_dia = await self._reintentar_respaldo()
+            except Exception as e:
+                print(f"⚠️ No se pudo reintentar el respaldo de logs: {e}")
+                al_dia = False
+            if not al_dia:
+                # La DB sigue fallando: el lote se respalda detrás de lo pendiente
+                await self._respaldar(lote)
+                return
+        pendientes = await self._guardar(lote)
+        if pendientes:
+            await self._respaldar(pendientes)
+
+    async def _guardar(self, lote: list[dict]) -> list[dict]:
+        """Escribe el lote (ordenado por ts) en una transacción.
+
+        Devuelve los registros que no quedaron guardados; el que llama los respalda.
+        """
+        lote = sorted(lote, key=lambda r: r["ts"])
+        inicio = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                await self._escribir(db, lote)
+                await db.commit()
+            pendientes = []
+        except IntegrityError:
+            # Otro worker escribió turnos de la misma llamada: insertar uno a uno
+            pendientes = await self._flush_individual(lote)
+        except Exception as e:
+            print(f"⚠️ Error guardando lote en DB, se respalda en disco: {e}")
+            return lote
+
+        guardados = len(lote) - len(pendientes)
+        if guardados:
+            DB_FLUSH_SECONDS.observe(time.perf_counter() - inicio)
+            LOG_RECORDS.labels("written").inc(guardados)
+            self.written += guardados
+            self.batches += 1
+        return pendientes
+
+    async def _escribir(self, db, lote: list[dict]):
+        """Llamadas, turnos, resumen y estadísticas de un lote ordenado por ts (sin commit)"""
+        calls = [r for r in lote if r["tipo"] == "call"]
+        interacciones = [r for r in lote if r["tipo"] == "interaction"]
+        await self._asegurar_llamadas(db, calls, interacciones)
+        if interacciones:
+            filas = await self._asignar_turnos(db, interacciones)
+            await db.execute(insert(models.Interaction), filas)
+            await self._actualizar_resumen(db, interacciones)
+        # Estadísticas en la misma transacción que las filas crudas
+        await actualizar_rollups(db, lote)
+
+    def _fila_llamada(self, r: dict) -> dict:
+        e164 = normalizar_telefono(r["user_phone"])
+        return {
+            "call_sid": r["call_sid"],
+            "user_phone": r["user_phone"],
+            "phone_e164": e164,
+            "phone_reversed": invertir(e164),
+            "start_time": self._fecha(r["ts"]),
+            "interaction_log": [],
+            "status": "active",
+        }
+
+    async def _asegurar_llamadas(self, db, calls: list[dict], interacciones: list[dict]):
+        """Inserta las llamadas del lote y una fila provisional para las que tienen
+        turnos pero cuyo registro "call" aún no llega (respaldo o cola llena), así
+        el UPDATE del resumen siempre encuentra su fila.
+
+        calls.call_sid es único: si otro worker creó la fila entre el SELECT y
+        el INSERT, ON CONFLICT DO NOTHING la deja y se completa como existente.
+        """
+        sids = {r["call_sid"] for r in calls} | {r["call_sid"] for r in interacciones}
+        if not sids:
+            return
+        result = await db.execute(
+            select(models.CallLog.call_sid).where(models.CallLog.call_sid.in_(sids)).distinct()
+        )
+        existentes = set(result.scalars())
+
+        nuevas: dict[str, dict] = {}
+        for r in calls:
+            if r["call_sid"] not in existentes:
+                nuevas.setdefault(r["call_sid"], self._fila_llamada(r))
+        for r in interacciones:
+            if r["call_sid"] not in existentes and r["call_sid"] not in nuevas:
+                nuevas[r["call_sid"]] = {
+                    "call_sid": r["call_sid"],
+                    "user_phone": None,
+                    "phone_e164": None,
+                    "phone_reversed": None,
+                    "start_time": self._fecha(r["ts"]),
+                    "interaction_log": [],
+                    "status": "active",
+                }
+        insertadas = set()
+        if nuevas:
+            result = await db.execute(
+                insert_dialecto(db, models.CallLog)
+                .on_conflict_do_nothing(index_elements=["call_sid"])
+                .returning(models.CallLog.call_sid),
+                list(nuevas.values()),
+            )
+            insertadas = set(result.scalars())
+
+        for r in calls:
+            if r["call_sid"] in insertadas:
+                continue
+            # Completa la fila provisional creada por un turno anterior (u otro worker)
+            fila = self._fila_llamada(r)
+            inicio = fila["start_time"]
+            await db.execute(
+                update(models.CallLog)
+                .where(models.CallLog.call_sid == r["call_sid"])
+                .values(
+                    user_phone=func.coalesce(models.CallLog.user_phone, fila["user_phone"]),
+                    phone_e164=func.coalesce(models.CallLog.phone_e164, fila["phone_e164"]),
+                    phone_reversed=func.coalesce(models.CallLog.phone_reversed, fila["phone_reversed"]),
+                    start_time=case((models.CallLog.start_time > inicio, inicio), else_=models.CallLog.start_time),
+                )
+            )
+
+    async def _asignar_turnos(self, db, interacciones: list[dict]) -> list[dict]:
+        """Calcula turn_index por orden de ts con una sola consulta por lote.
+
+        Si algún turno es anterior al último ya guardado de su llamada, se
+        intercala y se renumeran los existentes (_renumerar).
+        """
+        por_llamada: dict[str, list[dict]] = {}
+        for r in sorted(interacciones, key=lambda r: r["ts"]):
+            por_llamada.setdefault(r["call_sid"], []).append(r)
+        result = await db.execute(
+            select(
+                models.Interaction.call_sid,
+                func.max(models.Interaction.turn_index),
+                func.max(models.Interaction.created_at),
+            )
+            .where(models.Interaction.call_sid.in_(por_llamada))
+            .group_by(models.Interaction.call_sid)
+        )
+        guardados = {sid: (maximo, ultimo) for sid, maximo, ultimo in result.all()}
+
+        filas = []
+        for call_sid, turnos in por_llamada.items():
+            maximo, ultimo = guardados.get(call_sid, (-1, None))
+            if ultimo is None or turnos[0]["ts"] >= self._marca(ultimo):
+                filas.extend(self._fila_interaccion(r, maximo + 1 + i) for i, r in enumerate(turnos))
+            else:
+                filas.extend(await self._renumerar(db, call_sid, turnos))
+        return filas
+
+    async def _renumerar(self, db, call_sid: str, turnos: list[dict]) -> list[dict]:
+        """Intercala por ts los turnos nuevos con los guardados de la llamada"""
+        result = await db.execute(
+            select(models.Interaction.id, models.Interaction.created_at)
+            .where(models.Interaction.call_sid == call_sid)
+            .order_by(models.Interaction.turn_index)
+        )
+        # (ts, desempate, id guardado o registro nuevo); a igual ts, primero lo guardado
+        orden = [(self._marca(creado), 0, i, id_) for i, (id_, creado) in enumerate(result.all())]
+        orden += [(r["ts"], 1, i, r) for i, r in enumerate(turnos)]
+        orden.sort(key=lambda e: e[:3])
+
+        # Índices negativos temporales para no chocar con uq_interactions_call_turn
+        await db.execute(
+            update(models.Interaction)
+            .where(models.Interaction.call_sid == call_sid)
+            .values(turn_index=-models.Interaction.turn_index - 1)
+        )
+        filas = []
+        for turno, (_, es_nuevo, _, item) in enumerate(orden):
+            if es_nuevo:
+                filas.append(self._fila_interaccion(item, turno))
+            else:
+                await db.execute(
+                    update(models.Interaction).where(models.Interaction.id == item).values(turn_index=turno)
+                )
+        return filas
+
+    async def _actualizar_resumen(self, db, interacciones: list[dict]):
+        """Un UPDATE por llamada del lote: turn_count, y última pregunta y actividad
+        solo si el turno más nuevo del lote es posterior a la registrada"""
+        por_llamada: dict[str, list[dict]] = {}
+        for r in interacciones:
+            por_llamada.setdefault(r["call_sid"], []).append(r)
+        for call_sid, turnos in por_llamada.items():
+            ultimo = max(turnos, key=lambda r: r["ts"])
+            fecha = self._fecha(ultimo["ts"])
+            mas_reciente = or_(models.CallLog.last_activity.is_(None), models.CallLog.last_activity <= fecha)
+            await db.execute(
+                update(models.CallLog)
+                .where(models.CallLog.call_sid == call_sid)
+                .values(
+                    turn_count=models.CallLog.turn_count + len(turnos),
+                    last_question=case((mas_reciente, ultimo["user_text"]), else_=models.CallLog.last_question),
+                    last_activity=case((mas_reciente, fecha), else_=models.CallLog.last_activity),
+                )
+            )
+
+    def _fila_interaccion(self, r: dict, turn_index) -> dict:
+        return {
+            "call_sid": r["call_sid"],
+            "turn_index": turn_index,
+            "user_text": r["user_text"],
+            "ai_text": r["ai_text"],
+            "confidence": r["confidence"],
+            "latencies": r["latencies"],
+            "created_at": self._fecha(r["ts"]),
+        }
+
+    async def _flush_individual(self, lote: list[dict]) -> list[dict]:
+        """Camino lento: una transacción por registro (el lote ya viene ordenado por ts).
+
+        Si uno falla se devuelven ese y los siguientes; los anteriores ya están
+        confirmados y no deben respaldarse (se insertarían dos veces).
+        """
+        for i, r in enumerate(lote):
+            try:
+                async with self.session_factory() as db:
+                    await self._escribir(db, [r])
+                    await db.commit()
+            except Exception as e:
+                print(f"⚠️ Error guardando registro en DB, se respaldan {len(lote) - i}: {e}")
+                return lote[i:]
+        return []
+
+    async def _run(self):
+        while True:
+            primero = await self._queue.get()
+            if primero is _FIN:
+                return
+            lote = [primero]
+            terminar = False
+            limite = time.monotonic() + self.flush_interval
+            while len(lote) < self.batch_size:
+                restante = limite - time.monotonic()
+                if restante <= 0:
+                    break
+                try:
+                    registro = await asyncio.wait_for(self._queue.get(), restante)
+                except asyncio.TimeoutError:
+                    break
+                if registro is _FIN:
+                    terminar = True
+                    break
+                lote.append(registro)
+            try:
+                await self._flush(lote)
+            except Exception as e:
+                # El worker no debe morir: stop() no drenaría la cola y los
+                # webhooks seguirían encolando sin que nadie escriba
+                print(f"❌ Error inesperado vaciando lote de logs, se respalda en disco: {e}")
+                await self._respaldar(lote)
+            if terminar:
+                return
+
+    # --- Ciclo de vida -------------------------------------------------------
+
+    async def start(self):
+        try:
+            await self._reintentar_respaldo()
+        except Exception as e:
+            print(f"⚠️ No se pudo reintentar el respaldo de logs: {e}")
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Drena la cola: el worker vacía todo lo encolado antes de la marca de fin"""
+        if not self._worker or self._worker.done():
+            return
+        pendientes = self._queue.qsize()
+        await self._queue.put(_FIN)
+        await self._worker
+        if self._volcado is not None:
+            await self._volcado
+        if pendientes:
+            print(f"✅ Logs drenados al apagar: {pendientes} registros")
+
+    def stats(self) -> dict:
+        return {
+            "queued": self._queue.qsize(),
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "spilled": self.spilled,
+            "batches": self.batches,
+        }
+
+
+interaction_logger = InteractionLogger(
+    AsyncSessionLocal,
+    max_queue=int(os.getenv("LOG_QUEUE_MAX", "10000")),
+    batch_size=int(os.getenv("LOG_BATCH_SIZE", "200")),
+    flush_interval=float(os.getenv("LOG_FLUSH_INTERVAL", "0.5")),
+    spill_path=os.getenv("LOG_SPILL_PATH", "interaction_spill.jsonl"),
+)
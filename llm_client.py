@@ -0,0 +1,139 @@
+"""
+Cliente LLM asíncrono para Gemini.
+
+El SDK `google.generativeai` con transporte REST es síncrono: llamar a
+`generate_content` dentro de un `async def` bloquea el event loop de uvicorn
+durante todo el round-trip. Este módulo ejecuta las llamadas en un pool de
+threads dedicado, con modelos construidos una sola vez, sesión HTTP compartida,
+timeout por llamada y un límite de concurrencia.
+"""
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Optional
+
+import google.generativeai as genai
+from google.generativeai import client as genai_client
+from requests.adapters import HTTPAdapter
+
+EMBEDDING_MODEL = "models/text-embedding-004"
+
+
+def configurar_gemini(api_key: Optional[str] = None):
+    """Configura genai con transporte REST.
+
+    GEMINI_BASE_URL permite apuntar el SDK a otro servidor con la misma API
+    (p. ej. benchmarks/fake_providers.py); acepta "http://host:puerto".
+    """
+    base_url = os.getenv("GEMINI_BASE_URL")
+    genai.configure(
+        api_key=api_key or os.getenv("GEMINI_API_KEY"),
+        transport="rest",
+        client_options={"api_endpoint": base_url} if base_url else None,
+    )
+
+
+class LLMTimeoutError(Exception):
+    """La llamada a Gemini superó el timeout configurado"""
+
+
+class LLMClient:
+    """Fachada asíncrona sobre Gemini (generación y embeddings)"""
+
+    def __init__(self, max_concurrency: int = 8, timeout: float = 10.0, embed_timeout: float = 3.0):
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.embed_timeout = embed_timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="gemini")
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._models: dict[str, genai.GenerativeModel] = {}
+        # Sesión REST ya ajustada; genai.configure() crea clientes nuevos
+        self._sesion_ajustada = None
+
+    def get_model(self, model_name: str) -> genai.GenerativeModel:
+        """Devuelve el modelo cacheado (se construye una sola vez por nombre)"""
+        model = self._models.get(model_name)
+        if model is None:
+            model = genai.GenerativeModel(model_name)
+            self._models[model_name] = model
+        return model
+
+    def _ajustar_pool_http(self):
+        """Dimensiona el pool de conexiones de la sesión REST compartida de genai.
+
+        Por defecto urllib3 guarda 10 conexiones por host; con más threads
+        concurrentes las sobrantes se descartan y cada llamada repite el
+        handshake TLS.
+        """
+        try:
+            session = genai_client.get_default_generative_client()._transport._session
+            if session is self._sesion_ajustada:
+                return
+            self._sesion_ajustada = session
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(self.max_concurrency, 10))
+            session.mount("https://", adapter)
+            # GEMINI_BASE_URL puede ser http:// (servidor local de pruebas)
+            session.mount("http://", adapter)
+        except Exception as e:
+            print(f"⚠️ No se pudo ajustar el pool HTTP de Gemini: {e}")
+
+    async def _run(self, func, timeout: float):
+        """Ejecuta `func` en el pool respetando el límite de concurrencia y el timeout"""
+        self._ajustar_pool_http()
+        loop = asyncio.get_running_loop()
+        async with self._semaphore:
+            try:
+                return await asyncio.wait_for(loop.run_in_executor(self._executor, func), timeout)
+            except asyncio.TimeoutError:
+                raise LLMTimeoutError(f"Gemini no respondió en {timeout}s")
+
+    async def generate(
+        self,
+        prompt: str,
+        model_name: Optional[str] = None,
+        temperature: float = 0.7,
+        max_output_tokens: int = 300,
+        timeout: Optional[float] = None,
+    ):
+        """Genera contenido sin bloquear el event loop"""
+        timeout = timeout or self.timeout
+        model = self.get_model(model_name or os.getenv("GEMINI_MODEL", "gemini-pro"))
+        func = partial(
+            model.generate_content,
+            prompt,
+            generation_config=genai.types.GenerationConfig(
+                temperature=temperature,
+                max_output_tokens=max_output_tokens,
+            ),
+            request_options={"timeout": timeout},
+        )
+        return await self._run(func, timeout)
+
+    async def embed(
+        self,
+        content: str,
+        task_type: str = "retrieval_query",
+        timeout: Optional[float] = None,
+    ) -> list[float]:
+        """Genera el embedding de un texto sin bloquear el event loop"""
+        timeout = timeout or self.embed_timeout
+        func = partial(
+            genai.embed_content,
+            model=EMBEDDING_MODEL,
+            content=content,
+            task_type=task_type,
+            request_options={"timeout": timeout},
+        )
+        result = await self._run(func, timeout)
+        return result["embedding"]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+llm = LLMClient(
+    max_concurrency=int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")),
+    timeout=float(os.getenv("GEMINI_TIMEOUT", "10")),
+    embed_timeout=float(os.getenv("GEMINI_EMBED_TIMEOUT", "3")),
+)
@@ -1,48 +1,63 @@
-from typing import Optional
+from typing import Optional, Union
 
 import os
 from fastapi import FastAPI, Request
-from fastapi.responses import Response, FileResponse
+from fastapi.responses import Response, FileResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 from twilio.twiml.voice_response import VoiceResponse
-import google.generativeai as genai
 from elevenlabs import ElevenLabs, VoiceSettings
 from dotenv import load_dotenv
-import hashlib
 import time
+import uuid
 import asyncio
 from contextlib import asynccontextmanager
-import chromadb
-from sqlalchemy.orm import Session
-from database import SessionLocal, engine, get_db
+from database import async_engine, AsyncSessionLocal
 import models
-from fastapi import Depends
 from routers import api
-
-# Crear tablas
-models.Base.metadata.create_all(bind=engine)
+from llm_client import llm, LLMTimeoutError, configurar_gemini
+from answer_cache import answer_cache
+from embedding_cache import embedding_cache
+from retrieval import crear_retriever, BM25Retriever
+from chunking import estimar_tokens
+from prompt_builder import Prompt, construir_prompt
+from audio_cache import audio_cache, hash_texto, AUDIO_DIR
+from metrics import (
+    StageTimer, exportar, REQUEST_SECONDS, TTS_SECONDS, FALLBACKS, QUOTA_ERRORS,
+    IN_FLIGHT, ACTIVE_CALLS, CACHE_ENTRIES, LOG_QUEUE, PROMPT_TOKENS, LLM_TOKENS, INTENT_TURNS,
+)
+from interaction_logger import interaction_logger
+from intent_router import intent_router
+from tts_prewarm import ciclo_precalentamiento
 
 load_dotenv()
 
-# Configurar Gemini
-genai.configure(
-    api_key=os.getenv("GEMINI_API_KEY"),
-    transport="rest"
-)
+# Configurar Gemini (REST; GEMINI_BASE_URL opcional)
+configurar_gemini()
 print(f"🤖 Gemini configurado - Modelo: {os.getenv('GEMINI_MODEL', 'gemini-pro')}")
 
 # Configurar ElevenLabs
 elevenlabs_client = ElevenLabs(
-    api_key=os.getenv("ELEVENLABS_API_KEY")
+    api_key=os.getenv("ELEVENLABS_API_KEY"),
+    # Otro servidor con la misma API (p. ej. benchmarks/fake_providers.py)
+    base_url=os.getenv("ELEVENLABS_BASE_URL") or None,
 )
 
 # Crear carpeta para archivos de audio
-AUDIO_DIR = "audio_files"
 os.makedirs(AUDIO_DIR, exist_ok=True)
 
-# Cache de audios en memoria para respuesta instantánea
-audio_cache: dict[str, str] = {}
+# Cada cuántos segundos la tarea de fondo elimina audios expirados
+AUDIO_CACHE_JANITOR_INTERVAL = int(os.getenv("AUDIO_CACHE_JANITOR_INTERVAL", "600"))
+
+# Textos registrados para síntesis en streaming (hash -> (texto, registrado en))
+pending_streams: dict[str, tuple[str, float]] = {}
+# Los que Twilio nunca pide (llamada colgada, <Say> de respaldo) expiran
+AUDIO_STREAM_TTL = float(os.getenv("AUDIO_STREAM_TTL", "300"))
+
+# Síntesis en curso por hash: las peticiones concurrentes del mismo texto
+# esperan la misma llamada a ElevenLabs en lugar de lanzar otra
+sintesis_en_curso: dict[str, asyncio.Future] = {}
 
 # Mensajes comunes para pre-generar
 COMMON_MESSAGES = [
@@ -54,14 +69,73 @@ COMMON_MESSAGES = [
     "¡Que tengas un excelente día! Hasta pronto."
 ]
 
-# Inicializar ChromaDB para RAG
+# Respuestas del router de intenciones: se pre-generan y fijan igual que los mensajes comunes
+MENSAJES_FIJOS = COMMON_MESSAGES + [r for r in intent_router.respuestas() if r not in COMMON_MESSAGES]
+
+# Textos fijos que cierran cada turno
+TEXTO_CONTINUAR = "¿Hay algo más en lo que pueda ayudarte?"
+TEXTO_DESPEDIDA = "¡Que tengas un excelente día! Hasta pronto."
+
+# Cada cuántos segundos se persiste el cache de embeddings de consulta
+EMBEDDING_CACHE_SAVE_INTERVAL = int(os.getenv("EMBEDDING_CACHE_SAVE_INTERVAL", "300"))
+
+# Marca que vectorize_context.py reescribe en cada re-vectorización
+KB_VERSION_FILE = "./chroma_db/kb_version.txt"
+
+# Última actividad por CallSid; una llamada sin webhooks en este tiempo ya no cuenta como activa.
+# Ordenado por actividad (la más vieja primero); solo se toca desde el event loop
+CALL_IDLE_TIMEOUT = float(os.getenv("CALL_IDLE_TIMEOUT", "60"))
+ultima_actividad: dict[str, float] = {}
+
+# Webhooks de Twilio que se miden en /metrics (ruta -> etiqueta)
+WEBHOOKS_MEDIDOS = {"/inicio": "inicio", "/voice": "voice", "/recording": "recording"}
+
+
+def _podar_inactivas():
+    """Quita desde el frente las llamadas sin actividad (las que colgaron sin despedirse)"""
+    limite = time.monotonic() - CALL_IDLE_TIMEOUT
+    while ultima_actividad:
+        call_sid = next(iter(ultima_actividad))
+        if ultima_actividad[call_sid] >= limite:
+            break
+        del ultima_actividad[call_sid]
+
+
+def registrar_actividad(call_sid: str):
+    # Reinsertar mueve la llamada al final: el dict queda ordenado por actividad
+    ultima_actividad.pop(call_sid, None)
+    ultima_actividad[call_sid] = time.monotonic()
+    _podar_inactivas()
+
+
+def contar_llamadas_activas() -> int:
+    _podar_inactivas()
+    return len(ultima_actividad)
+
+
+ACTIVE_CALLS.set_function(contar_llamadas_activas)
+CACHE_ENTRIES.labels("audio_memory").set_function(lambda: audio_cache.stats()["memory_entries"])
+CACHE_ENTRIES.labels("audio_disk").set_function(lambda: audio_cache.stats()["disk_files"])
+CACHE_ENTRIES.labels("embeddings").set_function(lambda: embedding_cache.stats()["entries"])
+CACHE_ENTRIES.labels("answers").set_function(lambda: answer_cache.stats()["entries"])
+LOG_QUEUE.set_function(lambda: interaction_logger.stats()["queued"])
+
+# Índice léxico BM25 (sin red): backend propio y fallback cuando fallan los embeddings
+try:
+    lexical_retriever = BM25Retriever()
+    print(f"✅ Índice BM25 construido ({len(lexical_retriever.chunks)} chunks)")
+except Exception as e:
+    print(f"⚠️ Error construyendo índice BM25: {e}")
+    lexical_retriever = None
+
+# Inicializar el backend de recuperación para RAG (chroma | numpy | bm25 | hybrid)
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "chroma")
 try:
-    chroma_client = chromadb.PersistentClient(path="./chroma_db")
-    knowledge_collection = chroma_client.get_collection("orisod_knowledge")
-    print("✅ ChromaDB cargado - RAG activado")
+    retriever = crear_retriever(RETRIEVER_BACKEND, lexical=lexical_retriever)
+    print(f"✅ Retriever '{RETRIEVER_BACKEND}' cargado - RAG activado")
     RAG_ENABLED = True
 except Exception as e:
-    print(f"⚠️ ChromaDB no disponible, usando contexto completo: {e}")
+    print(f"⚠️ Retriever '{RETRIEVER_BACKEND}' no disponible, usando BM25/contexto completo: {e}")
     # Fallback: cargar contexto completo
     try:
         with open("contexto_orisod.txt", "r", encoding="utf-8") as f:
@@ -72,138 +146,381 @@ except Exception as e:
     RAG_ENABLED = False
 
 
-def buscar_contexto_relevante(pregunta: str, top_k: int = 3) -> str:
-    """Busca los chunks más relevantes del contexto usando RAG"""
-    if not RAG_ENABLED:
-        return CONTEXTO_ORISOD
-    
+def _es_error_de_cuota(error: Exception) -> bool:
+    error_str = str(error).lower()
+    return "429" in error_str or "quota" in error_str
+
+
+def version_conocimiento() -> str:
+    """Versión de la base de conocimiento (cambia cada vez que se re-vectoriza)"""
     try:
-        # Generar embedding de la pregunta
-        result = genai.embed_content(
-            model="models/text-embedding-004",
-            content=pregunta,
-            task_type="retrieval_query"
-        )
-        query_embedding = result['embedding']
-        
-        # Buscar chunks más similares
-        results = knowledge_collection.query(
-            query_embeddings=[query_embedding],
-            n_results=top_k
-        )
-        
-        # Combinar los chunks relevantes
-        contexto_relevante = "\n\n".join(results['documents'][0])
-        print(f"🔍 RAG: Recuperados {len(results['documents'][0])} chunks relevantes")
-        return contexto_relevante
-        
+        return str(os.stat(KB_VERSION_FILE).st_mtime_ns)
+    except OSError:
+        return "0"
+
+
+retriever_version = version_conocimiento()
+
+
+def actualizar_retriever():
+    """Recarga los índices si vectorize_context.py activó otra versión.
+
+    La versión anterior sigue en disco, así que las búsquedas en curso terminan
+    con el retriever viejo; si la recarga falla se conserva el anterior.
+    """
+    global retriever, lexical_retriever, retriever_version, RAG_ENABLED
+    version = version_conocimiento()
+    if version == retriever_version:
+        return
+    retriever_version = version
+    try:
+        lexico = BM25Retriever()
+        nuevo = crear_retriever(RETRIEVER_BACKEND, lexical=lexico)
     except Exception as e:
-        print(f"⚠️ Error en RAG, usando contexto completo: {e}")
-        return CONTEXTO_ORISOD if 'CONTEXTO_ORISOD' in globals() else ""
+        print(f"⚠️ No se pudo recargar el retriever, se mantiene el anterior: {e}")
+        return
+    lexical_retriever, retriever, RAG_ENABLED = lexico, nuevo, True
+    print(f"🔄 Retriever '{RETRIEVER_BACKEND}' recargado (nueva versión de la base de conocimiento)")
+
 
+async def obtener_embedding(pregunta: str) -> Optional[list[float]]:
+    """Embedding de la consulta; None si el RAG no está activo, no lo necesita o Gemini falla"""
+    if not RAG_ENABLED or not retriever.needs_embedding:
+        return None
 
+    # Las preguntas repetidas no pasan por la red
+    embedding = embedding_cache.get(pregunta)
+    if embedding is not None:
+        return embedding
+
+    try:
+        # Generar embedding de la pregunta (sin bloquear el event loop)
+        embedding = await llm.embed(pregunta, task_type="retrieval_query")
+    except Exception as e:
+        print(f"⚠️ Error generando embedding: {e}")
+        FALLBACKS.labels("embedding_error").inc()
+        if _es_error_de_cuota(e):
+            QUOTA_ERRORS.labels("gemini").inc()
+        return None
+
+    embedding_cache.put(pregunta, embedding)
+    return embedding
+
+
+def buscar_contexto_relevante(pregunta: str, query_embedding: Optional[list[float]], top_k: int = 3) -> Union[list[dict], str]:
+    """Busca los chunks más relevantes del contexto usando RAG
+
+    Si el backend necesita embedding y no lo hay (error o timeout de Gemini),
+    cae al índice BM25 local en lugar de enviar el contexto completo. Devuelve
+    los chunks ordenados por relevancia, o el texto completo como último recurso;
+    prompt_builder los recorta al presupuesto de tokens.
+    """
+    if RAG_ENABLED and (query_embedding is not None or not retriever.needs_embedding):
+        try:
+            # Buscar chunks más similares
+            chunks = retriever.search(pregunta, query_embedding, top_k=top_k)
+            if chunks:
+                print(f"🔍 RAG ({retriever.name}): Recuperados {len(chunks)} chunks relevantes")
+                return chunks
+        except Exception as e:
+            print(f"⚠️ Error en RAG, usando BM25: {e}")
+
+    if lexical_retriever is not None:
+        FALLBACKS.labels("retrieval_bm25").inc()
+        # Sin coincidencias léxicas se envía la descripción general (primer chunk)
+        chunks = lexical_retriever.search(pregunta, None, top_k=top_k) or lexical_retriever.chunks[:1]
+        print(f"🔍 BM25 (fallback): Recuperados {len(chunks)} chunks")
+        return chunks
+
+    FALLBACKS.labels("retrieval_full_context").inc()
+    return CONTEXTO_ORISOD if 'CONTEXTO_ORISOD' in globals() else ""
+
+
+def registrar_tokens(prompt: Prompt, result=None):
+    """Tokens de entrada/salida del turno: log y métricas.
+
+    Usa el conteo real de Gemini (usage_metadata) si viene en la respuesta y
+    la estimación de prompt_builder si no.
+    """
+    uso = getattr(result, "usage_metadata", None)
+    entrada = getattr(uso, "prompt_token_count", None) or prompt.tokens
+    salida = getattr(uso, "candidates_token_count", None)
+    if salida is None:
+        salida = estimar_tokens(result.text) if result is not None and result.parts else 0
+    recortados = max(prompt.tokens_originales - prompt.tokens_contexto, 0)
+
+    PROMPT_TOKENS.observe(entrada)
+    LLM_TOKENS.labels("prompt").inc(entrada)
+    LLM_TOKENS.labels("output").inc(salida)
+    LLM_TOKENS.labels("trimmed").inc(recortados)
+    print(f"🧮 Tokens: entrada={entrada} salida={salida} | contexto {prompt.tokens_contexto}/{prompt.tokens_originales} "
+          f"({prompt.duplicadas} oraciones duplicadas, {prompt.descartadas} descartadas)")
+
+
+async def generar_respuesta(user_input: str, contexto_relevante: Union[list[dict], str]) -> tuple[str, bool]:
+    """Genera la respuesta con Gemini.
+
+    Devuelve (respuesta, es_respuesta_real); el flag es False cuando se usó un
+    mensaje de error genérico, que no debe guardarse en el cache de respuestas.
+    """
+    # Contexto deduplicado y recortado a PROMPT_TOKEN_BUDGET
+    prompt = construir_prompt(user_input, contexto_relevante)
+
+    try:
+        # Modelo cacheado en el cliente LLM; la llamada corre en un pool de threads
+        # con timeout y límite de concurrencia para no bloquear otras llamadas
+        result = await llm.generate(prompt.texto, temperature=0.7, max_output_tokens=300)
+        registrar_tokens(prompt, result)
+
+        # Verificar si hay partes generadas antes de acceder a text
+        if result.parts:
+            respuesta = result.text.strip()
+            print(f"🤖 IA responde: {respuesta}")
+            return respuesta, True
+
+        FALLBACKS.labels("llm_empty").inc()
+        print(f"⚠️ Gemini retornó respuesta vacía. Finish reason: {result.candidates[0].finish_reason if result.candidates else 'Unknown'}")
+        return "Lo siento, no pude generar una respuesta. ¿Puedes preguntar de otra forma?", False
+    except LLMTimeoutError as e:
+        FALLBACKS.labels("llm_timeout").inc()
+        print(f"⚠️ {e} - Usando respuesta genérica")
+        return "Lo siento, estoy teniendo un problema técnico. ¿Puedes repetir tu pregunta?", False
+    except Exception as e:
+        # Detectar quota exceeded específicamente
+        if _es_error_de_cuota(e):
+            QUOTA_ERRORS.labels("gemini").inc()
+            FALLBACKS.labels("llm_quota").inc()
+            print(f"⚠️ Cuota de Gemini excedida - Usando respuesta genérica")
+            return "Lo siento, estoy experimentando alta demanda en este momento. Por favor, deja tus datos de contacto y te responderemos pronto.", False
+        FALLBACKS.labels("llm_error").inc()
+        print(f"❌ Error al generar respuesta: {e}")
+        return "Lo siento, estoy teniendo un problema técnico. ¿Puedes repetir tu pregunta?", False
+
+
+def _convertir_audio(texto: str):
+    """Lanza la síntesis en ElevenLabs y devuelve el iterador de chunks MP3"""
+    return elevenlabs_client.text_to_speech.convert(
+        text=texto,
+        voice_id=os.getenv("ELEVEN_VOICE_ID", "7QQzpAyzlKTVrRzQJmTE"),
+        model_id="eleven_turbo_v2_5",  # TURBO para velocidad 2-3x
+        voice_settings=VoiceSettings(
+            stability=0.3,  # Menor estabilidad = más rápido
+            similarity_boost=0.5,
+            style=0.0,
+            use_speaker_boost=False  # Desactivar para menor latencia
+        )
+    )
+
+
+def _escribir_atomico(filepath: str, chunks, on_chunk=None):
+    """Escribe los chunks en un temporal único y lo renombra al terminar.
+
+    Así nunca se sirve un MP3 a medio escribir y dos escrituras simultáneas
+    no se pisan; `on_chunk` permite reenviar cada chunk mientras se escribe.
+    """
+    tmp_path = f"{filepath}.{uuid.uuid4().hex}.part"
+    try:
+        with open(tmp_path, "wb") as f:
+            for chunk in chunks:
+                f.write(chunk)
+                if on_chunk:
+                    on_chunk(chunk)
+        os.replace(tmp_path, filepath)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+
+
+def _registrar_sintesis(texto_hash: str, tarea: asyncio.Future):
+    sintesis_en_curso[texto_hash] = tarea
+    tarea.add_done_callback(lambda _: sintesis_en_curso.pop(texto_hash, None))
+
+
+def _base_url(request: Request) -> str:
+    # Usar BASE_URL del .env si está disponible (para ngrok)
+    base_url = os.getenv("BASE_URL")
+    if not base_url:
+        base_url = str(request.base_url).rstrip('/')
+    return base_url
+
+
+def _registrar_stream(texto_hash: str, texto: str):
+    """Registra un texto para /audio/stream y descarta los registros expirados"""
+    ahora = time.monotonic()
+    for h in [h for h, (_, registrado) in pending_streams.items() if ahora - registrado > AUDIO_STREAM_TTL]:
+        del pending_streams[h]
+    pending_streams[texto_hash] = (texto, ahora)
+
+
+def _stream_pendiente(texto_hash: str) -> Optional[str]:
+    """Texto registrado para streaming, o None si no existe o ya expiró"""
+    entrada = pending_streams.get(texto_hash)
+    if entrada is None:
+        return None
+    texto, registrado = entrada
+    if time.monotonic() - registrado > AUDIO_STREAM_TTL:
+        pending_streams.pop(texto_hash, None)
+        return None
+    return texto
+
+
+async def generar_audio(texto: str, request: Request, streaming: Optional[bool] = None) -> Optional[str]:
+    """Genera audio con ElevenLabs con cache y modelo turbo para máxima velocidad
+
+    En modo streaming (AUDIO_STREAMING=true) no se espera a la síntesis: se
+    devuelve una URL /audio/stream/{id} que reenvía los chunks a Twilio
+    conforme llegan de ElevenLabs.
+    """
+    inicio = time.perf_counter()
+
+    def _medir(resultado: str):
+        TTS_SECONDS.labels(resultado).observe(time.perf_counter() - inicio)
 
-async def generar_audio(texto: str, request: Request) -> Optional[str]:
-    """Genera audio con ElevenLabs con cache y modelo turbo para máxima velocidad"""
     # Verificar si ElevenLabs está habilitado (permite desactivarlo temporalmente)
     if os.getenv("ENABLE_ELEVENLABS", "true").lower() == "false":
         print(f"⚠️ ElevenLabs desactivado, usando Twilio TTS fallback")
+        _medir("disabled")
         return None
+
+    if streaming is None:
+        streaming = os.getenv("AUDIO_STREAMING", "false").lower() == "true"
     
     try:
         # Hash simple del texto para cache permanente
-        texto_hash = hashlib.md5(texto.encode()).hexdigest()
+        texto_hash = hash_texto(texto)
 
         # Verificar cache en memoria primero (instantáneo)
-        if texto_hash in audio_cache:
+        url = audio_cache.get_url(texto_hash)
+        if url:
             print(f"✓ Audio desde cache (memoria): {texto[:30]}...")
-            print(f"  URL: {audio_cache[texto_hash]}")
-            return audio_cache[texto_hash]
+            print(f"  URL: {url}")
+            _medir("memory")
+            return url
 
-        # Verificar si existe en disco
+        # Verificar si existe en disco (índice en memoria, sin stat)
         filename = f"{texto_hash}.mp3"
-        filepath = os.path.join(AUDIO_DIR, filename)
-
-        if os.path.exists(filepath):
-            # Usar BASE_URL del .env si está disponible (para ngrok)
-            base_url = os.getenv("BASE_URL")
-            if not base_url:
-                base_url = str(request.base_url).rstrip('/')
-            url = f"{base_url}/audio/{filename}"
-            audio_cache[texto_hash] = url
+        filepath = audio_cache.filepath(texto_hash)
+
+        if audio_cache.on_disk(texto_hash):
+            url = f"{_base_url(request)}/audio/{filename}"
+            audio_cache.put_url(texto_hash, url)
             print(f"✓ Audio desde disco: {texto[:30]}...")
             print(f"  URL generada: {url}")
+            _medir("disk")
             return url
 
-        # Generar nuevo audio con modelo TURBO
-        print(f"⚡ Generando audio turbo: {texto[:30]}...")
-
-        def _generate():
-            audio_generator = elevenlabs_client.text_to_speech.convert(
-                text=texto,
-                voice_id=os.getenv("ELEVEN_VOICE_ID", "7QQzpAyzlKTVrRzQJmTE"),
-                model_id="eleven_turbo_v2_5",  # TURBO para velocidad 2-3x
-                voice_settings=VoiceSettings(
-                    stability=0.3,  # Menor estabilidad = más rápido
-                    similarity_boost=0.5,
-                    style=0.0,
-                    use_speaker_boost=False  # Desactivar para menor latencia
-                )
-            )
+        if streaming:
+            # Registrar el texto; la síntesis arranca cuando Twilio pida la URL
+            _registrar_stream(texto_hash, texto)
+            url = f"{_base_url(request)}/audio/stream/{texto_hash}"
+            print(f"⚡ Audio en streaming: {texto[:30]}...")
+            print(f"  URL: {url}")
+            _medir("stream")
+            return url
 
-            # Escribir inmediatamente para minimizar latencia
-            with open(filepath, "wb") as f:
-                for chunk in audio_generator:
-                    f.write(chunk)
+        tarea = sintesis_en_curso.get(texto_hash)
+        resultado = "miss" if tarea is None else "coalesced"
+        if tarea is None:
+            # Generar nuevo audio con modelo TURBO
+            print(f"⚡ Generando audio turbo: {texto[:30]}...")
 
-        # Ejecutar en thread para no bloquear
-        await asyncio.to_thread(_generate)
+            def _generate():
+                # Escribir inmediatamente para minimizar latencia
+                _escribir_atomico(filepath, _convertir_audio(texto))
+                audio_cache.register_file(texto_hash, os.path.getsize(filepath))
+
+            # Ejecutar en thread para no bloquear
+            tarea = asyncio.ensure_future(asyncio.to_thread(_generate))
+            _registrar_sintesis(texto_hash, tarea)
+        else:
+            print(f"⏳ Esperando síntesis en curso: {texto[:30]}...")
+
+        # shield: si esta petición se cancela, la síntesis compartida sigue
+        await asyncio.shield(tarea)
 
         # Guardar en cache y retornar
-        # Usar BASE_URL del .env si está disponible (para ngrok)
-        base_url = os.getenv("BASE_URL")
-        if not base_url:
-            base_url = str(request.base_url).rstrip('/')
-        url = f"{base_url}/audio/{filename}"
-        audio_cache[texto_hash] = url
+        url = f"{_base_url(request)}/audio/{filename}"
+        audio_cache.put_url(texto_hash, url)
         print(f"✓ Audio generado: {texto[:30]}...")
         print(f"  URL: {url}")
+        _medir(resultado)
         return url
 
     except Exception as e:
         # Solo mostrar error detallado si NO es quota exceeded (evitar spam en logs)
         error_str = str(e)
         if "quota_exceeded" in error_str:
+            QUOTA_ERRORS.labels("elevenlabs").inc()
             print(f"⚠️ Cuota ElevenLabs excedida, usando fallback Twilio TTS")
         else:
             print(f"❌ Error generando audio: {e}")
+        _medir("error")
         return None
 
 
-def limpiar_archivos_antiguos():
-    """Limpia archivos de audio antiguos (más de 24 horas)"""
-    try:
-        now = time.time()
-        for filename in os.listdir(AUDIO_DIR):
-            filepath = os.path.join(AUDIO_DIR, filename)
-            if os.path.isfile(filepath) and now - os.path.getmtime(filepath) > 86400:
-                os.unlink(filepath)
-    except Exception as e:
-        print(f"⚠️ Error limpiando archivos: {e}")
+async def stream_audio(texto_hash: str, texto: str, request: Request):
+    """Sintetiza en streaming: reenvía los chunks al cliente mientras los guarda en disco"""
+    filepath = audio_cache.filepath(texto_hash)
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    fin = object()
+
+    def _producir():
+        """Corre en un thread: tee de cada chunk al archivo y a la cola"""
+        try:
+            _escribir_atomico(
+                filepath,
+                _convertir_audio(texto),
+                on_chunk=lambda chunk: loop.call_soon_threadsafe(queue.put_nowait, chunk),
+            )
+            # El archivo solo aparece en el cache cuando está completo
+            audio_cache.register_file(texto_hash, os.path.getsize(filepath))
+            audio_cache.put_url(texto_hash, f"{_base_url(request)}/audio/{texto_hash}.mp3")
+            print(f"✓ Audio en streaming completado: {texto[:30]}...")
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            # Completo o fallido, el registro ya no sirve: el archivo está en disco o no hay audio
+            pending_streams.pop(texto_hash, None)
+            loop.call_soon_threadsafe(queue.put_nowait, fin)
+
+    # La síntesis sigue aunque Twilio corte la conexión, así el cache queda completo
+    _registrar_sintesis(texto_hash, loop.run_in_executor(None, _producir))
+
+    # Esperar el primer chunk antes de responder para poder reportar errores
+    primero = await queue.get()
+    if isinstance(primero, Exception) or primero is fin:
+        print(f"❌ Error en audio streaming: {primero}")
+        return Response(status_code=502)
+
+    async def _relay():
+        yield primero
+        while True:
+            item = await queue.get()
+            if item is fin:
+                break
+            if isinstance(item, Exception):
+                # Los headers ya se enviaron: abortar la conexión para que Twilio
+                # no tome el audio truncado como completo
+                print(f"❌ Error a mitad del audio streaming {texto_hash}: {item}")
+                raise item
+            yield item
+
+    return StreamingResponse(_relay(), media_type="audio/mpeg")
 
 
 @asynccontextmanager
 async def lifespan(app_instance: FastAPI):
     """Pre-generar audios comunes al iniciar para respuesta instantánea"""
 
-    # Función de pre-warming que se ejecuta completamente en background
+    # Pre-warming en background: mensajes fijos + respuestas frecuentes del historial
     async def prewarm():
         # Solo pre-generar si ElevenLabs está habilitado
         if os.getenv("ENABLE_ELEVENLABS", "true").lower() == "false":
             print("⚠️ ElevenLabs desactivado - Saltando pre-warming de audios")
             return
-            
-        print("⚡ Pre-generando audios comunes en background...")
+
         class MockRequest:
             def __init__(self):
                 self.base_url = type('obj', (object,), {
@@ -211,18 +528,46 @@ async def lifespan(app_instance: FastAPI):
                 })()
 
         mock_req = MockRequest()
-        for msg in COMMON_MESSAGES:
-            try:
-                await generar_audio(msg, mock_req)
-            except Exception as e:
-                print(f"  ✗ Error: {msg[:30]}... - {e}")
-        print("✅ Pre-warming completado")
+        await ciclo_precalentamiento(
+            MENSAJES_FIJOS,
+            lambda texto: generar_audio(texto, mock_req, streaming=False),
+            AsyncSessionLocal,
+        )
+
+    async def guardar_embeddings_periodicamente():
+        while True:
+            await asyncio.sleep(EMBEDDING_CACHE_SAVE_INTERVAL)
+            await asyncio.to_thread(embedding_cache.save)
+
+    # Crear tablas
+    async with async_engine.begin() as conn:
+        await conn.run_sync(models.Base.metadata.create_all)
+
+    # Logger write-behind (reintenta primero lo que quedó en el respaldo local)
+    await interaction_logger.start()
+
+    # Cache de embeddings persistido en el arranque anterior
+    await asyncio.to_thread(embedding_cache.load)
+
+    # Índice del cache de audio (único escaneo del directorio) y mensajes fijados
+    await asyncio.to_thread(audio_cache.scan)
+    for msg in MENSAJES_FIJOS:
+        audio_cache.pin(hash_texto(msg))
 
     # Lanzar en background SIN esperar
-    asyncio.create_task(prewarm())
+    prewarm_task = asyncio.create_task(prewarm())
+    guardado_task = asyncio.create_task(guardar_embeddings_periodicamente())
+    janitor_task = asyncio.create_task(audio_cache.janitor(AUDIO_CACHE_JANITOR_INTERVAL))
 
     yield
-    # No necesitamos cleanup porque la tarea se completa sola
+    prewarm_task.cancel()
+    guardado_task.cancel()
+    janitor_task.cancel()
+    await interaction_logger.stop()
+    embedding_cache.save()
+    # Liberar el pool de threads del cliente LLM y las conexiones a la DB
+    llm.shutdown()
+    await async_engine.dispose()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -234,67 +579,124 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # El dashboard lee el cursor de paginación de /api/calls
+    expose_headers=["X-Next-Cursor"],
 )
 
+# Comprimir respuestas JSON grandes (listados y transcripciones del dashboard)
+app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+
+@app.middleware("http")
+async def medir_webhooks(request: Request, call_next):
+    """Duración total y peticiones en curso de los webhooks de Twilio"""
+    endpoint = WEBHOOKS_MEDIDOS.get(request.url.path)
+    if endpoint is None:
+        return await call_next(request)
+    inicio = time.perf_counter()
+    with IN_FLIGHT.labels(endpoint).track_inprogress():
+        response = await call_next(request)
+    REQUEST_SECONDS.labels(endpoint).observe(time.perf_counter() - inicio)
+    return response
+
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    """Métricas en formato Prometheus (en el event loop, como los webhooks que
+    actualizan ultima_actividad)"""
+    cuerpo, content_type = exportar()
+    return Response(content=cuerpo, media_type=content_type)
+
+
+@app.get("/audio/stream/{audio_id}")
+async def serve_audio_stream(audio_id: str, request: Request):
+    """Audio en streaming: reenvía los chunks de ElevenLabs conforme llegan.
+
+    Se registra antes del mount estático de /audio, que si no capturaría la ruta.
+    """
+    texto_hash = audio_id.removesuffix(".mp3")
+    filepath = os.path.join(AUDIO_DIR, f"{texto_hash}.mp3")
+    tarea = sintesis_en_curso.get(texto_hash)
+    if tarea is not None:
+        # Otra petición ya está sintetizando este audio: esperar el archivo completo
+        await asyncio.shield(tarea)
+    if os.path.exists(filepath):
+        return FileResponse(filepath, media_type="audio/mpeg")
+    texto = _stream_pendiente(texto_hash)
+    if texto is None:
+        return Response(status_code=404)
+    return await stream_audio(texto_hash, texto, request)
+
 # Montar carpeta estática
 app.mount("/audio", StaticFiles(directory=AUDIO_DIR), name="audio")
 
 # Incluir routers
 app.include_router(api.router)
 
+def reproducir(destino, texto: str, audio_url: Optional[str]):
+    """<Play> del audio de ElevenLabs o, si no hubo audio, <Say> de Twilio.
+
+    Cada caso se cuenta para la tasa de fallback de /api/stats.
+    """
+    if audio_url:
+        destino.play(audio_url)
+        interaction_logger.log_event("tts_play")
+    else:
+        destino.say(texto, voice="Polly.Mia", language="es-MX")
+        interaction_logger.log_event("tts_say")
+        FALLBACKS.labels("tts_say").inc()
+
+
 @app.post("/inicio")
-async def inicio(request: Request, db: Session = Depends(get_db)):
+async def inicio(request: Request):
     """Endpoint para cuando comienza la llamada"""
-    limpiar_archivos_antiguos()
-    
+    timer = StageTimer("inicio")
     # Obtener datos de la llamada
-    form = await request.form()
+    with timer.stage("form"):
+        form = await request.form()
     call_sid = form.get("CallSid")
     from_number = form.get("From")
+    registrar_actividad(call_sid)
     
-    # Crear registro de llamada
-    new_call = models.CallLog(
-        call_sid=call_sid,
-        user_phone=from_number,
-        interaction_log=[]
-    )
-    db.add(new_call)
-    db.commit()
+    # Crear registro de llamada (write-behind, sin esperar a la DB)
+    interaction_logger.log_call(call_sid, from_number)
 
     vr = VoiceResponse()
     texto = "¡Hola! Soy tu asistente de ORISOD Enzyme. ¿En qué puedo ayudarte hoy?"
 
-    audio_url = await generar_audio(texto, request)
-
-    # Gather con configuración mejorada para español
-    gather = vr.gather(
-        input="speech",
-        action="/voice?attempt=1",
-        method="POST",
-        language="es-ES",  # Cambiado de es-MX a es-ES (mejor
-        speechTimeout="1",  # Detecta MUY rápido (1 seg de silencio)
-        timeout=25,
-        profanityFilter=False,
-        enhanced=True,
-        speechModel="experimental_conversations",  # Modelo experimental más preciso
-        hints="ORISOD Enzyme, qué ofreces, qué productos, beneficios, precio, ingredientes, cómo funciona, antioxidante, romero, olivo"
-    )
+    audio_url = await timer.measure("tts", generar_audio(texto, request))
 
-    if audio_url:
-        gather.play(audio_url)
-    else:
-        gather.say(texto, voice="Polly.Mia", language="es-MX")
+    with timer.stage("twiml"):
+        # Gather con configuración mejorada para español
+        gather = vr.gather(
+            input="speech",
+            action="/voice?attempt=1",
+            method="POST",
+            language="es-ES",  # Cambiado de es-MX a es-ES (mejor
+            speechTimeout="1",  # Detecta MUY rápido (1 seg de silencio)
+            timeout=25,
+            profanityFilter=False,
+            enhanced=True,
+            speechModel="experimental_conversations",  # Modelo experimental más preciso
+            hints="ORISOD Enzyme, qué ofreces, qué productos, beneficios, precio, ingredientes, cómo funciona, antioxidante, romero, olivo"
+        )
 
-    return Response(content=str(vr), media_type="application/xml")
+        reproducir(gather, texto, audio_url)
+        twiml = str(vr)
+
+    return Response(content=twiml, media_type="application/xml")
 
 
 
 
 
 @app.post("/voice")
-async def voice(request: Request, db: Session = Depends(get_db)):
-    form = await request.form()
+async def voice(request: Request):
+    timer = StageTimer()
+    with timer.stage("form"):
+        form = await request.form()
     call_sid = form.get("CallSid")
+    registrar_actividad(call_sid)
     user_input = form.get("SpeechResult", "")
     confidence_raw = form.get("Confidence", "0")
 
@@ -325,6 +727,7 @@ async def voice(request: Request, db: Session = Depends(get_db)):
     
     if not tiene_texto or (confianza_baja and not tiene_texto):
         if attempt < MAX_ATTEMPTS:
+            interaction_logger.log_event("asr_retry", call_sid)
             vr = VoiceResponse()
             texto = "No te escuché bien o no estoy seguro. Por favor, repite tu pregunta con calma."
             audio_url = await generar_audio(texto, request)
@@ -342,171 +745,111 @@ async def voice(request: Request, db: Session = Depends(get_db)):
                 hints="sí no ORISOD Enzyme, qué ofreces, qué productos, beneficios, precio, ingredientes, cómo funciona, antioxidante, romero, olivo, ayuda, información, pregunta, consulta, repetir, adiós, terminar, colgar"
             )
 
-            if audio_url:
-                gather.play(audio_url)
-            else:
-                gather.say(texto, voice="Polly.Mia", language="es-MX")
+            reproducir(gather, texto, audio_url)
 
             return Response(content=str(vr), media_type="application/xml")
         else:
             # Después de MAX_ATTEMPTS ofrecemos dejar un mensaje grabado
+            interaction_logger.log_event("asr_failure", call_sid)
             vr = VoiceResponse()
             texto = "Siento las molestias. Puedes dejar un mensaje después del tono y te responderemos por correo o llamada."
             audio_url = await generar_audio(texto, request)
 
-            if audio_url:
-                vr.play(audio_url)
-            else:
-                vr.say(texto, voice="Polly.Mia", language="es-MX")
+            reproducir(vr, texto, audio_url)
 
             # Iniciar grabación y notificar a /recording cuando termine
             vr.record(action="/recording", method="POST", maxLength=120, playBeep=True, trim="trim-silence")
             vr.hangup()
+            ultima_actividad.pop(call_sid, None)
         return Response(content=str(vr), media_type="application/xml")
 
     print(f"🎤 Usuario dijo: {user_input}")
 
-    # Detectar preguntas generales sobre productos/ofertas
-    preguntas_generales = ["qué ofreces", "que ofreces", "qué productos", "que productos", 
-                           "qué vendes", "que vendes", "cuál es tu producto", "cual es tu producto",
-                           "de qué trata", "de que trata", "qué es esto", "que es esto"]
-    
-    es_pregunta_general = any(pg in user_input.lower() for pg in preguntas_generales)
-    
-    if es_pregunta_general:
-        # Para preguntas generales, usar la descripción general completa
-        contexto_relevante = buscar_contexto_relevante("descripción general ORISOD Enzyme producto", top_k=2)
-    else:
-        # Para preguntas específicas, buscar contexto relevante
-        contexto_relevante = buscar_contexto_relevante(user_input, top_k=3)
+    # Preguntas frecuentes, saludos y despedidas (intents.json): una pasada sin red
+    with timer.stage("router"):
+        intent, despedida = intent_router.resolver(user_input)
+    INTENT_TURNS.labels(intent.name if intent else "llm").inc()
 
-    # Prompt mejorado para conversación natural con contexto ORISOD
-    prompt = f"""Eres un asistente virtual experto en ORISOD Enzyme®. Responde SOLO sobre este producto usando el contexto.
-Sé breve y directo: máximo 2 oraciones. 
-Si preguntan qué ofreces o cuál es tu producto, responde que ofreces ORISOD Enzyme® y explica brevemente qué es.
-Si no está en el contexto, di que no tienes esa información.
+    # El audio de seguimiento solo depende de si el usuario se despide:
+    # se prepara en paralelo con el resto del turno
+    texto_seguimiento = TEXTO_DESPEDIDA if despedida else TEXTO_CONTINUAR
+    seguimiento_task = asyncio.create_task(
+        timer.measure("tts_seguimiento", generar_audio(texto_seguimiento, request))
+    )
 
-Contexto:
-{contexto_relevante}
+    if intent is not None:
+        # Respuesta fija con audio pre-generado: sin embedding, RAG ni Gemini.
+        # Una despedida sola no lleva respuesta, solo el texto de cierre.
+        print(f"⚡ Respuesta directa del router ({intent.name})")
+        respuesta = intent.answer
+        audio_url = await timer.measure("tts_respuesta", generar_audio(respuesta, request)) if respuesta else None
+    else:
+        actualizar_retriever()
 
-Usuario: {user_input}
-Asistente:"""
+        # El embedding de la consulta es la clave del cache semántico y del RAG
+        with timer.stage("embedding"):
+            query_embedding = await obtener_embedding(user_input)
 
-    try:
-        # Usar gemini-pro (modelo estable y ampliamente disponible)
-        # Alternativas: gemini-1.5-pro, gemini-1.5-flash (requieren SDK actualizado)
-        model_name = os.getenv("GEMINI_MODEL", "gemini-pro")
-        model = genai.GenerativeModel(model_name)
-        result = model.generate_content(
-            prompt,
-            generation_config=genai.types.GenerationConfig(
-                temperature=0.7,
-                max_output_tokens=300,  # Aumentado de 100 a 300 para evitar error de MAX_TOKENS con respuesta vacía
-            )
-        )
-        
-        # Verificar si hay partes generadas antes de acceder a text
-        if result.parts:
-            respuesta = result.text.strip()
-        else:
-            print(f"⚠️ Gemini retornó respuesta vacía. Finish reason: {result.candidates[0].finish_reason if result.candidates else 'Unknown'}")
-            respuesta = "Lo siento, no pude generar una respuesta. ¿Puedes preguntar de otra forma?"
-            
-        print(f"🤖 IA responde: {respuesta}")
-    except Exception as e:
-        error_str = str(e)
-        # Detectar quota exceeded específicamente
-        if "429" in error_str or "quota" in error_str.lower():
-            print(f"⚠️ Cuota de Gemini excedida - Usando respuesta genérica")
-            respuesta = "Lo siento, estoy experimentando alta demanda en este momento. Por favor, deja tus datos de contacto y te responderemos pronto."
+        cacheada = None
+        if query_embedding is not None:
+            answer_cache.sync_version(version_conocimiento())
+            cacheada = answer_cache.lookup(query_embedding)
+
+        es_respuesta_real = False
+        if cacheada:
+            respuesta = cacheada.answer
+            print(f"⚡ Respuesta desde cache semántico ('{cacheada.question}'): {respuesta}")
         else:
-            print(f"❌ Error al generar respuesta: {e}")
-            respuesta = "Lo siento, estoy teniendo un problema técnico. ¿Puedes repetir tu pregunta?"
+            with timer.stage("retrieval"):
+                contexto_relevante = buscar_contexto_relevante(user_input, query_embedding, top_k=3)
+            with timer.stage("llm"):
+                respuesta, es_respuesta_real = await generar_respuesta(user_input, contexto_relevante)
 
-    # Guardar interacción en DB
-    try:
-        call_log = db.query(models.CallLog).filter(models.CallLog.call_sid == call_sid).first()
-        if call_log:
-            # Actualizar log
-            current_log = list(call_log.interaction_log) if call_log.interaction_log else []
-            current_log.append({
-                "user": user_input,
-                "ai": respuesta,
-                "timestamp": time.time()
-            })
-            # Forzar actualización en SQLAlchemy (a veces no detecta cambios en JSON)
-            call_log.interaction_log = current_log
-            # flag_modified(call_log, "interaction_log") # Si fuera necesario
-            db.commit()
-    except Exception as e:
-        print(f"⚠️ Error guardando en DB: {e}")
+        # También en un acierto del cache: el MP3 pudo ser desalojado y así se
+        # refresca su último acceso (con el archivo en disco es un acierto en memoria)
+        audio_url = await timer.measure("tts_respuesta", generar_audio(respuesta, request))
 
-    vr = VoiceResponse()
-    audio_url = await generar_audio(respuesta, request)
+        if es_respuesta_real and query_embedding is not None:
+            answer_cache.store(query_embedding, user_input, respuesta)
 
-    if audio_url:
-        vr.play(audio_url)
-    else:
-        vr.say(respuesta, voice="Polly.Mia", language="es-MX")
-
-    # Verificar despedida (Lógica MUY estricta)
-    # Solo aceptamos frases completas o palabras inequívocas de despedida
-    frases_cierre_exactas = [
-        "adiós", "adios", "bye", "chao", "bai", "nos vemos", "hasta luego", 
-        "hasta pronto", "colgar", "terminar llamada", "eso es todo", "ya es todo",
-        "muchas gracias adiós", "gracias adiós", "gracias bye", "a dios"
-    ]
-    
-    input_lower = user_input.lower().strip().replace(".", "").replace(",", "").replace("!", "")
-    
-    es_despedida = False
-    
-    # 1. Coincidencia exacta o frase contenida (pero segura)
-    if input_lower in frases_cierre_exactas:
-        es_despedida = True
-    
-    # 2. Si la frase termina con "adiós" o "bye"
-    elif input_lower.endswith("adiós") or input_lower.endswith("adios") or input_lower.endswith("bye"):
-        es_despedida = True
-        
-    # 3. Si la frase es SOLO "gracias" (opcional, a veces la gente cuelga así)
-    elif input_lower == "gracias" or input_lower == "muchas gracias":
-        # Podríamos preguntar "¿Algo más?" en lugar de colgar, pero por ahora asumimos cierre si es seco
-        pass 
-
-    if es_despedida:
-        texto_despedida = "¡Que tengas un excelente día! Hasta pronto."
-        audio_url = await generar_audio(texto_despedida, request)
-
-        if audio_url:
-            vr.play(audio_url)
-        else:
-            vr.say(texto_despedida, voice="Polly.Mia", language="es-MX")
+    # El audio de seguimiento normalmente ya está listo (cache o síntesis en paralelo)
+    audio_seguimiento = await seguimiento_task
 
-        vr.hangup()
-    else:
-        gather = vr.gather(
-            input="speech",
-            action="/voice?attempt=1",
-            method="POST",
-            language="es-ES",
-            speechTimeout="1",
-            timeout=25,
-            profanityFilter=False,
-            enhanced=True,
-            speechModel="experimental_conversations",
-            hints="sí no ORISOD Enzyme, qué ofreces, qué productos, beneficios, precio, ingredientes, cómo funciona, antioxidante, romero, olivo, ayuda, más, otra pregunta, información, adiós, terminar, colgar"
-        )
+    with timer.stage("twiml"):
+        vr = VoiceResponse()
+        if respuesta:
+            reproducir(vr, respuesta, audio_url)
 
-        texto_continuar = "¿Hay algo más en lo que pueda ayudarte?"
-        audio_url = await generar_audio(texto_continuar, request)
+        if despedida:
+            reproducir(vr, texto_seguimiento, audio_seguimiento)
 
-        if audio_url:
-            gather.play(audio_url)
+            vr.hangup()
         else:
-            gather.say(texto_continuar, voice="Polly.Mia", language="es-MX")
+            gather = vr.gather(
+                input="speech",
+                action="/voice?attempt=1",
+                method="POST",
+                language="es-ES",
+                speechTimeout="1",
+                timeout=25,
+                profanityFilter=False,
+                enhanced=True,
+                speechModel="experimental_conversations",
+                hints="sí no ORISOD Enzyme, qué ofreces, qué productos, beneficios, precio, ingredientes, cómo funciona, antioxidante, romero, olivo, ayuda, más, otra pregunta, información, adiós, terminar, colgar"
+            )
 
-    return Response(content=str(vr), media_type="application/xml")
+            reproducir(gather, texto_seguimiento, audio_seguimiento)
+        twiml = str(vr)
+
+    if despedida:
+        ultima_actividad.pop(call_sid, None)
+
+    # Guardar interacción en DB fuera del camino crítico (write-behind por lotes);
+    # las duraciones por etapa quedan en el registro del turno
+    interaction_logger.log_interaction(call_sid, user_input, respuesta or texto_seguimiento, confidence, timer.stages)
+
+    print(f"⏱️ Turno: {timer.resumen()}")
+    return Response(content=twiml, media_type="application/xml")
 
 
 @app.post("/recording")
@@ -0,0 +1,89 @@
+"""
+Medición de latencia por etapa de cada turno de llamada y métricas Prometheus.
+
+`StageTimer` guarda las duraciones del turno (van al registro de la
+interacción) y además las observa en el histograma `voice_stage_seconds`.
+Todo lo demás se expone en /metrics con el registro por defecto de
+prometheus_client.
+"""
+import time
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge, Histogram, CONTENT_TYPE_LATEST, generate_latest
+
+# Desde aciertos de cache (ms) hasta síntesis o generación lentas (segundos)
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2, 4, 8, 15)
+
+STAGE_SECONDS = Histogram(
+    "voice_stage_seconds", "Duración de cada etapa de un webhook de voz",
+    ["endpoint", "stage"], buckets=BUCKETS,
+)
+REQUEST_SECONDS = Histogram(
+    "voice_request_seconds", "Duración total de los webhooks de Twilio",
+    ["endpoint"], buckets=BUCKETS,
+)
+TTS_SECONDS = Histogram(
+    "tts_seconds", "Obtención de la URL de audio según el resultado del cache",
+    ["cache"], buckets=BUCKETS,  # memory | disk | stream | miss | coalesced | error | disabled
+)
+DB_FLUSH_SECONDS = Histogram(
+    "db_flush_seconds", "INSERT + commit de un lote del logger de interacciones",
+    buckets=BUCKETS,
+)
+
+PROMPT_TOKENS = Histogram(
+    "llm_prompt_tokens", "Tokens del prompt enviado a Gemini (tras el presupuesto)",
+    buckets=(100, 200, 300, 400, 500, 700, 1000, 1500, 2500),
+)
+
+FALLBACKS = Counter("fallbacks_total", "Degradaciones en el camino de la llamada", ["kind"])
+QUOTA_ERRORS = Counter("quota_errors_total", "Errores de cuota de proveedores externos", ["provider"])
+LLM_TOKENS = Counter("llm_tokens_total", "Tokens de Gemini", ["kind"])  # prompt | output | trimmed
+# Ruta de cada turno de /voice: nombre de la intención respondida sin Gemini o "llm"
+INTENT_TURNS = Counter("intent_router_turns_total", "Turnos por ruta del router de intenciones", ["route"])
+LOG_RECORDS = Counter("interaction_log_records_total", "Registros del logger por destino", ["result"])
+
+IN_FLIGHT = Gauge("voice_requests_in_flight", "Webhooks de voz en proceso", ["endpoint"])
+ACTIVE_CALLS = Gauge("voice_active_calls", "Llamadas con actividad reciente")
+CACHE_ENTRIES = Gauge("cache_entries", "Entradas en cada cache", ["cache"])
+LOG_QUEUE = Gauge("interaction_log_queue", "Registros en cola del logger write-behind")
+
+
+def exportar() -> tuple[bytes, str]:
+    """Cuerpo y content-type para /metrics"""
+    return generate_latest(), CONTENT_TYPE_LATEST
+
+
+class StageTimer:
+    """Acumula la duración (ms) de cada etapa de un turno.
+
+    Las etapas pueden solaparse (tareas concurrentes), por eso `total_ms` es el
+    tiempo de reloj desde la creación y no la suma de etapas.
+    """
+
+    def __init__(self, endpoint: str = "voice"):
+        self.endpoint = endpoint
+        self._inicio = time.perf_counter()
+        self.stages: dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        inicio = time.perf_counter()
+        try:
+            yield
+        finally:
+            segundos = time.perf_counter() - inicio
+            self.stages[name] = round(segundos * 1000, 1)
+            STAGE_SECONDS.labels(self.endpoint, name).observe(segundos)
+
+    async def measure(self, name: str, awaitable):
+        """Espera `awaitable` registrando su duración como la etapa `name`"""
+        with self.stage(name):
+            return await awaitable
+
+    def total_ms(self) -> float:
+        return round((time.perf_counter() - self._inicio) * 1000, 1)
+
+    def resumen(self) -> str:
+        etapas = " ".join(f"{nombre}={ms:.0f}ms" for nombre, ms in self.stages.items())
+        return f"{etapas} | total={self.total_ms():.0f}ms"
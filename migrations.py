@@ -0,0 +1,249 @@
+"""
+Migraciones de datos idempotentes. Ejecutar con:
+
+    python migrations.py
+"""
+from datetime import date, datetime, timezone
+
+from sqlalchemy import select, exists, func, inspect, text, update, delete
+
+import models
+from database import SessionLocal, engine
+from analytics import MAX_QUESTION_KEY
+from phone_numbers import normalizar_telefono, invertir
+from text_normalization import normalizar_texto
+
+
+def _agregar_columnas(tabla: str, columnas: dict[str, str]):
+    """ALTER TABLE ... ADD COLUMN para las columnas que falten (create_all no altera tablas)"""
+    existentes = {col["name"] for col in inspect(engine).get_columns(tabla)}
+    with engine.begin() as conn:
+        for nombre, tipo in columnas.items():
+            if nombre not in existentes:
+                conn.execute(text(f"ALTER TABLE {tabla} ADD COLUMN {nombre} {tipo}"))
+
+
+def migrar_interaction_log():
+    """Copia el JSON calls.interaction_log a la tabla interactions.
+
+    Se saltan las llamadas que ya tienen filas en interactions, así que se puede
+    ejecutar varias veces (p. ej. con el servidor antiguo todavía escribiendo).
+    """
+    models.Base.metadata.create_all(bind=engine)
+
+    db = SessionLocal()
+    migradas = 0
+    turnos = 0
+    try:
+        ya_migrada = exists().where(models.Interaction.call_sid == models.CallLog.call_sid)
+        consulta = (
+            select(models.CallLog.call_sid, models.CallLog.interaction_log)
+            .where(models.CallLog.interaction_log.is_not(None), ~ya_migrada)
+            .execution_options(yield_per=500)
+        )
+        for call_sid, log in db.execute(consulta):
+            if not log or not call_sid:
+                continue
+            for turn_index, item in enumerate(log):
+                interaccion = models.Interaction(
+                    call_sid=call_sid,
+                    turn_index=turn_index,
+                    user_text=item.get("user"),
+                    ai_text=item.get("ai"),
+                    latencies=item.get("latencias_ms"),
+                )
+                if item.get("timestamp"):
+                    interaccion.created_at = datetime.fromtimestamp(item["timestamp"], tz=timezone.utc)
+                db.add(interaccion)
+                turnos += 1
+            migradas += 1
+            if migradas % 500 == 0:
+                # Vaciar la sesión sin cerrar el cursor del lote en curso
+                db.flush()
+                db.expunge_all()
+        db.commit()
+    finally:
+        db.close()
+    print(f"✅ interaction_log migrado: {migradas} llamadas, {turnos} turnos")
+
+
+def agregar_resumen_llamadas():
+    """Agrega calls.turn_count/last_question/last_activity y los rellena.
+
+    El relleno sale de la tabla interactions (correr antes migrar_interaction_log)
+    y solo toca llamadas con turn_count = 0.
+    """
+    _agregar_columnas("calls", {
+        "turn_count": "INTEGER NOT NULL DEFAULT 0",
+        "last_question": "TEXT",
+        "last_activity": "TIMESTAMP WITH TIME ZONE" if engine.dialect.name == "postgresql" else "DATETIME",
+    })
+
+    turnos = (
+        select(func.count(models.Interaction.id))
+        .where(models.Interaction.call_sid == models.CallLog.call_sid)
+        .scalar_subquery()
+    )
+    ultima = (
+        select(models.Interaction.user_text, models.Interaction.created_at)
+        .where(models.Interaction.call_sid == models.CallLog.call_sid)
+        .order_by(models.Interaction.turn_index.desc())
+        .limit(1)
+    )
+    con_turnos = exists().where(models.Interaction.call_sid == models.CallLog.call_sid)
+    with engine.begin() as conn:
+        result = conn.execute(
+            update(models.CallLog)
+            .where(models.CallLog.turn_count == 0, con_turnos)
+            .values(
+                turn_count=turnos,
+                last_question=ultima.with_only_columns(models.Interaction.user_text).scalar_subquery(),
+                last_activity=ultima.with_only_columns(models.Interaction.created_at).scalar_subquery(),
+            )
+        )
+    print(f"✅ Resumen de llamadas: {result.rowcount} llamadas actualizadas")
+
+
+def normalizar_telefonos():
+    """Agrega calls.phone_e164/phone_reversed con sus índices y los rellena por lotes"""
+    _agregar_columnas("calls", {"phone_e164": "VARCHAR", "phone_reversed": "VARCHAR"})
+    tabla = models.CallLog.__table__
+    for indice in tabla.indexes:
+        if {col.name for col in indice.columns} & {"phone_e164", "phone_reversed"}:
+            indice.create(bind=engine, checkfirst=True)
+
+    db = SessionLocal()
+    actualizadas = 0
+    ultimo_id = 0
+    try:
+        # Lotes por keyset sobre la PK con commit por lote: se puede interrumpir y reanudar
+        while True:
+            filas = db.execute(
+                select(models.CallLog.id, models.CallLog.user_phone)
+                .where(models.CallLog.id > ultimo_id, models.CallLog.phone_e164.is_(None))
+                .order_by(models.CallLog.id)
+                .limit(1000)
+            ).all()
+            if not filas:
+                break
+            ultimo_id = filas[-1].id
+            lote = []
+            for call_id, user_phone in filas:
+                e164 = normalizar_telefono(user_phone)
+                if e164:
+                    lote.append({"id": call_id, "phone_e164": e164, "phone_reversed": invertir(e164)})
+            if lote:
+                db.execute(update(models.CallLog), lote)
+                db.commit()
+                actualizadas += len(lote)
+    finally:
+        db.close()
+    print(f"✅ Teléfonos normalizados: {actualizadas} llamadas")
+
+
+def llamadas_unicas():
+    """Fusiona las filas de calls con el mismo call_sid y vuelve único su índice.
+
+    Se conserva la fila de menor id con el teléfono que tenga alguna de ellas
+    y el inicio más temprano. Corre antes de reconstruir_estadisticas, que
+    cuenta llamadas.
+    """
+    db = SessionLocal()
+    fusionadas = 0
+    try:
+        repetidos = db.execute(
+            select(models.CallLog.call_sid)
+            .where(models.CallLog.call_sid.is_not(None))
+            .group_by(models.CallLog.call_sid)
+            .having(func.count() > 1)
+        ).scalars().all()
+        for call_sid in repetidos:
+            filas = db.execute(
+                select(models.CallLog).where(models.CallLog.call_sid == call_sid).order_by(models.CallLog.id)
+            ).scalars().all()
+            conservar, sobrantes = filas[0], filas[1:]
+            for fila in sobrantes:
+                for campo in ("user_phone", "phone_e164", "phone_reversed"):
+                    if getattr(conservar, campo) is None:
+                        setattr(conservar, campo, getattr(fila, campo))
+                if fila.start_time and (conservar.start_time is None or fila.start_time < conservar.start_time):
+                    conservar.start_time = fila.start_time
+                db.delete(fila)
+            fusionadas += len(sobrantes)
+        db.commit()
+    finally:
+        db.close()
+
+    # El índice anterior (ix_calls_call_sid) no era único: se recrea
+    indice = next(i for i in models.CallLog.__table__.indexes if i.unique and "call_sid" in i.columns)
+    if not any(i["name"] == indice.name and i["unique"] for i in inspect(engine).get_indexes("calls")):
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {indice.name}"))
+        indice.create(bind=engine)
+    print(f"✅ call_sid único: {fusionadas} filas duplicadas fusionadas")
+
+
+def reconstruir_estadisticas():
+    """Recalcula daily_call_stats (llamadas y turnos) y question_stats desde las tablas crudas.
+
+    Reemplaza los contadores de llamadas/turnos y las preguntas; los de TTS y
+    ASR no tienen historial del que reconstruirse y se conservan.
+    """
+    models.Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        dias: dict[date, dict] = {}
+        conteos = (
+            ("calls", models.CallLog.start_time),
+            ("turns", models.Interaction.created_at),
+        )
+        for columna, fecha in conteos:
+            for dia, total in db.execute(select(func.date(fecha), func.count()).group_by(func.date(fecha))):
+                if dia is None:
+                    continue
+                # SQLite devuelve la fecha como texto
+                dia = date.fromisoformat(dia) if isinstance(dia, str) else dia
+                dias.setdefault(dia, {})[columna] = total
+
+        for dia, valores in dias.items():
+            fila = db.get(models.DailyCallStats, dia)
+            if fila is None:
+                fila = models.DailyCallStats(day=dia, tts_play=0, tts_say=0, asr_retries=0, asr_failures=0)
+                db.add(fila)
+            fila.calls = valores.get("calls", 0)
+            fila.turns = valores.get("turns", 0)
+
+        db.execute(delete(models.QuestionStats))
+        preguntas: dict[str, dict] = {}
+        consulta = (
+            select(models.Interaction.user_text, models.Interaction.created_at)
+            .execution_options(yield_per=1000)
+        )
+        for user_text, created_at in db.execute(consulta):
+            clave = normalizar_texto(user_text or "")[:MAX_QUESTION_KEY]
+            if not clave:
+                continue
+            pregunta = preguntas.setdefault(clave, {"count": 0, "example": user_text, "last_asked": created_at})
+            pregunta["count"] += 1
+            if created_at and (pregunta["last_asked"] is None or created_at >= pregunta["last_asked"]):
+                pregunta["example"], pregunta["last_asked"] = user_text, created_at
+        db.add_all(models.QuestionStats(question_key=clave, **valores) for clave, valores in preguntas.items())
+        db.commit()
+    finally:
+        db.close()
+    print(f"✅ Estadísticas reconstruidas: {len(dias)} días, {len(preguntas)} preguntas distintas")
+
+
+MIGRACIONES = [
+    migrar_interaction_log,
+    agregar_resumen_llamadas,
+    normalizar_telefonos,
+    llamadas_unicas,
+    reconstruir_estadisticas,
+]
+
+
+if __name__ == "__main__":
+    for migracion in MIGRACIONES:
+        print(f"⚡ {migracion.__name__}...")
+        migracion()
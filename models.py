@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, JSON
+from sqlalchemy import Column, Integer, String, Date, DateTime, Text, JSON, Float, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -6,12 +6,63 @@ class CallLog(Base):
     __tablename__ = "calls"
 
     id = Column(Integer, primary_key=True, index=True)
-    call_sid = Column(String, index=True)  # ID único de llamada de Twilio
+    # ID de llamada de Twilio; único para que varios workers no dupliquen la fila (ON CONFLICT)
+    call_sid = Column(String, index=True, unique=True)
     user_phone = Column(String, index=True)
+    # Normalizado en phone_numbers.py; ambos se consultan por rango sobre su índice
+    phone_e164 = Column(String, index=True, nullable=True)
+    phone_reversed = Column(String, index=True, nullable=True)
     start_time = Column(DateTime(timezone=True), server_default=func.now())
-    interaction_log = Column(JSON, default=[])  # Lista de interacciones (pregunta/respuesta)
+    # Obsoleto: las interacciones nuevas van a la tabla interactions (ver migrations.py)
+    interaction_log = Column(JSON, default=list)
     status = Column(String, default="active")
     
     # Campos opcionales para análisis
     duration = Column(Integer, nullable=True)
     user_intent = Column(String, nullable=True)
+
+    # Resumen para el listado del dashboard (lo mantiene interaction_logger)
+    turn_count = Column(Integer, default=0, server_default="0", nullable=False)
+    last_question = Column(Text, nullable=True)
+    last_activity = Column(DateTime(timezone=True), nullable=True)
+
+
+class Interaction(Base):
+    """Un turno pregunta/respuesta; se inserta una fila por turno (append-only)"""
+    __tablename__ = "interactions"
+    __table_args__ = (
+        # También sirve de índice para leer la transcripción de una llamada en orden
+        UniqueConstraint("call_sid", "turn_index", name="uq_interactions_call_turn"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    call_sid = Column(String, nullable=False)  # CallSid de Twilio (calls.call_sid)
+    turn_index = Column(Integer, nullable=False)
+    user_text = Column(Text)
+    ai_text = Column(Text)
+    confidence = Column(Float, nullable=True)
+    latencies = Column(JSON, nullable=True)  # ms por etapa del turno
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class DailyCallStats(Base):
+    """Contadores por día (UTC) que analytics.py incrementa en cada lote del logger"""
+    __tablename__ = "daily_call_stats"
+
+    day = Column(Date, primary_key=True)
+    calls = Column(Integer, default=0, nullable=False)
+    turns = Column(Integer, default=0, nullable=False)
+    tts_play = Column(Integer, default=0, nullable=False)  # Audio de ElevenLabs
+    tts_say = Column(Integer, default=0, nullable=False)  # Fallback a <Say> de Twilio
+    asr_retries = Column(Integer, default=0, nullable=False)  # "No te escuché bien"
+    asr_failures = Column(Integer, default=0, nullable=False)  # Se agotaron los intentos
+
+
+class QuestionStats(Base):
+    """Frecuencia de cada pregunta normalizada"""
+    __tablename__ = "question_stats"
+
+    question_key = Column(String, primary_key=True)  # normalizar_texto(user_text)
+    example = Column(Text)  # Última forma original en que se preguntó
+    count = Column(Integer, default=0, nullable=False, index=True)
+    last_asked = Column(DateTime(timezone=True))
@@ -0,0 +1,51 @@
+"""
+Normalización de teléfonos a E.164 para guardarlos y buscarlos con índices.
+
+Se guardan dos columnas indexadas por llamada: `phone_e164` (búsqueda por
+prefijo, p. ej. "+52 55") y `phone_reversed` (dígitos invertidos, búsqueda por
+terminación, p. ej. los últimos 4 dígitos). Ambas se consultan como rangos
+[inicio, fin) sobre un B-tree normal, que funciona igual en Postgres y SQLite.
+"""
+import os
+import re
+from typing import Optional
+
+# Código de país para números nacionales sin "+" (52 = México)
+DEFAULT_COUNTRY_CODE = os.getenv("DEFAULT_COUNTRY_CODE", "52")
+
+
+def solo_digitos(texto: str) -> str:
+    return re.sub(r"\D", "", texto or "")
+
+
+def normalizar_telefono(numero: Optional[str]) -> Optional[str]:
+    """Devuelve el número en E.164 (+<dígitos>) o None si no parece un teléfono.
+
+    Twilio ya entrega E.164; los números de SIP/clientes ("client:...",
+    "anonymous") no tienen formato telefónico.
+    """
+    if not numero:
+        return None
+    numero = numero.strip()
+    digitos = solo_digitos(numero)
+    if numero.startswith("+"):
+        pass
+    elif digitos.startswith("00"):
+        digitos = digitos[2:]
+    elif len(digitos) == 10:
+        digitos = DEFAULT_COUNTRY_CODE + digitos
+    if not 8 <= len(digitos) <= 15:
+        return None
+    return f"+{digitos}"
+
+
+def invertir(telefono_e164: Optional[str]) -> Optional[str]:
+    """Dígitos en orden inverso: la terminación del número pasa a ser un prefijo"""
+    if not telefono_e164:
+        return None
+    return solo_digitos(telefono_e164)[::-1]
+
+
+def rango_prefijo(prefijo: str) -> tuple[str, str]:
+    """Rango [inicio, fin) con todas las cadenas que empiezan con `prefijo`"""
+    return prefijo, prefijo[:-1] + chr(ord(prefijo[-1]) + 1)
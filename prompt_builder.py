@@ -0,0 +1,179 @@
+"""
+Construcción del prompt de Gemini con presupuesto de tokens.
+
+Los tokens de entrada determinan la latencia de Gemini y consumen la cuota
+por minuto (ver TROUBLESHOOTING_QUOTAS.md). Antes de cada llamada:
+
+1. Se parte el contexto recuperado en oraciones, conservando la ruta de
+   títulos de cada chunk ("2. Componentes > 2.1 Polifenoles del olivo").
+2. Se eliminan oraciones repetidas (solapamiento entre chunks contiguos,
+   chunks duplicados o el contexto completo del fallback).
+3. Si aún excede PROMPT_TOKEN_BUDGET, se conservan las oraciones más
+   relevantes para la pregunta (BM25 sobre las oraciones y el título de su
+   sección, con un pequeño bonus por el rango del chunk recuperado) y se
+   re-emiten en su orden original.
+"""
+import math
+import os
+import re
+from collections import Counter
+from dataclasses import dataclass
+from typing import Union
+
+from chunking import dividir_por_tokens, estimar_tokens
+from retrieval import tokenizar
+from text_normalization import normalizar_texto
+
+# Tokens máximos del prompt completo (instrucciones + contexto + pregunta)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "700"))
+
+PLANTILLA = """Eres un asistente virtual experto en ORISOD Enzyme®. Responde SOLO sobre este producto usando el contexto.
+Sé breve y directo: máximo 2 oraciones.
+Si preguntan qué ofreces o cuál es tu producto, responde que ofreces ORISOD Enzyme® y explica brevemente qué es.
+Si no está en el contexto, di que no tienes esa información.
+
+Contexto:
+{contexto}
+
+Usuario: {pregunta}
+Asistente:"""
+
+# Fin de oración seguido de mayúscula; no corta títulos numerados como "1. Descripción"
+FIN_ORACION = re.compile(r"(?<=[^\d\s][.!?])\s+(?=[A-ZÁÉÍÓÚÑ¿¡])")
+
+
+@dataclass
+class Prompt:
+    texto: str
+    tokens: int
+    tokens_contexto: int
+    # Tokens del contexto recuperado antes de deduplicar y recortar
+    tokens_originales: int
+    oraciones: int
+    duplicadas: int
+    descartadas: int
+
+
+@dataclass
+class _Oracion:
+    texto: str
+    bloque: int  # índice del chunk de origen (0 = más relevante)
+    orden: int
+
+
+def _bloques(contexto: Union[str, list[dict]]) -> list[tuple[str, list[str]]]:
+    """(encabezado, líneas) por chunk; el encabezado es la ruta de títulos si la hay"""
+    if isinstance(contexto, str):
+        # Contexto completo (fallback sin RAG): se estructura por secciones
+        contexto = dividir_por_tokens(contexto)
+    bloques = []
+    for chunk in contexto:
+        lineas = [l for l in chunk["content"].split("\n") if l.strip()]
+        encabezado = ""
+        # El chunker de tokens antepone la ruta de títulos como primera línea
+        if lineas and (" > " in lineas[0] or lineas[0].strip() == chunk.get("title")):
+            encabezado, lineas = lineas[0].strip(), lineas[1:]
+        bloques.append((encabezado, lineas))
+    return bloques
+
+
+def _puntajes(pregunta: str, oraciones: list[_Oracion], encabezados: list[str], ranqueado: bool) -> list[float]:
+    """BM25 de cada oración (con el título de su sección) contra la pregunta,
+    más un bonus por rango del chunk si el contexto viene ordenado por relevancia"""
+    terminos = [Counter(tokenizar(f"{encabezados[o.bloque]} {o.texto}")) for o in oraciones]
+    n = len(oraciones)
+    df = Counter(t for ts in terminos for t in ts)
+    largo_medio = (sum(sum(ts.values()) for ts in terminos) / n) if n else 0.0
+    consulta = set(tokenizar(pregunta))
+    k1, b = 1.2, 0.75
+    puntajes = []
+    for oracion, ts in zip(oraciones, terminos):
+        largo = sum(ts.values())
+        puntaje = 0.0
+        for termino in consulta & ts.keys():
+            idf = math.log(1 + (n - df[termino] + 0.5) / (df[termino] + 0.5))
+            tf = ts[termino]
+            puntaje += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * largo / (largo_medio or 1)))
+        puntajes.append(puntaje + (0.3 / (1 + oracion.bloque) if ranqueado else 0.0))
+    return puntajes
+
+
+def comprimir_contexto(pregunta: str, contexto: Union[str, list[dict]], max_tokens: int) -> tuple[str, dict]:
+    """Contexto deduplicado y recortado a `max_tokens`; devuelve (texto, estadísticas)"""
+    ranqueado = not isinstance(contexto, str)
+    bloques = _bloques(contexto)
+    encabezados = [e for e, _ in bloques]
+
+    oraciones: list[_Oracion] = []
+    vistas: set[str] = set()
+    duplicadas = 0
+    for i, (_, lineas) in enumerate(bloques):
+        for linea in lineas:
+            for texto in FIN_ORACION.split(linea.strip()):
+                clave = normalizar_texto(texto)
+                if not clave:
+                    continue
+                if clave in vistas:
+                    duplicadas += 1
+                    continue
+                vistas.add(clave)
+                oraciones.append(_Oracion(texto, i, len(oraciones)))
+
+    def _costo(o: _Oracion) -> int:
+        return estimar_tokens(o.texto) + 1
+
+    total = sum(_costo(o) for o in oraciones) + sum(estimar_tokens(e) + 2 for e in set(encabezados) if e)
+    elegidas = oraciones
+    if total > max_tokens:
+        elegidas, usados, con_encabezado = [], 0, set()
+        puntajes = _puntajes(pregunta, oraciones, encabezados, ranqueado)
+        for idx in sorted(range(len(oraciones)), key=lambda j: puntajes[j], reverse=True):
+            oracion = oraciones[idx]
+            encabezado = encabezados[oracion.bloque]
+            costo = _costo(oracion)
+            if encabezado and encabezado not in con_encabezado:
+                costo += estimar_tokens(encabezado) + 2
+            if usados + costo > max_tokens:
+                continue
+            usados += costo
+            if encabezado:
+                con_encabezado.add(encabezado)
+            elegidas.append(oracion)
+        elegidas.sort(key=lambda o: o.orden)
+
+    # Re-emitir agrupado por chunk; partes contiguas de una sección comparten encabezado
+    partes: list[str] = []
+    bloque_actual, encabezado_actual = None, None
+    for oracion in elegidas:
+        encabezado = encabezados[oracion.bloque]
+        if oracion.bloque != bloque_actual and (not encabezado or encabezado != encabezado_actual):
+            if partes:
+                partes.append("")
+            if encabezado:
+                partes.append(encabezado)
+        bloque_actual, encabezado_actual = oracion.bloque, encabezado
+        partes.append(oracion.texto)
+
+    return "\n".join(partes), {
+        "oraciones": len(elegidas),
+        "duplicadas": duplicadas,
+        "descartadas": len(oraciones) - len(elegidas),
+    }
+
+
+def construir_prompt(pregunta: str, contexto: Union[str, list[dict]], presupuesto: int = PROMPT_TOKEN_BUDGET) -> Prompt:
+    """Prompt final para Gemini que no excede `presupuesto` tokens (estimados)"""
+    fijo = estimar_tokens(PLANTILLA.format(contexto="", pregunta=pregunta))
+    if isinstance(contexto, str):
+        originales = estimar_tokens(contexto)
+    else:
+        originales = estimar_tokens("\n\n".join(c["content"] for c in contexto))
+    texto_contexto, stats = comprimir_contexto(pregunta, contexto, max(presupuesto - fijo, 0))
+    texto = PLANTILLA.format(contexto=texto_contexto, pregunta=pregunta)
+    return Prompt(
+        texto=texto,
+        tokens=estimar_tokens(texto),
+        tokens_contexto=estimar_tokens(texto_contexto),
+        tokens_originales=originales,
+        **stats,
+    )
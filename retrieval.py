@@ -0,0 +1,299 @@
+"""
+Backends de recuperación para el RAG.
+
+- chroma: colección `orisod_knowledge` en ./chroma_db (comportamiento original)
+- numpy: matriz float32 normalizada en ./vector_index/embeddings.npy, abierta
+  con mmap (los workers de uvicorn comparten las páginas) y consultada con un
+  único producto matricial
+- bm25: índice léxico en memoria sobre los mismos chunks, sin red
+- hybrid: fusión de los puntajes de un backend vectorial y de bm25
+
+vectorize_context.py construye cada versión de los índices vectoriales al lado
+de la anterior y la activa reescribiendo un puntero (active_collection.txt en
+./chroma_db, CURRENT en ./vector_index); los lectores resuelven el puntero al
+abrir el índice.
+
+Todos devuelven una lista de chunks {"id", "title", "content", "hash", "score"}
+ordenada de mayor a menor `score` (similitud coseno en los vectoriales).
+"""
+import json
+import math
+import os
+from collections import Counter, defaultdict
+from typing import Optional
+
+import numpy as np
+
+from chunking import cargar_chunks, hash_chunk
+from text_normalization import normalizar_texto
+
+COLLECTION_NAME = "orisod_knowledge"
+CHROMA_PATH = "./chroma_db"
+VECTOR_INDEX_DIR = "./vector_index"
+
+# Punteros a la versión activa del índice que escribe vectorize_context.py.
+# Sin puntero se usa el layout original (colección/directorio sin versión).
+CHROMA_POINTER = "active_collection.txt"
+NUMPY_POINTER = "CURRENT"
+
+
+def leer_puntero(directorio: str, archivo: str) -> Optional[str]:
+    try:
+        with open(os.path.join(directorio, archivo), "r", encoding="utf-8") as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def publicar_puntero(directorio: str, archivo: str, valor: str):
+    """Cambia la versión activa de forma atómica (write + rename)"""
+    destino = os.path.join(directorio, archivo)
+    tmp = destino + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(valor)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, destino)
+
+
+def coleccion_activa(path: str = CHROMA_PATH) -> str:
+    return leer_puntero(path, CHROMA_POINTER) or COLLECTION_NAME
+
+
+def indice_activo(index_dir: str = VECTOR_INDEX_DIR) -> str:
+    version = leer_puntero(index_dir, NUMPY_POINTER)
+    return os.path.join(index_dir, version) if version else index_dir
+
+
+class Retriever:
+    """Interfaz común de los backends"""
+
+    name = "base"
+    # Si es False la consulta no necesita embedding (camino sin red)
+    needs_embedding = True
+
+    def search(self, query: str, query_embedding: Optional[list[float]], top_k: int = 3) -> list[dict]:
+        raise NotImplementedError
+
+
+class ChromaRetriever(Retriever):
+    name = "chroma"
+
+    def __init__(self, path: str = CHROMA_PATH, collection_name: Optional[str] = None):
+        # Import diferido: chromadb es pesado y solo lo necesita este backend
+        import chromadb
+
+        client = chromadb.PersistentClient(path=path)
+        self.collection = client.get_collection(collection_name or coleccion_activa(path))
+
+    def search(self, query: str, query_embedding: Optional[list[float]], top_k: int = 3) -> list[dict]:
+        results = self.collection.query(
+            query_embeddings=[query_embedding],
+            n_results=top_k
+        )
+        chunks = []
+        for chunk_id, doc, meta, dist in zip(
+            results["ids"][0], results["documents"][0], results["metadatas"][0], results["distances"][0]
+        ):
+            chunks.append({
+                "id": chunk_id,
+                "title": (meta or {}).get("title", ""),
+                "section": (meta or {}).get("section", ""),
+                "parent": (meta or {}).get("parent", ""),
+                "content": doc,
+                "hash": (meta or {}).get("hash", ""),
+                # Chroma usa L2 al cuadrado; con embeddings normalizados cos = 1 - d/2
+                "score": 1.0 - dist / 2.0,
+            })
+        return chunks
+
+
+class NumpyRetriever(Retriever):
+    name = "numpy"
+
+    def __init__(self, index_dir: str = VECTOR_INDEX_DIR):
+        index_dir = indice_activo(index_dir)
+        self.matrix = np.load(os.path.join(index_dir, "embeddings.npy"), mmap_mode="r")
+        with open(os.path.join(index_dir, "chunks.json"), "r", encoding="utf-8") as f:
+            self.chunks = json.load(f)
+        if len(self.chunks) != self.matrix.shape[0]:
+            raise ValueError(f"Índice inconsistente: {len(self.chunks)} chunks y {self.matrix.shape[0]} embeddings")
+
+    def search(self, query: str, query_embedding: Optional[list[float]], top_k: int = 3) -> list[dict]:
+        vec = np.asarray(query_embedding, dtype=np.float32)
+        vec /= np.linalg.norm(vec) or 1.0
+        scores = self.matrix @ vec
+
+        top_k = min(top_k, len(scores))
+        mejores = np.argpartition(-scores, top_k - 1)[:top_k]
+        mejores = mejores[np.argsort(-scores[mejores])]
+        return [{**self.chunks[i], "score": float(scores[i])} for i in mejores]
+
+
+# Palabras vacías frecuentes (ya sin acentos) que no aportan al ranking léxico
+STOPWORDS_ES = set("""
+a al algo como con cual cuales de del desde donde el ella en era es esa ese eso esta este esto
+estos fue ha hay la las le les lo los mas me mi mucho muy no nos o para pero por porque puede
+que quien se sea ser si sin sobre son su sus te tiene tienen tu un una uno unos y ya yo
+""".split())
+
+# Sufijos del stemmer ligero, del más largo al más corto
+SUFIJOS_ES = (
+    "amientos", "imientos", "amiento", "imiento", "aciones", "uciones", "idades",
+    "mente", "acion", "ucion", "idad", "ivas", "ivos", "osas", "osos", "ante", "ancia",
+    "able", "ible", "ista", "ismo", "iva", "ivo", "osa", "oso", "ico", "ica",
+    "es", "as", "os", "a", "o", "e", "s",
+)
+
+
+def stem_es(token: str) -> str:
+    """Stemmer ligero para español: quita un sufijo dejando al menos 4 letras"""
+    for sufijo in SUFIJOS_ES:
+        if token.endswith(sufijo) and len(token) - len(sufijo) >= 4:
+            return token[:-len(sufijo)]
+    return token
+
+
+def tokenizar(texto: str) -> list[str]:
+    """Normaliza (acentos, puntuación), quita palabras vacías y aplica el stemmer"""
+    return [stem_es(t) for t in normalizar_texto(texto).split() if t not in STOPWORDS_ES]
+
+
+class BM25Retriever(Retriever):
+    """Okapi BM25 en memoria; se construye en el arranque en milisegundos"""
+
+    name = "bm25"
+    needs_embedding = False
+
+    def __init__(self, chunks: Optional[list[dict]] = None, k1: float = 1.5, b: float = 0.75):
+        self.chunks = chunks if chunks is not None else cargar_chunks()
+        self.k1 = k1
+        self.b = b
+
+        self.doc_len = []
+        self.postings: dict[str, list[tuple[int, int]]] = defaultdict(list)
+        for idx, chunk in enumerate(self.chunks):
+            terms = Counter(tokenizar(chunk["content"]))
+            self.doc_len.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings[term].append((idx, tf))
+
+        n_docs = len(self.chunks)
+        self.avgdl = (sum(self.doc_len) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def scores(self, query: str) -> dict[int, float]:
+        """Puntaje BM25 por índice de chunk (solo chunks con algún término en común)"""
+        scores: dict[int, float] = defaultdict(float)
+        for term in set(tokenizar(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for idx, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[idx] / self.avgdl)
+                scores[idx] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+    def search(self, query: str, query_embedding: Optional[list[float]] = None, top_k: int = 3) -> list[dict]:
+        scores = self.scores(query)
+        mejores = sorted(scores, key=scores.get, reverse=True)[:top_k]
+        return [{**self.chunks[i], "score": scores[i]} for i in mejores]
+
+
+class HybridRetriever(Retriever):
+    """Fusiona puntajes vectoriales y léxicos normalizados (min-max) por chunk.
+
+    score = alpha * vectorial + (1 - alpha) * bm25. Sin embedding disponible
+    degrada a bm25 puro. Los chunks se cruzan por el hash de su contenido, no
+    por id: los ids son posicionales y el índice vectorial puede ser de otra
+    versión del contexto que el bm25 (se recargan por separado).
+    """
+
+    name = "hybrid"
+    needs_embedding = True
+
+    def __init__(self, vector: Retriever, lexical: BM25Retriever, alpha: float = 0.6, candidates: int = 10):
+        self.vector = vector
+        self.lexical = lexical
+        self.alpha = alpha
+        self.candidates = candidates
+
+    @staticmethod
+    def _clave(chunk: dict) -> str:
+        # Índices construidos antes de guardar el hash lo recalculan del texto
+        return chunk.get("hash") or hash_chunk(chunk)
+
+    @classmethod
+    def _min_max(cls, resultados: list[dict]) -> dict[str, float]:
+        if not resultados:
+            return {}
+        valores = [r["score"] for r in resultados]
+        lo, hi = min(valores), max(valores)
+        rango = (hi - lo) or 1.0
+        return {cls._clave(r): (r["score"] - lo) / rango for r in resultados}
+
+    def search(self, query: str, query_embedding: Optional[list[float]], top_k: int = 3) -> list[dict]:
+        n = max(self.candidates, top_k)
+        lexicos = self.lexical.search(query, None, n)
+        if query_embedding is None:
+            return lexicos[:top_k]
+
+        vectoriales = self.vector.search(query, query_embedding, n)
+        por_clave = {self._clave(r): r for r in lexicos + vectoriales}
+        vec_norm = self._min_max(vectoriales)
+        lex_norm = self._min_max(lexicos)
+        fusion = {
+            clave: self.alpha * vec_norm.get(clave, 0.0) + (1 - self.alpha) * lex_norm.get(clave, 0.0)
+            for clave in por_clave
+        }
+        mejores = sorted(fusion, key=fusion.get, reverse=True)[:top_k]
+        return [{**por_clave[c], "score": fusion[c]} for c in mejores]
+
+
+def guardar_indice_numpy(chunks: list[dict], embeddings: list[list[float]], index_dir: str = VECTOR_INDEX_DIR):
+    """Guarda embeddings normalizados (float32 contiguo) y los textos de los chunks.
+
+    `chunks` son dicts con "id", "title" y "content", en el mismo orden que `embeddings`.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+    matrix = np.ascontiguousarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    matrix /= np.where(norms == 0, 1.0, norms)
+
+    # Escribir a temporales y renombrar para que un lector nunca vea un índice a medias
+    npy_tmp = os.path.join(index_dir, "embeddings.tmp.npy")
+    json_tmp = os.path.join(index_dir, "chunks.tmp.json")
+    np.save(npy_tmp, matrix)
+    with open(json_tmp, "w", encoding="utf-8") as f:
+        json.dump(chunks, f, ensure_ascii=False)
+    os.replace(json_tmp, os.path.join(index_dir, "chunks.json"))
+    os.replace(npy_tmp, os.path.join(index_dir, "embeddings.npy"))
+
+
+BACKENDS = {
+    "chroma": ChromaRetriever,
+    "numpy": NumpyRetriever,
+    "bm25": BM25Retriever,
+}
+
+
+def crear_retriever(backend: str, lexical: Optional[BM25Retriever] = None) -> Retriever:
+    """Instancia el backend configurado (RETRIEVER_BACKEND).
+
+    `hybrid` combina HYBRID_VECTOR_BACKEND (chroma | numpy) con el índice bm25.
+    """
+    if backend == "hybrid":
+        vector = crear_retriever(os.getenv("HYBRID_VECTOR_BACKEND", "chroma"))
+        return HybridRetriever(
+            vector,
+            lexical or BM25Retriever(),
+            alpha=float(os.getenv("HYBRID_ALPHA", "0.6")),
+        )
+    if backend == "bm25" and lexical is not None:
+        return lexical
+    if backend not in BACKENDS:
+        raise ValueError(f"Backend de recuperación desconocido: {backend} (opciones: {', '.join(BACKENDS)}, hybrid)")
+    return BACKENDS[backend]()
@@ -1,34 +1,306 @@
-from fastapi import APIRouter, Depends, HTTPException, Request
-from fastapi.responses import Response
-from sqlalchemy.orm import Session
-from typing import List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import Response, StreamingResponse
+from starlette.background import BackgroundTask
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
+from datetime import datetime
+import asyncio
+import csv
+import io
+import os
+import orjson
 import models
-from database import get_db
+from database import get_async_db, AsyncSessionLocal
+from answer_cache import answer_cache
+from embedding_cache import embedding_cache
+from audio_cache import audio_cache
+from intent_router import intent_router
+from phone_numbers import solo_digitos, rango_prefijo
+from analytics import resumen_estadisticas
 import yaml
 
 # Prefijo /api para diferenciarlo de los webhooks
 router = APIRouter(prefix="/api", tags=["dashboard"])
 
+def _call_dict(call: models.CallLog) -> dict:
+    return {col.name: getattr(call, col.name) for col in models.CallLog.__table__.columns}
+
+
+def _interaction_dict(interaction: models.Interaction) -> dict:
+    """Mismo formato que usaba el JSON interaction_log"""
+    return {
+        "user": interaction.user_text,
+        "ai": interaction.ai_text,
+        "timestamp": interaction.created_at.timestamp() if interaction.created_at else None,
+        "confidence": interaction.confidence,
+        "latencias_ms": interaction.latencies,
+    }
+
+
+async def _con_transcripciones(db: AsyncSession, calls: list) -> list[dict]:
+    """Arma el interaction_log de cada llamada desde la tabla interactions (una sola consulta)"""
+    sids = [call.call_sid for call in calls if call.call_sid]
+    por_llamada: dict[str, list] = {}
+    if sids:
+        result = await db.execute(
+            select(models.Interaction)
+            .where(models.Interaction.call_sid.in_(sids))
+            .order_by(models.Interaction.call_sid, models.Interaction.turn_index)
+        )
+        for interaction in result.scalars():
+            por_llamada.setdefault(interaction.call_sid, []).append(_interaction_dict(interaction))
+
+    resultado = []
+    for call in calls:
+        data = _call_dict(call)
+        # Llamadas sin migrar conservan el JSON antiguo
+        data["interaction_log"] = por_llamada.get(call.call_sid) or call.interaction_log or []
+        resultado.append(data)
+    return resultado
+
+# Columnas del listado: sin interaction_log ni transcripciones (van en /calls/{id})
+COLUMNAS_RESUMEN = (
+    models.CallLog.id,
+    models.CallLog.call_sid,
+    models.CallLog.user_phone,
+    models.CallLog.start_time,
+    models.CallLog.last_activity,
+    models.CallLog.status,
+    models.CallLog.duration,
+    models.CallLog.turn_count,
+    models.CallLog.last_question,
+)
+
+
+def _resumen_dict(fila) -> dict:
+    data = dict(fila._mapping)
+    if data["duration"] is None and data["start_time"] and data["last_activity"]:
+        data["duration"] = int((data["last_activity"] - data["start_time"]).total_seconds())
+    return data
+
+
+def _json(contenido, headers: Optional[dict] = None) -> Response:
+    """JSON serializado con orjson (fechas incluidas), sin pasar por jsonable_encoder"""
+    return Response(orjson.dumps(contenido), media_type="application/json", headers=headers)
+
+
+async def _pagina_resumen(db: AsyncSession, consulta, cursor: Optional[int], limit: int) -> Response:
+    """Página de resúmenes ordenada por id descendente, con X-Next-Cursor si hay más"""
+    consulta = consulta.order_by(models.CallLog.id.desc()).limit(limit + 1)
+    if cursor is not None:
+        # Keyset: usa el índice de la PK, el costo no crece con la profundidad de la página
+        consulta = consulta.where(models.CallLog.id < cursor)
+    filas = (await db.execute(consulta)).all()
+
+    headers = {}
+    if len(filas) > limit:
+        filas = filas[:limit]
+        headers["X-Next-Cursor"] = str(filas[-1].id)
+    return _json([_resumen_dict(fila) for fila in filas], headers=headers)
+
+
+def _filtro_telefono(phone: str):
+    """Rango indexado sobre phone_e164 (prefijo, con "+") o phone_reversed (terminación)"""
+    digitos = solo_digitos(phone)
+    if not digitos:
+        raise HTTPException(status_code=400, detail="El teléfono debe contener dígitos")
+    if phone.strip().startswith("+"):
+        columna, (inicio, fin) = models.CallLog.phone_e164, rango_prefijo(f"+{digitos}")
+    else:
+        columna, (inicio, fin) = models.CallLog.phone_reversed, rango_prefijo(digitos[::-1])
+    return (columna >= inicio) & (columna < fin)
+
+
 @router.get("/calls")
-def get_calls(skip: int = 0, limit: int = 50, db: Session = Depends(get_db)):
-    """Obtener lista de llamadas recientes"""
-    calls = db.query(models.CallLog).order_by(models.CallLog.id.desc()).offset(skip).limit(limit).all()
-    return calls
+async def get_calls(
+    cursor: Optional[int] = Query(None, description="id de la última llamada de la página anterior"),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Obtener lista de llamadas recientes (resumen, paginado por cursor).
+
+    El cursor de la página siguiente viene en el header X-Next-Cursor
+    (ausente en la última página).
+    """
+    return await _pagina_resumen(db, select(*COLUMNAS_RESUMEN), cursor, limit)
+
+# --- Exportación masiva -----------------------------------------------------
+
+# Exportaciones simultáneas: cada una ocupa una conexión del pool mientras dura
+EXPORT_MAX_CONCURRENCY = int(os.getenv("EXPORT_MAX_CONCURRENCY", "2"))
+_exportaciones = asyncio.Semaphore(EXPORT_MAX_CONCURRENCY)
+
+# Una fila por turno; las llamadas sin turnos salen con los campos del turno vacíos
+COLUMNAS_EXPORT = (
+    models.CallLog.id.label("call_id"),
+    models.CallLog.call_sid,
+    models.CallLog.user_phone,
+    models.CallLog.phone_e164,
+    models.CallLog.start_time,
+    models.CallLog.status,
+    models.Interaction.turn_index,
+    models.Interaction.created_at,
+    models.Interaction.user_text,
+    models.Interaction.ai_text,
+    models.Interaction.confidence,
+)
+FILAS_POR_BLOQUE = 500
+
+
+async def _tomar_exportacion():
+    """Toma un permiso de exportación sin esperar; None si ya no quedan.
+
+    Devuelve la función que lo libera (idempotente). Con permisos libres
+    acquire() no cede el control, así que verificar y tomar es atómico.
+    """
+    if _exportaciones.locked():
+        return None
+    await _exportaciones.acquire()
+    liberado = False
+
+    def liberar():
+        nonlocal liberado
+        if not liberado:
+            liberado = True
+            _exportaciones.release()
+    return liberar
+
+
+async def _liberando(cuerpo, liberar):
+    """Libera el permiso al terminar, fallar o cortarse el streaming"""
+    try:
+        async for parte in cuerpo:
+            yield parte
+    finally:
+        liberar()
+
+
+async def _filas_export(consulta):
+    """Recorre la consulta con un cursor del servidor (yield_per) en su propia sesión.
+
+    La sesión de Depends se cierra antes de que termine la respuesta en
+    streaming, por eso el generador abre la suya.
+    """
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(consulta.execution_options(yield_per=FILAS_POR_BLOQUE))
+        async for fila in result:
+            yield fila._mapping
+
+
+async def _ndjson(consulta):
+    bloque = []
+    async for fila in _filas_export(consulta):
+        bloque.append(orjson.dumps(dict(fila)))
+        if len(bloque) >= FILAS_POR_BLOQUE:
+            yield b"\n".join(bloque) + b"\n"
+            bloque = []
+    if bloque:
+        yield b"\n".join(bloque) + b"\n"
+
+
+async def _csv(consulta):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow([col.key for col in COLUMNAS_EXPORT])
+    filas = 0
+    async for fila in _filas_export(consulta):
+        writer.writerow([
+            valor.isoformat() if isinstance(valor, datetime) else valor
+            for valor in fila.values()
+        ])
+        filas += 1
+        if filas % FILAS_POR_BLOQUE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+# Declarada antes de /calls/{call_id} para que "export" no se tome como id
+@router.get("/calls/export")
+async def export_calls(
+    format: str = Query("ndjson", pattern="^(ndjson|csv)$"),
+    since: Optional[datetime] = Query(None, description="Inicio de llamada desde (ISO 8601)"),
+    until: Optional[datetime] = Query(None, description="Inicio de llamada antes de (ISO 8601)"),
+    phone: Optional[str] = Query(None, description="Mismo formato que /search"),
+):
+    """Exportar transcripciones completas en streaming (NDJSON o CSV, memoria constante)"""
+    consulta = (
+        select(*COLUMNAS_EXPORT)
+        .outerjoin(models.Interaction, models.Interaction.call_sid == models.CallLog.call_sid)
+        .order_by(models.CallLog.id, models.Interaction.turn_index)
+    )
+    if since is not None:
+        consulta = consulta.where(models.CallLog.start_time >= since)
+    if until is not None:
+        consulta = consulta.where(models.CallLog.start_time < until)
+    if phone:
+        consulta = consulta.where(_filtro_telefono(phone))
+
+    # Acotar exportaciones para no dejar a los webhooks sin conexiones del pool;
+    # el permiso se toma aquí (no en el generador) para que el 429 sea exacto
+    liberar = await _tomar_exportacion()
+    if liberar is None:
+        raise HTTPException(status_code=429, detail="Demasiadas exportaciones en curso, intenta más tarde")
+
+    if format == "csv":
+        cuerpo, media_type = _csv(consulta), "text/csv; charset=utf-8"
+    else:
+        cuerpo, media_type = _ndjson(consulta), "application/x-ndjson"
+    headers = {"Content-Disposition": f'attachment; filename="calls.{format}"'}
+    return StreamingResponse(
+        _liberando(cuerpo, liberar),
+        media_type=media_type,
+        headers=headers,
+        # Por si el streaming nunca arranca (el generador no llega a su finally)
+        background=BackgroundTask(liberar),
+    )
+
 
 @router.get("/calls/{call_id}")
-def get_call_details(call_id: int, db: Session = Depends(get_db)):
+async def get_call_details(call_id: int, db: AsyncSession = Depends(get_async_db)):
     """Obtener detalles de una llamada específica"""
-    call = db.query(models.CallLog).filter(models.CallLog.id == call_id).first()
+    call = await db.get(models.CallLog, call_id)
     if not call:
         raise HTTPException(status_code=404, detail="Llamada no encontrada")
-    return call
+    return _json((await _con_transcripciones(db, [call]))[0])
 
 @router.get("/search")
-def search_calls(phone: str, db: Session = Depends(get_db)):
-    """Buscar llamadas por número de teléfono"""
-    # Buscar coincidencias parciales
-    calls = db.query(models.CallLog).filter(models.CallLog.user_phone.contains(phone)).order_by(models.CallLog.id.desc()).all()
-    return calls
+async def search_calls(
+    phone: str,
+    cursor: Optional[int] = Query(None, description="X-Next-Cursor de la página anterior"),
+    limit: int = Query(50, ge=1, le=200),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """Buscar llamadas por número de teléfono (resumen, paginado por cursor).
+
+    Con "+" al inicio (codificado como %2B) se busca por prefijo E.164
+    ("+5255"); sin él, por terminación ("5678", "5512345678"). Ambas son
+    consultas de rango indexadas.
+    """
+    consulta = select(*COLUMNAS_RESUMEN).where(_filtro_telefono(phone))
+    return await _pagina_resumen(db, consulta, cursor, limit)
+
+@router.get("/stats")
+async def get_stats(
+    days: int = Query(30, ge=1, le=366),
+    top: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_async_db),
+):
+    """KPIs del dashboard desde las tablas de rollup (sin recorrer calls/interactions)"""
+    return _json(await resumen_estadisticas(db, days=days, top=top))
+
+@router.get("/cache/stats")
+def get_cache_stats():
+    """Contadores de los caches de respuestas, embeddings de consulta y audio,
+    y la fracción de turnos que el router de intenciones responde sin Gemini"""
+    return {
+        "answers": answer_cache.stats(),
+        "embeddings": embedding_cache.stats(),
+        "audio": audio_cache.stats(),
+        "intent_router": intent_router.stats(),
+    }
 
 @router.get("/openapi.yaml", tags=["Documentacion"])
 def get_openapi_yaml(request: Request):
@@ -36,4 +308,4 @@ def get_openapi_yaml(request: Request):
     openapi_dict = request.app.openapi()
     yaml_str = yaml.safe_dump(openapi_dict, sort_keys=False, allow_unicode=True)
     headers = {"Content-Disposition": 'attachment; filename="openapi.yaml"'}
-    return Response(content=yaml_str, media_type="application/x-yaml", headers=headers)
\ No newline at end of file
+    return Response(content=yaml_str, media_type="application/x-yaml", headers=headers)
@@ -0,0 +1,41 @@
+"""
+Pruebas del pool HTTP de LLMClient (sin red): python -m pytest test_llm_client.py
+"""
+from google.generativeai import client as genai_client
+
+from llm_client import LLMClient, configurar_gemini
+
+
+def _sesion():
+    return genai_client.get_default_generative_client()._transport._session
+
+
+def test_pool_https_dimensionado(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    configurar_gemini()
+    cliente = LLMClient(max_concurrency=32)
+    cliente._ajustar_pool_http()
+    assert _sesion().get_adapter("https://generativelanguage.googleapis.com")._pool_maxsize == 32
+    cliente.shutdown()
+
+
+def test_pool_se_reajusta_tras_configure(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    cliente = LLMClient(max_concurrency=16)
+    configurar_gemini()
+    cliente._ajustar_pool_http()
+    # genai.configure() descarta los clientes y su sesión
+    configurar_gemini()
+    cliente._ajustar_pool_http()
+    assert _sesion().get_adapter("https://generativelanguage.googleapis.com")._pool_maxsize == 16
+    cliente.shutdown()
+
+
+def test_pool_http_para_gemini_base_url(monkeypatch):
+    monkeypatch.setenv("GEMINI_API_KEY", "test")
+    monkeypatch.setenv("GEMINI_BASE_URL", "http://127.0.0.1:8100")
+    configurar_gemini()
+    cliente = LLMClient(max_concurrency=64)
+    cliente._ajustar_pool_http()
+    assert _sesion().get_adapter("http://127.0.0.1:8100")._pool_maxsize == 64
+    cliente.shutdown()
@@ -0,0 +1,13 @@
+"""
+Normalización de texto en español compartida por caches, BM25 y enrutado.
+"""
+import re
+import unicodedata
+
+
+def normalizar_texto(texto: str) -> str:
+    """Minúsculas, sin acentos, sin puntuación y con espacios colapsados"""
+    texto = unicodedata.normalize("NFKD", texto.casefold())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s]", " ", texto)
+    return " ".join(texto.split())
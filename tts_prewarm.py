@@ -0,0 +1,128 @@
+"""
+Pre-generación de audios a partir del historial de llamadas.
+
+Además de los mensajes fijos (COMMON_MESSAGES y respuestas del router de
+intenciones), se sintetizan las respuestas de la IA más repetidas en los
+últimos PREWARM_LOOKBACK_DAYS días, para que tras un deploy la primera
+llamada que las necesite ya encuentre el MP3 en disco. Corre al arrancar y
+cada PREWARM_INTERVAL segundos:
+
+- se omiten los textos que ya están en disco (sin gastar cuota); su último
+  acceso se renueva, así la limpieza por AUDIO_CACHE_MAX_AGE no los borra
+  mientras sigan entre los frecuentes (con PREWARM_INTERVAL menor que esa edad)
+- hasta PREWARM_CONCURRENCY síntesis simultáneas, para no competir con las
+  llamadas en curso por el límite de concurrencia de ElevenLabs
+- presupuesto de PREWARM_CHAR_BUDGET caracteres por corrida (ElevenLabs
+  cobra por carácter); los textos que no caben esperan a la siguiente
+- tras PREWARM_MAX_ERRORS fallos (p. ej. cuota agotada) se aborta la corrida
+"""
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import func, select
+
+import models
+from audio_cache import audio_cache, hash_texto
+
+PREWARM_TOP_N = int(os.getenv("PREWARM_TOP_N", "50"))
+PREWARM_MIN_COUNT = int(os.getenv("PREWARM_MIN_COUNT", "2"))
+PREWARM_LOOKBACK_DAYS = int(os.getenv("PREWARM_LOOKBACK_DAYS", "30"))
+PREWARM_CONCURRENCY = int(os.getenv("PREWARM_CONCURRENCY", "3"))
+PREWARM_CHAR_BUDGET = int(os.getenv("PREWARM_CHAR_BUDGET", "20000"))
+PREWARM_MAX_ERRORS = int(os.getenv("PREWARM_MAX_ERRORS", "3"))
+# 0 = solo al arrancar
+PREWARM_INTERVAL = int(os.getenv("PREWARM_INTERVAL", "21600"))
+
+
+async def respuestas_frecuentes(
+    db,
+    top: int = PREWARM_TOP_N,
+    dias: int = PREWARM_LOOKBACK_DAYS,
+    minimo: int = PREWARM_MIN_COUNT,
+) -> list[tuple[str, int]]:
+    """(respuesta, veces) de las respuestas de la IA más repetidas"""
+    desde = datetime.now(timezone.utc) - timedelta(days=dias)
+    veces = func.count().label("veces")
+    consulta = (
+        select(models.Interaction.ai_text, veces)
+        .where(models.Interaction.created_at >= desde, models.Interaction.ai_text.is_not(None))
+        .group_by(models.Interaction.ai_text)
+        .having(func.count() >= minimo)
+        .order_by(veces.desc())
+        .limit(top)
+    )
+    return [(texto, n) for texto, n in (await db.execute(consulta)).all() if texto.strip()]
+
+
+async def precalentar(
+    textos: list[str],
+    sintetizar: Callable[[str], Awaitable[Optional[str]]],
+    concurrencia: int = PREWARM_CONCURRENCY,
+    presupuesto: int = PREWARM_CHAR_BUDGET,
+    max_errores: int = PREWARM_MAX_ERRORS,
+) -> dict:
+    """Sintetiza en orden de prioridad los textos que no están en disco.
+
+    `sintetizar` devuelve la URL del audio o None si falló (como generar_audio).
+    """
+    stats = {"candidates": 0, "on_disk": 0, "synthesized": 0, "errors": 0, "over_budget": 0, "chars": 0}
+    pendientes = []
+    for texto in dict.fromkeys(textos):
+        stats["candidates"] += 1
+        if audio_cache.refrescar(hash_texto(texto)):
+            stats["on_disk"] += 1
+        elif stats["chars"] + len(texto) > presupuesto:
+            stats["over_budget"] += 1
+        else:
+            stats["chars"] += len(texto)
+            pendientes.append(texto)
+
+    semaforo = asyncio.Semaphore(concurrencia)
+    abortar = asyncio.Event()
+
+    async def _uno(texto: str):
+        async with semaforo:
+            if abortar.is_set():
+                return
+            try:
+                ok = await sintetizar(texto) is not None
+            except Exception as e:
+                print(f"  ✗ Error: {texto[:30]}... - {e}")
+                ok = False
+            if ok:
+                stats["synthesized"] += 1
+                return
+            stats["errors"] += 1
+            if stats["errors"] >= max_errores and not abortar.is_set():
+                print(f"⚠️ Pre-warming abortado tras {stats['errors']} errores (¿cuota de ElevenLabs?)")
+                abortar.set()
+
+    await asyncio.gather(*(_uno(t) for t in pendientes))
+    return stats
+
+
+async def ciclo_precalentamiento(
+    fijos: list[str],
+    sintetizar: Callable[[str], Awaitable[Optional[str]]],
+    session_factory,
+    intervalo: int = PREWARM_INTERVAL,
+):
+    """Mensajes fijos + respuestas frecuentes del historial, al arrancar y periódicamente"""
+    while True:
+        frecuentes: list[tuple[str, int]] = []
+        try:
+            async with session_factory() as db:
+                frecuentes = await respuestas_frecuentes(db)
+        except Exception as e:
+            print(f"⚠️ No se pudo leer el historial para pre-warming: {e}")
+
+        print(f"⚡ Pre-generando audios en background ({len(fijos)} fijos, {len(frecuentes)} del historial)...")
+        stats = await precalentar(fijos + [texto for texto, _ in frecuentes], sintetizar)
+        print(f"✅ Pre-warming completado: {stats['synthesized']} generados, {stats['on_disk']} ya en disco, "
+              f"{stats['over_budget']} fuera de presupuesto, {stats['errors']} errores ({stats['chars']} caracteres)")
+
+        if intervalo <= 0:
+            return
+        await asyncio.sleep(intervalo)
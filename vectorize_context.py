@@ -1,83 +1,222 @@
 """
 Script para vectorizar el contexto de ORISOD Enzyme usando Gemini Embeddings y ChromaDB
+(también exporta el índice numpy que usa RETRIEVER_BACKEND=numpy)
+
+Re-vectorización incremental:
+- cada chunk lleva un hash de su título y contenido; solo se piden a Gemini
+  los embeddings de chunks nuevos o modificados, el resto se reutiliza del
+  índice activo
+- los embeddings se piden en lotes (VECTORIZE_BATCH_SIZE) con hasta
+  VECTORIZE_CONCURRENCY lotes en paralelo
+- la nueva versión (colección `orisod_knowledge_v<fecha>_<n>` y directorio
+  ./vector_index/v<fecha>_<n>) se construye al lado de la activa, sin los chunks
+  eliminados, y se activa cambiando un puntero de forma atómica; main.py la
+  detecta por kb_version.txt y recarga el retriever sin reiniciar
+- se conservan VECTORIZE_KEEP_VERSIONS versiones (la activa y las anteriores,
+  que aún pueden estar abiertas por workers que no han recargado)
+
+    python vectorize_context.py          # incremental
+    python vectorize_context.py --full   # re-embeber todo
 """
+import argparse
+import json
 import os
-import chromadb
-from chromadb.config import Settings
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
 import google.generativeai as genai
+import numpy as np
 from dotenv import load_dotenv
 
+from chunking import cargar_chunks, hash_chunk
+from llm_client import EMBEDDING_MODEL, configurar_gemini
+from retrieval import (
+    CHROMA_PATH,
+    CHROMA_POINTER,
+    COLLECTION_NAME,
+    NUMPY_POINTER,
+    VECTOR_INDEX_DIR,
+    coleccion_activa,
+    guardar_indice_numpy,
+    indice_activo,
+    publicar_puntero,
+)
+
 load_dotenv()
 
-# Configurar Gemini
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-
-# Leer el contexto
-with open("contexto_orisod.txt", "r", encoding="utf-8") as f:
-    contenido = f.read()
-
-# Dividir en chunks por secciones
-# Usamos los títulos numerados como separadores
-chunks = []
-current_chunk = ""
-current_title = ""
-
-for line in contenido.split('\n'):
-    # Detectar títulos principales (números al inicio)
-    if line.strip() and (line[0].isdigit() or line.startswith('##')):
-        if current_chunk:
-            chunks.append({
-                "title": current_title,
-                "content": current_chunk.strip()
-            })
-        current_title = line.strip()
-        current_chunk = line + "\n"
-    else:
-        current_chunk += line + "\n"
-
-# Agregar el último chunk
-if current_chunk:
-    chunks.append({
-        "title": current_title,
-        "content": current_chunk.strip()
-    })
-
-print(f"📚 Dividido en {len(chunks)} chunks")
-
-# Crear cliente de ChromaDB
-client = chromadb.PersistentClient(path="./chroma_db")
-
-# Crear o resetear la colección
-try:
-    client.delete_collection("orisod_knowledge")
-except:
-    pass
-
-collection = client.create_collection(
-    name="orisod_knowledge",
-    metadata={"description": "Conocimiento sobre ORISOD Enzyme"}
-)
+# Gemini acepta hasta 100 textos por batchEmbedContents
+BATCH_SIZE = int(os.getenv("VECTORIZE_BATCH_SIZE", "100"))
+CONCURRENCY = int(os.getenv("VECTORIZE_CONCURRENCY", "4"))
+KEEP_VERSIONS = max(2, int(os.getenv("VECTORIZE_KEEP_VERSIONS", "2")))
+MAX_RETRIES = 3
+KB_VERSION_FILE = os.path.join(CHROMA_PATH, "kb_version.txt")
+
+
+def _chunks_de(directorio: str) -> list[dict]:
+    try:
+        with open(os.path.join(directorio, "chunks.json"), "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def embeddings_previos(index_dir: str = VECTOR_INDEX_DIR) -> dict[str, list[float]]:
+    """Embeddings del índice numpy activo por hash de chunk (vacío si no hay)"""
+    directorio = indice_activo(index_dir)
+    chunks = _chunks_de(directorio)
+    try:
+        matrix = np.load(os.path.join(directorio, "embeddings.npy"))
+    except (OSError, ValueError):
+        return {}
+    if len(chunks) != matrix.shape[0]:
+        return {}
+    # Índices anteriores sin hash guardado se recalculan desde el texto
+    return {chunk.get("hash") or hash_chunk(chunk): matrix[i].tolist() for i, chunk in enumerate(chunks)}
+
+
+def _embeber_lote(textos: list[str]) -> list[list[float]]:
+    for intento in range(MAX_RETRIES):
+        try:
+            result = genai.embed_content(
+                model=EMBEDDING_MODEL,
+                content=textos,
+                task_type="retrieval_document"
+            )
+            return result["embedding"]
+        except Exception as e:
+            if intento == MAX_RETRIES - 1:
+                raise
+            espera = 2 ** intento
+            print(f"⚠️ Error embebiendo lote ({e}); reintentando en {espera}s")
+            time.sleep(espera)
+
+
+def embeber(textos: list[str]) -> list[list[float]]:
+    """Embeddings en lotes, con hasta CONCURRENCY peticiones simultáneas"""
+    lotes = [textos[i:i + BATCH_SIZE] for i in range(0, len(textos), BATCH_SIZE)]
+    with ThreadPoolExecutor(max_workers=CONCURRENCY) as pool:
+        resultados = list(pool.map(_embeber_lote, lotes))
+    return [embedding for lote in resultados for embedding in lote]
+
+
+def _versiones_chroma(client) -> list[str]:
+    # chromadb >= 0.6 devuelve nombres; versiones anteriores, objetos Collection
+    nombres = [getattr(c, "name", c) for c in client.list_collections()]
+    return sorted(n for n in nombres if n == COLLECTION_NAME or n.startswith(f"{COLLECTION_NAME}_v"))
+
+
+def publicar_chroma(chunks: list[dict], embeddings: list[list[float]], version: str):
+    import chromadb
 
-# Generar embeddings con Gemini y agregar a ChromaDB
-print("⚡ Generando embeddings con Gemini...")
-for i, chunk in enumerate(chunks):
-    # Gemini genera embeddings automáticamente si usamos el modelo de embeddings
-    result = genai.embed_content(
-        model="models/text-embedding-004",
-        content=chunk["content"],
-        task_type="retrieval_document"
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    nombre = f"{COLLECTION_NAME}_{version}"
+    collection = client.create_collection(
+        name=nombre,
+        metadata={"description": "Conocimiento sobre ORISOD Enzyme"}
     )
-    
-    embedding = result['embedding']
-    
-    collection.add(
-        ids=[f"chunk_{i}"],
-        embeddings=[embedding],
-        documents=[chunk["content"]],
-        metadatas=[{"title": chunk["title"]}]
+    for i in range(0, len(chunks), BATCH_SIZE):
+        lote = chunks[i:i + BATCH_SIZE]
+        collection.add(
+            ids=[c["id"] for c in lote],
+            embeddings=embeddings[i:i + BATCH_SIZE],
+            documents=[c["content"] for c in lote],
+            metadatas=[
+                {"title": c["title"], "section": c.get("section", ""), "parent": c.get("parent", ""), "hash": c["hash"]}
+                for c in lote
+            ]
+        )
+    publicar_puntero(CHROMA_PATH, CHROMA_POINTER, nombre)
+
+    # La colección sin versión (layout original) ordena antes que las versionadas
+    for viejo in _versiones_chroma(client)[:-KEEP_VERSIONS]:
+        client.delete_collection(viejo)
+        print(f"🗑️ Colección eliminada: {viejo}")
+
+
+def nueva_version() -> str:
+    """Reserva un nombre de versión libre: v<fecha>_<n>, con n para no chocar
+    dentro del mismo segundo (el mkdir atómico reserva el directorio numpy).
+
+    El ancho fijo mantiene el orden alfabético igual al cronológico (la
+    limpieza de versiones viejas depende de eso).
+    """
+    fecha = time.strftime("v%Y%m%d%H%M%S")
+    n = 0
+    while True:
+        version = f"{fecha}_{n:02d}"
+        try:
+            os.mkdir(os.path.join(VECTOR_INDEX_DIR, version))
+            return version
+        except FileExistsError:
+            n += 1
+
+
+def publicar_numpy(chunks: list[dict], embeddings: list[list[float]], version: str):
+    guardar_indice_numpy(chunks, embeddings, os.path.join(VECTOR_INDEX_DIR, version))
+    publicar_puntero(VECTOR_INDEX_DIR, NUMPY_POINTER, version)
+
+    versiones = sorted(
+        d for d in os.listdir(VECTOR_INDEX_DIR)
+        if d.startswith("v") and os.path.isdir(os.path.join(VECTOR_INDEX_DIR, d))
     )
-    print(f"  ✓ Chunk {i+1}/{len(chunks)}: {chunk['title'][:50]}...")
+    for viejo in versiones[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(VECTOR_INDEX_DIR, viejo), ignore_errors=True)
+        print(f"🗑️ Índice numpy eliminado: {viejo}")
+
+
+def vectorizar(path: str = "contexto_orisod.txt", completo: bool = False):
+    # Configurar Gemini (REST; GEMINI_BASE_URL opcional)
+    configurar_gemini()
+
+    # Dividir en chunks por secciones
+    # Usamos los títulos numerados como separadores
+    chunks = cargar_chunks(path)
+    print(f"📚 Dividido en {len(chunks)} chunks")
+
+    previos = {} if completo else embeddings_previos()
+    hashes = [c["hash"] for c in chunks]
+    if previos and hashes == [c.get("hash") for c in _chunks_de(indice_activo())]:
+        print("✅ Sin cambios en la base de conocimiento; el índice activo sigue vigente")
+        return
+
+    pendientes = list(dict.fromkeys(h for h in hashes if h not in previos))
+    eliminados = len(set(previos) - set(hashes))
+    print(f"🔁 Reutilizados: {len(chunks) - sum(h not in previos for h in hashes)} | "
+          f"nuevos o modificados: {len(pendientes)} | eliminados: {eliminados}")
+
+    # Generar solo los embeddings que faltan
+    if pendientes:
+        print(f"⚡ Generando {len(pendientes)} embeddings con Gemini "
+              f"(lotes de {BATCH_SIZE}, {CONCURRENCY} en paralelo)...")
+        texto_por_hash = {c["hash"]: c["content"] for c in chunks}
+        inicio = time.perf_counter()
+        nuevos = embeber([texto_por_hash[h] for h in pendientes])
+        previos.update(zip(pendientes, nuevos))
+        print(f"  ✓ {len(nuevos)} embeddings en {time.perf_counter() - inicio:.1f}s")
+    embeddings = [previos[h] for h in hashes]
+
+    # Construir la nueva versión al lado de la activa y cambiar el puntero
+    os.makedirs(CHROMA_PATH, exist_ok=True)
+    os.makedirs(VECTOR_INDEX_DIR, exist_ok=True)
+    version = nueva_version()
+    publicar_numpy(chunks, embeddings, version)
+    try:
+        publicar_chroma(chunks, embeddings, version)
+    except ImportError:
+        print("⚠️ chromadb no instalado: solo se publicó el índice numpy")
+
+    # Marcar la nueva versión: main.py recarga el retriever e invalida su cache de respuestas
+    publicar_puntero(CHROMA_PATH, os.path.basename(KB_VERSION_FILE), str(time.time()))
+
+    print("✅ Vectorización completada!")
+    print(f"📊 Versión {version}: colección {coleccion_activa()} y {indice_activo()}")
+    print(f"📝 Total de chunks: {len(chunks)}")
+
 
-print("✅ Vectorización completada!")
-print(f"📊 Base de datos guardada en ./chroma_db")
-print(f"📝 Total de chunks: {len(chunks)}")
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Vectoriza contexto_orisod.txt (incremental)")
+    parser.add_argument("--context", default="contexto_orisod.txt")
+    parser.add_argument("--full", action="store_true", help="Ignorar el índice activo y re-embeber todo")
+    args = parser.parse_args()
+    vectorizar(args.context, completo=args.full)